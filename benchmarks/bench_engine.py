@@ -0,0 +1,115 @@
+"""Measure the overhead of the PLAMS job engine in a set of typical scenarios and save the results as JSON.
+
+Every scenario runs *n* instances of :class:`~fakejob.FakeJob` (directly or as children of nested |MultiJob| instances) and reports the throughput (jobs per second, including |finish|) and the latency of jobs (time between calling |run| and the end of |postrun|). The scenarios are:
+
+*   ``serial`` -- serial |JobRunner|,
+*   ``parallel`` -- parallel |JobRunner| with a worker pool of *maxjobs* threads,
+*   ``multijob`` -- the same, with jobs grouped in a two-level tree of multijobs with *width* children each,
+*   ``hashing`` -- |RPM| enabled, all jobs different,
+*   ``rerun`` -- |RPM| enabled, all jobs identical, so all but the first one are copied (copied jobs don't call |postrun|, so their latency is not reported),
+*   ``pickling`` -- |pickling| enabled,
+*   ``cleaning`` -- |cleaning| of job folders with ``keep`` and ``save`` lists.
+
+Example usage::
+
+    python benchmarks/bench_engine.py -n 1000 10000 --output engine.json
+
+Every scenario and number of jobs is executed in a separate Python process, so their peak RSS is reported independently. Results of different versions of PLAMS can be compared by running the benchmark with the same arguments and comparing the JSON files.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from fakejob import FakeJob, Environment, Timer, peak_rss
+from scm.plams import MultiJob, JobRunner
+
+
+class LatencyJob(FakeJob):
+    """A :class:`~fakejob.FakeJob` remembering the moment of the end of its |postrun| as ``finished``."""
+    def postrun(self):
+        self.finished = time.perf_counter()
+
+
+def leaves(top):
+    if isinstance(top, MultiJob):
+        return [leaf for child in top.children for leaf in leaves(child)]
+    return [top]
+
+
+def scenario(name, n, maxjobs, width, sleep):
+    """Run the scenario *name* with *n* jobs and return a dictionary with the results."""
+    env = {'hashing': name in ['hashing', 'rerun'] and 'input', 'pickle': name == 'pickling'}
+    if name == 'cleaning':
+        env.update(keep=['$JN.out', '$JN.err'], save=['$JN.out'])
+    if name == 'serial':
+        jr = JobRunner(parallel=False)
+    else:
+        jr = JobRunner(parallel=True, maxjobs=maxjobs, maxthreads=maxjobs)
+
+    with Environment(**env) as e:
+        jobs = [LatencyJob(name='fake', sleep=sleep) for i in range(n)]
+        for i, job in enumerate(jobs):
+            job.settings.input.seed = 0 if name == 'rerun' else i
+        if name == 'multijob':
+            groups = [jobs[i:i+width] for i in range(0, n, width)]
+            inner = [MultiJob(name='inner', children=g) for g in groups]
+            top = [MultiJob(name='outer', children=inner[i:i+width]) for i in range(0, len(inner), width)]
+        else:
+            top = jobs
+        started = {}
+        with Timer() as t:
+            for job in top:
+                for leaf in leaves(job):
+                    started[id(leaf)] = time.perf_counter()
+                job.run(jobrunner=jr)
+            for job in top:
+                job.results.wait()
+        latencies = [1000*(job.finished - started[id(job)]) for job in jobs if hasattr(job, 'finished')]
+        copied = sum(job.status == 'copied' for job in jobs)
+    total = t.elapsed + e.finish_time
+    latencies.sort()
+    return {'scenario': name, 'jobs': n, 'sleep': sleep, 'maxjobs': maxjobs if name != 'serial' else 1,
+            'time_s': t.elapsed, 'finish_s': e.finish_time, 'throughput_jobs_per_s': n/total,
+            'latency_ms': {'mean': statistics.mean(latencies), 'p50': latencies[len(latencies)//2], 'p95': latencies[int(0.95*(len(latencies)-1))], 'max': latencies[-1]} if latencies else None,
+            'copied': copied, 'peak_rss_mb': peak_rss()}
+
+
+SCENARIOS = ['serial', 'parallel', 'multijob', 'hashing', 'rerun', 'pickling', 'cleaning']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, nargs='+', default=[1000], help='numbers of jobs (for example: 1000 10000 100000)')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--maxjobs', type=int, default=8, help='number of simultaneously executed jobs for parallel scenarios')
+    parser.add_argument('--width', type=int, default=10, help='number of children of each MultiJob in the multijob scenario')
+    parser.add_argument('--sleep', type=float, default=0, help='duration of each job in seconds')
+    parser.add_argument('--output', default='bench_engine.json', help='JSON file with the results')
+    parser.add_argument('--single', nargs=2, metavar=('SCENARIO', 'N'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(scenario(args.single[0], int(args.single[1]), args.maxjobs, args.width, args.sleep)))
+        sys.exit(0)
+
+    results = []
+    print('{:>10} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('scenario', 'jobs', 'time [s]', 'jobs/s', 'p50 [ms]', 'p95 [ms]', 'RSS [MB]'))
+    for n in args.n:
+        for name in args.scenarios:
+            cmd = [sys.executable, __file__, '--single', name, str(n), '--maxjobs', str(args.maxjobs), '--width', str(args.width), '--sleep', str(args.sleep)]
+            out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+            r = json.loads(out.stdout.decode().splitlines()[-1])
+            results.append(r)
+            lat = r['latency_ms'] or {'p50': float('nan'), 'p95': float('nan')}
+            print('{:>10} {:>8} {:>10.2f} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.1f}'.format(name, n, r['time_s'] + r['finish_s'], r['throughput_jobs_per_s'], lat['p50'], lat['p95'], r['peak_rss_mb']))
+
+    meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'arguments': vars(args)}
+    with open(args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print('Results saved to {}'.format(args.output))
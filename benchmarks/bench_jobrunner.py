@@ -0,0 +1,51 @@
+"""Compare the thread-per-job |JobRunner| with the worker pool mode (*maxthreads*).
+
+Each variant is executed in a separate Python process, so that the peak RSS reported for it is not polluted by other variants. Example usage::
+
+    python benchmarks/bench_jobrunner.py -n 10000 --maxjobs 8 --maxthreads 8
+
+With ``--sleep 0`` jobs finish about as fast as they are started and the two variants behave similarly. With jobs lasting longer than submitting them (for example ``--sleep 0.05``) the thread-per-job variant accumulates one parked thread per queued job.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import threading
+
+from fakejob import FakeJob, Environment, Timer, peak_rss
+from scm.plams import JobRunner
+
+
+def run_variant(n, maxjobs, maxthreads, sleep):
+    peak_threads = 0
+    jr = JobRunner(parallel=True, maxjobs=maxjobs, maxthreads=maxthreads)
+    with Environment():
+        with Timer() as t:
+            jobs = [FakeJob(name='fake', sleep=sleep) for i in range(n)]
+            for job in jobs:
+                job.run(jobrunner=jr)
+                peak_threads = max(peak_threads, threading.active_count())
+            for job in jobs:
+                job.results.wait()
+    return {'jobs': n, 'sleep': sleep, 'maxjobs': maxjobs, 'maxthreads': maxthreads, 'time': t.elapsed, 'per_job_ms': 1000*t.elapsed/n, 'peak_threads': peak_threads, 'peak_rss_mb': peak_rss()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=10000, help='number of jobs')
+    parser.add_argument('--maxjobs', type=int, default=8)
+    parser.add_argument('--maxthreads', type=int, default=8, help='size of the worker pool in the pooled variant')
+    parser.add_argument('--sleep', type=float, default=0, help='duration of each job in seconds')
+    parser.add_argument('--variant', choices=['threads', 'pool'], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        maxthreads = args.maxthreads if args.variant == 'pool' else 0
+        print(json.dumps(run_variant(args.n, args.maxjobs, maxthreads, args.sleep)))
+    else:
+        print('{:>8} {:>8} {:>10} {:>10} {:>12} {:>14}'.format('variant', 'jobs', 'time [s]', 'ms/job', 'max threads', 'peak RSS [MB]'))
+        for variant in ['threads', 'pool']:
+            out = subprocess.run([sys.executable, __file__, '-n', str(args.n), '--maxjobs', str(args.maxjobs), '--maxthreads', str(args.maxthreads), '--sleep', str(args.sleep), '--variant', variant], stdout=subprocess.PIPE, check=True)
+            r = json.loads(out.stdout.decode().splitlines()[-1])
+            print('{:>8} {:>8} {:>10.2f} {:>10.3f} {:>12} {:>14.1f}'.format(variant, r['jobs'], r['time'], r['per_job_ms'], r['peak_threads'], r['peak_rss_mb']))
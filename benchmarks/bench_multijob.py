@@ -0,0 +1,34 @@
+"""Measure the wall time of nested |MultiJob| trees with many fast children.
+
+The tree has *depth* levels of multijobs, every multijob has *width* children and the leaves are instances of :class:`~fakejob.FakeJob`. Any latency added by |MultiJob| on top of its children accumulates with every level of the tree. Example usage::
+
+    python benchmarks/bench_multijob.py --depth 3 --width 4
+"""
+
+import argparse
+
+from fakejob import FakeJob, Environment, Timer
+from scm.plams import MultiJob, JobRunner
+
+
+def tree(depth, width, sleep):
+    if depth == 0:
+        return FakeJob(name='leaf', sleep=sleep)
+    return MultiJob(name='level{}'.format(depth), children=[tree(depth-1, width, sleep) for i in range(width)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--depth', type=int, default=3, help='number of nested MultiJob levels')
+    parser.add_argument('--width', type=int, default=4, help='number of children of each MultiJob')
+    parser.add_argument('--sleep', type=float, default=0, help='duration of each leaf job in seconds')
+    parser.add_argument('--maxjobs', type=int, default=8)
+    args = parser.parse_args()
+
+    print('{:>10} {:>8} {:>10}'.format('runner', 'leaves', 'time [s]'))
+    for name, jr in [('serial', JobRunner(parallel=False)), ('parallel', JobRunner(parallel=True, maxjobs=args.maxjobs))]:
+        with Environment():
+            top = tree(args.depth, args.width, args.sleep)
+            with Timer() as t:
+                top.run(jobrunner=jr).wait()
+        print('{:>10} {:>8} {:>10.2f}'.format(name, args.width**args.depth, t.elapsed))
@@ -0,0 +1,46 @@
+"""Measure the overhead of calling |Results| methods, which are all guarded by :func:`~scm.plams.core.results._restrict`.
+
+A trivial method of a |Results| subclass (similar to :meth:`~scm.plams.interfaces.adfsuite.scmjob.SCMResults.readkf` reading an already cached value) is called many times from |postrun|, where the job is *finished* and the access is privileged, and after the job is *successful*. Example usage::
+
+    python benchmarks/bench_results.py -n 100000
+"""
+
+import argparse
+
+from fakejob import FakeJob, Environment, Timer
+from scm.plams import Results
+
+
+class CachedResults(Results):
+    def value(self, key):
+        return key
+
+
+class CachedJob(FakeJob):
+    _result_type = CachedResults
+
+    def __init__(self, calls, **kwargs):
+        FakeJob.__init__(self, **kwargs)
+        self.calls = calls
+
+    def postrun(self):
+        with Timer() as t:
+            for i in range(self.calls):
+                self.results.value(i)
+        self.postrun_time = t.elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=100000, help='number of calls')
+    args = parser.parse_args()
+
+    with Environment():
+        job = CachedJob(calls=args.n, name='cached')
+        job.run().wait()
+        with Timer() as t:
+            for i in range(args.n):
+                job.results.value(i)
+    print('{:>12} {:>10} {:>12}'.format('status', 'calls', 'us/call'))
+    print('{:>12} {:>10} {:>12.2f}'.format('finished', args.n, 1e6*job.postrun_time/args.n))
+    print('{:>12} {:>10} {:>12.2f}'.format('successful', args.n, 1e6*t.elapsed/args.n))
@@ -0,0 +1,79 @@
+"""Common elements of PLAMS benchmarks.
+
+The benchmarks in this folder measure the overhead of PLAMS itself, so they use :class:`FakeJob`, a trivial |SingleJob| whose runscript does nothing (or just sleeps). No external programs are needed to run them. Benchmarks are regular scripts that should be executed with a Python interpreter able to import ``scm.plams``, for example::
+
+    python benchmarks/bench_jobrunner.py -n 10000
+"""
+
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from scm.plams import SingleJob, config, init, finish
+
+
+class FakeJob(SingleJob):
+    """A |SingleJob| with an empty input file and a runscript consisting of a single ``true`` command (or ``sleep``, if *sleep* is a positive number of seconds).
+
+    The input contains ``settings.input.seed``, so jobs can be made distinguishable for |RPM| by setting different seeds.
+    """
+    def __init__(self, sleep=0, **kwargs):
+        SingleJob.__init__(self, **kwargs)
+        self.sleep = sleep
+
+    def get_input(self):
+        return 'seed {}\n'.format(self.settings.input.seed)
+
+    def get_runscript(self):
+        return 'sleep {}\n'.format(self.sleep) if self.sleep else 'true\n'
+
+
+
+class Environment:
+    """Context manager initializing PLAMS in a temporary folder and erasing it afterwards.
+
+    Log output is silenced and |RPM| and |pickling| are disabled unless *hashing* or *pickle* say otherwise. If *keep* or *save* are given, they are used as ``config.job.keep`` and ``config.job.save`` (see |cleaning|). The wall time of |finish| is stored as ``finish_time``.
+    """
+    def __init__(self, hashing=False, pickle=False, keep='all', save='all'):
+        self.hashing = hashing
+        self.pickle = pickle
+        self.keep = keep
+        self.save = save
+
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='plams_bench_')
+        init(path=self.path)
+        config.log.stdout = 0
+        config.log.file = 0
+        config.jobmanager.hashing = self.hashing
+        config.job.pickle = self.pickle
+        config.job.keep = self.keep
+        config.job.save = self.save
+        return self
+
+    def __exit__(self, *args):
+        with Timer() as t:
+            finish()
+        self.finish_time = t.elapsed
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+
+class Timer:
+    """Context manager measuring the wall time of its body. The result, in seconds, is stored as ``elapsed``."""
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
+
+
+
+def peak_rss():
+    """Return the peak resident set size of the current process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    return rss / 2**20 if os.uname().sysname == 'Darwin' else rss / 2**10
@@ -1,8 +1,14 @@
+import asyncio
+import gzip
+import itertools
+import json
 import os
 import stat
 import threading
 import time
 
+import numpy as np
+
 try:
     import dill as pickle
 except ImportError:
@@ -13,8 +19,9 @@ from os.path import join as opj
 from .errors import FileError, JobError, PlamsError, ResultsError
 from .functions import config, log
 from .private import sha256
-from .results import Results
+from .results import Results, _privileged
 from .settings import Settings
+from .tracing import _tracer
 from ..mol.molecule import Molecule
 
 __all__ = ['SingleJob', 'MultiJob']
@@ -31,6 +38,7 @@ class Job:
 
     *   :meth:`~Job.check`
     *   :meth:`~Job.hash` (see |RPM|)
+    *   :meth:`~Job.dependencies`
     *   |prerun| and |postrun| (see :ref:`prerun-postrun`)
 
     All other methods should remain unchanged.
@@ -93,29 +101,71 @@ class Job:
 
             This method does not do too much by itself. After some initial preparation it passes control to the job runner, which decides if a new thread should be started for this job. The role of the job runner is to execute three methods that make the full job life cycle: :meth:`~Job._prepare`, :meth:`~Job._execute` and :meth:`~Job._finalize`. During :meth:`~Job._execute` the job runner is called once again to execute the runscript (only in case of |SingleJob|).
         """
-        if self.status != 'created':
-            raise JobError('Trying to run previously started job {}'.format(self.name))
+        self._start(kwargs)
 
-        self.status = 'started'
-        self._log_status(1)
+        jobrunner = jobrunner or config.default_jobrunner
+        jobmanager = jobmanager or config.default_jobmanager
 
-        self.settings.run.soft_update(Settings(kwargs))
+        jobrunner._run_job(self, jobmanager)
+        return self.results
+
+
+    async def arun(self, jobrunner=None, jobmanager=None, **kwargs):
+        """Asynchronous counterpart of |run| meant to be awaited in asyncio coroutines. Returned value is the |Results| instance associated with this job, available when the job is done.
+
+        To avoid blocking the event loop, *jobrunner* (or ``config.default_jobrunner``, if ``None``) should be an instance of :class:`~scm.plams.core.jobrunner.AsyncJobRunner`. Any other job runner is used exactly like in |run|, followed by awaiting :meth:`~scm.plams.core.results.Results.await_done`. Keep in mind that a serial job runner executes the whole job in the thread running the event loop.
+
+        .. warning::
+
+            This method should **not** be overridden.
+        """
+        self._start(kwargs)
 
         jobrunner = jobrunner or config.default_jobrunner
         jobmanager = jobmanager or config.default_jobmanager
 
-        jobrunner._run_job(self, jobmanager)
+        if hasattr(jobrunner, '_arun_job'):
+            await jobrunner._arun_job(self, jobmanager)
+        else:
+            jobrunner._run_job(self, jobmanager)
+            await self.results.await_done()
         return self.results
 
 
+    def _start(self, runflags):
+        """Mark this job as started and store *runflags* (a dictionary of |run| keyword arguments) in the ``run`` branch of its settings."""
+        if self.status != 'created':
+            raise JobError('Trying to run previously started job {}'.format(self.name))
+
+        self.status = 'started'
+        self._log_status(1)
+        _tracer.start(self, 'pending')
+
+        self.settings.run.soft_update(Settings(runflags))
+
+
     def pickle(self, filename=None):
-        """Pickle this instance and save to a file indicated by *filename*. If ``None``, save to ``[jobname].dill`` in the job folder."""
+        """Pickle this instance and save to a file indicated by *filename*. If ``None``, save to ``[jobname].dill`` in the job folder. A small metadata sidecar with the same name followed by ``.json`` is saved next to it (see :meth:`_metadata`). If ``compact_pickle`` in ``settings`` is ``True``, the file is compressed with :mod:`gzip`."""
         filename = filename or opj(self.path, self.name+'.dill')
-        with open(filename, 'wb') as f:
+        opener = gzip.open if self.settings.get('compact_pickle') else open
+        with _tracer.span(self, 'pickle'), opener(filename, 'wb') as f:
             try:
                 pickle.dump(self, f, -1)
             except:
                 log('Pickling of {} failed'.format(self.name), 1)
+                return
+        try:
+            with open(filename+'.json', 'w') as f:
+                json.dump(self._metadata(), f)
+        except Exception as e:
+            log('Saving metadata of {} failed: {}'.format(self.name, e), 1)
+
+
+    def _metadata(self):
+        """Return a dictionary with basic information about this instance: name, status, class, hash and the hashing method used to obtain it. It is stored in a sidecar file by :meth:`pickle` and used by |load_all| in the lazy mode to create job stubs without unpickling."""
+        cls = self.__class__
+        return {'name': self.name, 'status': self.status, 'class': cls.__module__+'.'+cls.__qualname__,
+                'hashing': self.jobmanager.settings.hashing if self.jobmanager else config.jobmanager.hashing, 'hash': self.hash()}
 
 
     def ok(self, strict=True):
@@ -141,6 +191,31 @@ class Job:
         raise PlamsError('Trying to run an abstract method Job.hash()')
 
 
+    def dependencies(self):
+        """Return a list of jobs this job depends on.
+
+        Apart from explicit dependencies listed in ``depend``, every |Job| or |Results| instance present as a value in the ``input`` branch of settings (also inside lists and tuples) is considered a dependency. That covers, for example, restart files given as |Results| of previous jobs. Restart files given as plain paths (strings) to files in folders of other jobs are not recognized, such dependencies should be listed in ``depend``.
+
+        The returned list is used by job runners with scheduling enabled (see |JobRunner|) to build the dependency graph of pending jobs. It does not affect the order in which the job life cycle is carried out. This method can be overridden in subclasses that have other kinds of dependencies.
+        """
+        ret = []
+        def collect(value):
+            if isinstance(value, Settings):
+                for v in value.values():
+                    collect(v)
+            elif isinstance(value, (list, tuple)):
+                for v in value:
+                    collect(v)
+            elif isinstance(value, (Job, Results)):
+                job = value if isinstance(value, Job) else value.job
+                if job is not None and job is not self and all(job is not j for j in ret):
+                    ret.append(job)
+
+        collect(list(self.depend))
+        collect(self.settings.input)
+        return ret
+
+
     def prerun(self):
         """Actions to take before the actual job execution.
 
@@ -164,32 +239,39 @@ class Job:
         """Prepare the job for execution. This method collects steps 1-7 from :ref:`job-life-cycle`. Should not be overridden. Returned value indicates if job execution should continue (|RPM| did not find this job as previously run)."""
 
         log('Starting {}._prepare()'.format(self.name), 7)
+        _tracer.stop(self, 'pending')
 
         log('Resolving {}.depend'.format(self.name), 7)
         if config.preview is False:
-            for j in self.depend:
-                j.results.wait()
+            with _tracer.span(self, 'depend'):
+                for j in self.depend:
+                    j.results.wait()
         log('{}.depend resolved'.format(self.name), 7)
 
-        jobmanager._register(self)
+        with _tracer.span(self, 'register'):
+            jobmanager._register(self)
 
         log('Starting {}.prerun()'.format(self.name), 5)
-        self.prerun()
+        with _tracer.span(self, 'prerun'):
+            self.prerun()
         log('{}.prerun() finished'.format(self.name), 5)
 
         for i in reversed(self.default_settings):
             self.settings.soft_update(i)
 
-        prev = jobmanager._check_hash(self)
+        self._hashcache = {}
+        with _tracer.span(self, 'hash'):
+            prev = jobmanager._check_hash(self)
         if prev is not None:
             try:
-                prev.results._copy_to(self.results)
+                with _tracer.span(self, 'copy'):
+                    prev.results._copy_to(self.results)
                 self.status = 'copied'
             except ResultsError as re:
                 log('Copying results of {} failed because of the following error: {}'.format(prev.name, str(re)), 1)
                 self.status = prev.status
             if self.settings.pickle:
-                self.pickle()
+                jobmanager._pickle(self, store_hash=False)
             self.results.finished.set()
             self.results.done.set()
             if self.parent and self in self.parent:
@@ -197,7 +279,8 @@ class Job:
         else:
             self.status = 'running'
             log('Starting {}._get_ready()'.format(self.name), 7)
-            self._get_ready()
+            with _tracer.span(self, 'get_ready'):
+                self._get_ready()
             log('{}._get_ready() finished'.format(self.name), 7)
 
         log('{}._prepare() finished'.format(self.name), 7)
@@ -215,27 +298,40 @@ class Job:
         raise PlamsError('Trying to run an abstract method Job._execute()')
 
 
+    async def _aexecute(self, jobrunner):
+        """Execute the job using an :class:`~scm.plams.core.jobrunner.AsyncJobRunner`. Abstract method."""
+        raise PlamsError('Trying to run an abstract method Job._aexecute()')
+
+
     def _finalize(self):
         """Gather the results of the job execution and organize them. This method collects steps 9-12 from :ref:`job-life-cycle`. Should not be overridden."""
         log('Starting {}._finalize()'.format(self.name), 7)
 
         if config.preview is False:
             log('Collecting results of {}'.format(self.name), 7)
-            self.results.collect()
+            with _tracer.span(self, 'collect'):
+                self.results.collect()
             self.results.finished.set()
             if self.status != 'crashed':
                 self.status = 'finished'
                 self._log_status(3)
-                if self.check():
+                with _tracer.span(self, 'check'), _privileged(self):
+                    ok = self.check()
+                if ok:
                     log('{}.check() success. Cleaning results with keep = {}'.format(self.name, self.settings.keep), 7)
-                    self.results._clean(self.settings.keep)
+                    with _tracer.span(self, 'clean'):
+                        self.results._clean(self.settings.keep)
                     log('Starting {}.postrun()'.format(self.name), 5)
-                    self.postrun()
+                    with _tracer.span(self, 'postrun'), _privileged(self):
+                        self.postrun()
                     log('{}.postrun() finished'.format(self.name), 5)
                     self.status = 'successful'
                     log('Pickling {}'.format(self.name), 7)
                     if self.settings.pickle:
-                        self.pickle()
+                        if self.jobmanager:
+                            self.jobmanager._pickle(self)
+                        else:
+                            self.pickle()
                 else:
                     log('{}.check() failed'.format(self.name), 7)
                     self.status = 'failed'
@@ -254,15 +350,25 @@ class Job:
     def __getstate__(self):
         """Prepare this job instance for pickling.
 
-        Attributes ``jobmanager``, ``parent``, ``default_settings`` and ``_lock`` are removed, as well as all attributes listed in ``self._dont_pickle``.
+        Attributes ``jobmanager``, ``parent``, ``default_settings``, ``_lock``, ``_phase`` and ``_hashcache`` are removed, as well as all attributes listed in ``self._dont_pickle``. Hashes of a loaded job are therefore always calculated anew, with the current hashing methods.
         """
-        remove = ['jobmanager', 'parent', 'default_settings', '_lock'] + self._dont_pickle
+        remove = ['jobmanager', 'parent', 'default_settings', '_lock', '_phase', '_hashcache'] + self._dont_pickle
         return {k:v for k,v in self.__dict__.items() if k not in remove}
 
 
     def _log_status(self, level):
-        """Log the status of this instance on a chosen log *level*. The message is uppercased to clearly stand out among other log entries."""
-        log('JOB {} {}'.format(self.name, self.status.upper()), level)
+        """Log the status of this instance on a chosen log *level*. The message is uppercased to clearly stand out among other log entries. The status is also recorded in the journal of the job manager, if it keeps one.
+
+        The previously logged status and the time elapsed since it was logged are passed to |log| as the life-cycle ``phase`` that has just ended and its ``duration`` (in seconds).
+        """
+        now = time.perf_counter()
+        data = {}
+        if getattr(self, '_phase', None):
+            data = {'phase': self._phase[0], 'duration': round(now - self._phase[1], 6)}
+        self._phase = (self.status, now)
+        log('JOB {} {}'.format(self.name, self.status.upper()), level, job=self.name, status=self.status, **data)
+        if self.jobmanager and self.jobmanager.journal:
+            self.jobmanager.journal.record(self, 'status', status=self.status)
 
 
 #===========================================================================
@@ -279,6 +385,8 @@ class SingleJob(Job):
 
         _filenames = {'inp':'$JN.in', 'run':'$JN.run', 'out':'$JN.out', 'err': '$JN.err'}
 
+    After the runscript is executed, the ``usage`` attribute stores a |Settings| instance describing resources used by the runscript (exit code, wall time, CPU time, maximum resident memory), if the job runner was able to determine them (see :meth:`~scm.plams.core.jobrunner.GridRunner.resource_usage`). Otherwise it is ``None``.
+
     This class defines no new methods that could be directly called in your script. Methods that can and should be overridden are |get_input| and |get_runscript|.
 
     """
@@ -287,6 +395,7 @@ class SingleJob(Job):
     def __init__(self, molecule=None, **kwargs):
         Job.__init__(self, **kwargs)
         self.molecule = molecule.copy() if isinstance(molecule, Molecule) else molecule
+        self.usage = None
 
 
     def get_input(self):
@@ -325,6 +434,98 @@ class SingleJob(Job):
         return sha256(self.full_runscript())
 
 
+    def hash_normalized(self, precision=None):
+        """Calculate SHA256 hash of the class of this job, the ``input`` branch of its settings and its ``molecule``, instead of the text of the input file.
+
+        Floating point numbers (also these given as strings) are rounded to *precision* decimal places (``hash_precision`` in |JobManager| settings by default), so jobs with inputs differing only in the formatting of numbers or in the numerical noise in coordinates get the same hash. Jobs and |Results| present as values in ``settings.input`` are replaced with normalized hashes of corresponding jobs.
+        """
+        if precision is None:
+            precision = self._hash_settings().get('hash_precision', 6)
+        cls = self.__class__
+        return sha256('\n'.join([cls.__module__+'.'+cls.__qualname__, _canonical(self.settings.input, precision), _canonical(self.molecule, precision)]))
+
+
+    def hash_fuzzy(self, tolerance=None, precision=None):
+        """Calculate SHA256 hash of this job that does not depend on displacements of atoms much smaller than *tolerance* (``fuzzy_tolerance`` in |JobManager| settings by default, in angstroms).
+
+        The hash combines :meth:`fuzzy_fingerprint` with coordinates of atoms (and lattice vectors) rounded to the nearest multiple of *tolerance*. Geometries differing by less than *tolerance* can still be rounded differently, so the job manager additionally compares geometries of jobs with the same fingerprint directly (see |RPM|).
+        """
+        if tolerance is None:
+            tolerance = self._hash_settings().get('fuzzy_tolerance', 1e-4)
+        fingerprint, labels, coords = self.fuzzy_fingerprint(precision)
+        grid = np.round(coords / tolerance).astype(np.int64).tolist()
+        return sha256(fingerprint + '\n' + repr(list(zip(labels, map(tuple, grid)))))
+
+
+    def fuzzy_fingerprint(self, precision=None):
+        """Return a tuple ``(fingerprint, labels, coords)`` describing this job for the ``fuzzy`` hashing mode.
+
+        *fingerprint* is SHA256 hash of the class of this job, the ``input`` branch of its settings (normalized like in :meth:`hash_normalized`), the list of *labels* (in the order of atoms) and bonds between them, as well as properties of molecules. Every atom is labelled with its symbol and its normalized properties, lattice vectors are labelled with their indices. If ``molecule`` is a dictionary of molecules, labels are prefixed with keys of that dictionary. *coords* is a numpy array with coordinates of all the labelled atoms and lattice vectors, in the order of *labels*.
+
+        Like hashes (see :meth:`_hash_part`), the returned value is remembered and reused after the job is prepared by |run|.
+        """
+        if precision is None:
+            precision = self._hash_settings().get('hash_precision', 6)
+        key = 'fingerprint:{}'.format(precision)
+        cache = self.__dict__.get('_hashcache')
+        if cache is not None and key in cache:
+            return cache[key]
+        ret = self._fuzzy_fingerprint(precision)
+        if cache is not None:
+            cache[key] = ret
+        return ret
+
+
+    def _fuzzy_fingerprint(self, precision):
+        molecules = self.molecule if isinstance(self.molecule, dict) else {'': self.molecule}
+        labels, coords, bonds, other = [], [], [], []
+        for key, mol in sorted(molecules.items(), key=lambda x: str(x[0])):
+            prefix = '{}:'.format(key) if key != '' else ''
+            if not isinstance(mol, Molecule):
+                other.append(prefix + _canonical(mol, precision))
+                continue
+            atoms = [prefix + atom.symbol + _canonical(atom.properties, precision) for atom in mol.atoms]
+            index = {id(atom): label for atom, label in zip(mol.atoms, atoms)}
+            bonds += [sorted([index[id(b.atom1)], index[id(b.atom2)]]) + [b.order] for b in mol.bonds]
+            other.append(prefix + _canonical(mol.properties, precision))
+            labels += atoms + ['{}lattice{}'.format(prefix, i) for i in range(len(mol.lattice))]
+            coords += [atom.coords for atom in mol.atoms] + [tuple(vec) for vec in mol.lattice]
+        cls = self.__class__
+        fingerprint = sha256('\n'.join([cls.__module__+'.'+cls.__qualname__, _canonical(self.settings.input, precision), repr(labels), _canonical(sorted(bonds), precision)] + other))
+        return fingerprint, labels, np.array(coords, dtype=float).reshape(-1, 3)
+
+
+    def _hash_settings(self):
+        return self.jobmanager.settings if self.jobmanager else config.jobmanager
+
+
+    def _hash_part(self, part):
+        """Return the hash of *part* of this job: ``'input'``, ``'runscript'``, ``'normalized'`` or ``'fuzzy'`` (calculated with :meth:`hash_input`, :meth:`hash_runscript`, :meth:`hash_normalized` or :meth:`hash_fuzzy`). After the job is prepared by |run|, its settings can no longer affect the hash, so the calculated value is remembered and reused."""
+        settings = self._hash_settings()
+        precision = settings.get('hash_precision', 6)
+        tolerance = settings.get('fuzzy_tolerance', 1e-4)
+        if part == 'normalized':
+            key = '{}:{}'.format(part, precision)
+        elif part == 'fuzzy':
+            key = '{}:{}:{}'.format(part, precision, tolerance)
+        else:
+            key = part
+        cache = self.__dict__.get('_hashcache')
+        if cache is not None and key in cache:
+            return cache[key]
+        if part == 'input':
+            ret = self.hash_input()
+        elif part == 'runscript':
+            ret = self.hash_runscript()
+        elif part == 'normalized':
+            ret = self.hash_normalized(precision)
+        else:
+            ret = self.hash_fuzzy(tolerance, precision)
+        if cache is not None:
+            cache[key] = ret
+        return ret
+
+
     def hash(self):
         """Calculate unique hash of this instance.
 
@@ -338,24 +539,31 @@ class SingleJob(Job):
         *   ``input`` -- returns the hash of the input file.
         *   ``runscript`` -- returns the hash of the runscript.
         *   ``input+runscript`` -- returns SHA256 hash of the concatenation of **hashes** of input and runscript.
-        """
-        if self.jobmanager:
-            mode = self.jobmanager.settings.hashing
-        else:
-            mode = config.jobmanager.hashing
+        *   ``normalized`` -- returns the hash of settings and the molecule with rounded numbers, see :meth:`~SingleJob.hash_normalized`.
+        *   ``fuzzy`` -- returns the hash of settings and the molecule, independent of the order of atoms and of small displacements of atoms, see :meth:`~SingleJob.hash_fuzzy`.
 
+        Once the job has been prepared by |run|, hashes are remembered, so calling this method again is cheap.
+        """
+        mode = self._hash_settings().hashing
         if not mode:
             return None
-        if mode == 'input':
-            return self.hash_input()
-        elif mode == 'runscript':
-            return self.hash_runscript()
+        if mode in ['input', 'runscript', 'normalized', 'fuzzy']:
+            return self._hash_part(mode)
         elif mode == 'input+runscript':
-            return sha256(self.hash_input() + self.hash_runscript())
+            return sha256(self._hash_part('input') + self._hash_part('runscript'))
         else:
             raise PlamsError('Unsupported hashing method: {}'.format(mode))
 
 
+    def _metadata(self):
+        """Extend :meth:`Job._metadata` with the data returned by :meth:`fuzzy_fingerprint` (and the precision used to obtain it) stored under ``fuzzy`` key, if the job manager of this job uses the ``fuzzy`` hashing method. That way stubs of jobs loaded lazily take part in the fuzzy |RPM|. The fingerprint calculated during |run| is reused, so the geometry is not processed again."""
+        meta = Job._metadata(self)
+        if self.jobmanager and self.jobmanager.settings.hashing == 'fuzzy' and meta['hash'] is not None:
+            fingerprint, labels, coords = self.fuzzy_fingerprint()
+            meta['fuzzy'] = {'fingerprint': fingerprint, 'labels': labels, 'coords': coords.tolist(), 'precision': self._hash_settings().get('hash_precision', 6)}
+        return meta
+
+
     def check(self):
         """Check if the calculation was successful.
 
@@ -405,13 +613,41 @@ class SingleJob(Job):
         log('Starting {}._execute()'.format(self.name), 7)
         if config.preview is False:
             o = self._filename('out') if not self.settings.runscript.stdout_redirect else None
+            begin = time.perf_counter()
             retcode = jobrunner.call(runscript=self._filename('run'), workdir=self.path, out=o, err=self._filename('err'), runflags=self.settings.run)
+            self.usage = jobrunner.resource_usage(self.path)
+            self._trace_call(begin, time.perf_counter())
             if retcode != 0:
                 log('WARNING: Job {} finished with nonzero return code'.format(self.name), 3)
                 self.status = 'crashed'
         log('{}._execute() finished'.format(self.name), 7)
 
 
+    async def _aexecute(self, jobrunner):
+        """Asynchronous counterpart of :meth:`~SingleJob._execute`. The runscript is executed with :meth:`~scm.plams.core.jobrunner.AsyncJobRunner.acall` of *jobrunner*."""
+        log('Starting {}._aexecute()'.format(self.name), 7)
+        if config.preview is False:
+            o = self._filename('out') if not self.settings.runscript.stdout_redirect else None
+            begin = time.perf_counter()
+            retcode = await jobrunner.acall(runscript=self._filename('run'), workdir=self.path, out=o, err=self._filename('err'), runflags=self.settings.run)
+            self.usage = jobrunner.resource_usage(self.path)
+            self._trace_call(begin, time.perf_counter())
+            if retcode != 0:
+                log('WARNING: Job {} finished with nonzero return code'.format(self.name), 3)
+                self.status = 'crashed'
+        log('{}._aexecute() finished'.format(self.name), 7)
+
+
+    def _trace_call(self, begin, end):
+        """Record the execution of the runscript between *begin* and *end* with the tracer (see :class:`~scm.plams.core.tracing._Tracer`). If its wall time is known from ``usage`` (see :meth:`~scm.plams.core.jobrunner.GridRunner.resource_usage`), the time spent waiting in the queue is recorded separately as ``queued``, followed by ``running``. Otherwise the whole execution is recorded as ``call``."""
+        if self.usage and self.usage.get('walltime') is not None:
+            start = max(begin, end - self.usage.walltime)
+            _tracer.add(self, 'queued', begin, start)
+            _tracer.add(self, 'running', start, end)
+        else:
+            _tracer.add(self, 'call', begin, end)
+
+
     def _filename(self, t):
         """Return filename for file of type *t*. *t* can be any key from ``_filenames`` dictionary. ``$JN`` is replaced with job name in the returned string."""
         return self._filenames[t].replace('$JN', self.name)
@@ -495,14 +731,14 @@ class MultiJob(Job):
 
     The job folder of a multijob gets cleaned independently of its children. See |cleaning| for details.
 
-    Private attributes ``_active_children`` and ``_lock`` are essential for proper parallel execution. Please do not modify them.
+    Private attributes ``_active_children`` and ``_lock`` are essential for proper parallel execution. Please do not modify them. ``_lock`` is a :class:`threading.Condition` notified every time a child job finishes.
     """
     def __init__(self, children=None, childrunner=None, **kwargs):
         Job.__init__(self, **kwargs)
         self.children = [] if children is None else children
         self.childrunner = childrunner
         self._active_children = 0
-        self._lock =  threading.Lock()
+        self._lock = threading.Condition()
 
 
     def new_children(self):
@@ -528,6 +764,13 @@ class MultiJob(Job):
         return all([child.ok() for child in self])
 
 
+    def _metadata(self):
+        """Extend :meth:`Job._metadata` with metadata of all children and other jobs (see :meth:`other_jobs`) stored under ``children`` key."""
+        meta = Job._metadata(self)
+        meta['children'] = [job._metadata() for job in itertools.chain(self, self.other_jobs())]
+        return meta
+
+
     def other_jobs(self):
         """Iterate through other jobs that belong to this |MultiJob|, but are not in ``children``.
 
@@ -557,10 +800,11 @@ class MultiJob(Job):
     def _notify(self):
         """Notify this job that one of its children has finished.
 
-        Decrement ``_active_children`` by one. Use ``_lock`` to ensure thread safety.
+        Decrement ``_active_children`` by one and wake up the thread waiting in :meth:`~MultiJob._execute`. Use ``_lock`` to ensure thread safety.
         """
         with self._lock:
             self._active_children -= 1
+            self._lock.notify_all()
 
 
     def _execute(self, jobrunner):
@@ -591,6 +835,106 @@ class MultiJob(Job):
 
             new = self.new_children()
 
-        while self._active_children > 0:
-            time.sleep(config.sleepstep)
+        with self._lock:
+            self._lock.wait_for(lambda: self._active_children <= 0)
         log('{}._execute() finished'.format(self.name), 7)
+
+
+    async def _aexecute(self, jobrunner):
+        """Asynchronous counterpart of :meth:`~MultiJob._execute`. All children are run with :meth:`~Job.arun` and awaited concurrently.
+
+        Unlike in :meth:`~MultiJob._execute`, all previously started children are awaited before each call of :meth:`~MultiJob.new_children`, so that the latter can safely access their results without blocking the event loop.
+        """
+        log('Starting {}._aexecute()'.format(self.name), 7)
+        jr = self.childrunner or jobrunner
+
+        await asyncio.gather(*[child.arun(jobrunner=jr, jobmanager=self.jobmanager, **self.settings.run) for child in self])
+
+        new = self.new_children()
+        while new:
+            with self._lock:
+                self._active_children += len(new)
+
+            if isinstance(new, dict) and isinstance(self.children, dict):
+                self.children.update(new)
+                it = new.values()
+            elif isinstance(new, list) and isinstance(self.children, list):
+                self.children += new
+                it = new
+            else:
+                raise JobError("ERROR in job {}: 'new_children' returned a value incompatible with 'children'".format(self.name))
+
+            for child in it:
+                child.parent = self
+            await asyncio.gather(*[child.arun(jobrunner=jr, jobmanager=self.jobmanager, **self.settings.run) for child in it])
+
+            new = self.new_children()
+        log('{}._aexecute() finished'.format(self.name), 7)
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+def _canonical(value, precision):
+    """Return a string representing *value* for :meth:`SingleJob.hash_normalized`. Floating point numbers, and strings that can be converted to them, are rounded to *precision* decimal places. Keys of dictionaries and |Settings| are sorted. Molecules are represented by element symbols, coordinates and properties of atoms, bonds, the lattice and molecular properties."""
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    if isinstance(value, int) and abs(value) >= 2**53:
+        return repr(value)
+    if isinstance(value, (int, float)):
+        value = round(float(value), precision)
+        return repr(value + 0.0)
+    if isinstance(value, str):
+        try:
+            return _canonical(float(value), precision)
+        except ValueError:
+            return repr(value)
+    if isinstance(value, dict):
+        return '{' + ','.join('{}:{}'.format(repr(k), _canonical(v, precision)) for k, v in sorted(value.items(), key=lambda x: str(x[0]))) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_canonical(v, precision) for v in value) + ']'
+    if isinstance(value, Molecule):
+        index = {id(atom): i for i, atom in enumerate(value.atoms)}
+        atoms = [[atom.symbol, list(atom.coords), atom.properties] for atom in value.atoms]
+        bonds = sorted([sorted([index[id(b.atom1)], index[id(b.atom2)]]) + [b.order] for b in value.bonds])
+        return 'Molecule' + _canonical([atoms, bonds, value.lattice, value.properties], precision)
+    if isinstance(value, Results):
+        value = value.job
+    if isinstance(value, SingleJob):
+        return 'Job:' + value._hash_part('normalized')
+    if isinstance(value, Job):
+        return 'Job:' + repr(value.name)
+    if hasattr(value, 'tolist'):
+        return _canonical(value.tolist(), precision)
+    if hasattr(value, 'path') and isinstance(value.path, str):
+        return repr(value.path)
+    return repr(value)
+
+
+def _fuzzy_cells(coords, tolerance):
+    """Return a list of keys of cells of the grid used by |JobManager| to find geometries that can be the same as *coords* up to *tolerance* (see :func:`_same_geometry`). The first key is the cell of *coords* itself, followed by all its neighbours.
+
+    Cells are defined by the centroid of all points and their mean distance from it. If every point is displaced by at most *tolerance* along each axis, the centroid moves by at most *tolerance* along each axis and the mean distance changes by at most ``2*sqrt(3)*tolerance``, so matching geometries always lie in neighbouring cells.
+    """
+    if len(coords) == 0:
+        return [()]
+    center = coords.mean(axis=0)
+    spread = np.linalg.norm(coords - center, axis=1).mean()
+    steps = [tolerance] * 3 + [2 * np.sqrt(3) * tolerance]
+    cell = [int(np.floor(x / step)) for x, step in zip(list(center) + [spread], steps)]
+    shifts = sorted(itertools.product((-1, 0, 1), repeat=len(cell)), key=lambda shift: any(shift))
+    return [tuple(c + d for c, d in zip(cell, shift)) for shift in shifts]
+
+
+def _same_geometry(labels1, coords1, labels2, coords2, tolerance):
+    """Check if two lists of labelled points (as returned by :meth:`SingleJob.fuzzy_fingerprint`) are the same, with points in the same order and every point displaced by at most *tolerance* along each axis.
+
+    Geometries with atoms in a different order are never considered the same, since results of the matching job (gradients, charges, etc.) would not be in the order of atoms of the new job.
+    """
+    if list(labels1) != list(labels2) or np.shape(coords1) != np.shape(coords2):
+        return False
+    return bool(np.all(np.abs(np.asarray(coords1) - np.asarray(coords2)) <= tolerance))
@@ -1,4 +1,7 @@
+import atexit
+import json
 import os
+import queue
 import re
 import shutil
 import sys
@@ -6,6 +9,7 @@ import threading
 import time
 import types
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Dict, NoReturn
 
 from os.path import join as opj
@@ -71,18 +75,33 @@ def finish(otherJM=None):
 
     This function must be called at the end of your script for |cleaning| to take place. See |master-script| for details.
 
+    If ``config.trace`` is ``True``, the time spent by all jobs in each phase of their life cycle is summarized in the log and saved to ``trace.json`` in the main working folder (see :class:`~scm.plams.core.tracing._Tracer`).
+
     If you used some other job managers than just the default one, they need to be passed as *otherJM* list.
     """
-    for thread in threading.enumerate():
-        if thread.name == 'plamsthread':
+    #threads started by JobRunner can start other threads (for example worker threads of a pool), so keep joining until none is left
+    current = threading.current_thread()
+    threads = [t for t in threading.enumerate() if t.name == 'plamsthread' and t is not current]
+    while threads:
+        for thread in threads:
             thread.join()
+        threads = [t for t in threading.enumerate() if t.name == 'plamsthread' and t is not current]
 
     config.default_jobmanager._clean()
     if otherJM:
         for jm in otherJM:
             jm._clean()
+    from .tracing import _tracer
+    if _tracer.events:
+        tracefile = opj(config.default_jobmanager.workdir, 'trace.json')
+        _tracer.export(tracefile)
+        log(_tracer.summary(), 3)
+        log('Trace of the job life cycle saved to {}'.format(tracefile), 3)
+        _tracer.clear()
+
     log('PLAMS environment cleaned up successfully', 5)
     log('PLAMS run finished. Goodbye', 3)
+    _logwriter.flush()
 
     if config.erase_workdir is True:
         shutil.rmtree(config.default_jobmanager.workdir)
@@ -99,7 +118,7 @@ def load(filename):
 #===========================================================================
 
 
-def load_all(path, jobmanager=None):
+def load_all(path, jobmanager=None, lazy=False):
     """Load all jobs from *path*.
 
     This function works as multiple executions of |load_job|. It searches for ``.dill`` files inside the directory given by *path*, yet not directly in it, but one level deeper. In other words, all files matching ``path/*/*.dill`` are used. That way a path to the main working folder of a previously run script can be used to import all the jobs run by that script.
@@ -108,21 +127,38 @@ def load_all(path, jobmanager=None):
 
     The purpose of this function is to provide a quick way of restarting a script. Loading all successful jobs from the previous run prevents double work and allows the new execution of the script to proceed directly to the place where the previous execution failed.
 
+    If *lazy* is ``True``, jobs are not unpickled. Instead, lightweight stubs are created in parallel from metadata sidecars saved next to ``.dill`` files (see :meth:`~scm.plams.core.jobmanager.JobManager.load_job_lazy`). Stubs are sufficient for |RPM| and each of them loads the full job when it is used for the first time, so restarting a script that ran many jobs is much faster. Jobs without a metadata sidecar (pickled by older versions of PLAMS) are loaded in the normal way. If *path* contains a journal (see |JobManager|), it is replayed with :meth:`~scm.plams.core.jobmanager.JobManager.replay_journal` instead of searching for ``.dill`` files, which also reattaches to jobs that were still in the queue when the previous run ended.
+
     Jobs are loaded using default job manager stored in ``config.default_jobmanager``. If you wish to use a different one you can pass it as *jobmanager* argument of this function.
 
-    Returned value is a dictionary containing all loaded jobs as values and absolute paths to ``.dill`` files as keys.
+    Returned value is a dictionary containing all loaded jobs (or their stubs) as values and absolute paths to ``.dill`` files as keys.
     """
     jm = jobmanager or config.default_jobmanager
+    if lazy:
+        replayed = jm.replay_journal(path)
+        if replayed is not None:
+            return replayed
+    filenames = list(_find_dills(path))
+    stubs = [None] * len(filenames)
+    if lazy:
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+            stubs = list(executor.map(jm.load_job_lazy, filenames))
     loaded_jobs = {}
+    for filename, stub in zip(filenames, stubs):
+        job = stub or jm.load_job(filename)
+        if job:
+            loaded_jobs[filename] = job
+    return loaded_jobs
+
+
+def _find_dills(path):
+    """Generate absolute paths to ``.dill`` files that should be loaded by |load_all| from *path*."""
     for foldername in filter(lambda x: isdir(opj(path,x)), os.listdir(path)):
         maybedill = opj(path,foldername,foldername+'.dill')
         if isfile(maybedill):
-            job = jm.load_job(maybedill)
-            if job:
-                loaded_jobs[os.path.abspath(maybedill)] = job
+            yield os.path.abspath(maybedill)
         else:
-            loaded_jobs.update(load_all(path=opj(path,foldername), jobmanager=jm))
-    return loaded_jobs
+            yield from _find_dills(opj(path,foldername))
 
 
 #===========================================================================
@@ -153,16 +189,88 @@ def read_molecules(folder, formats=None):
 
 
 _stdlock = threading.Lock()
-_filelock = threading.Lock()
 
-def log(message, level=0):
+
+class _LogWriter:
+    """Background thread appending log messages to logfiles.
+
+    Messages are put in a queue with :meth:`write` and the thread writes them in batches of up to ``batchsize`` lines, keeping files open and flushing them after every batch. The thread is started when needed and it exits (closing all files) after ``idle`` seconds without messages. :meth:`flush` waits until all queued messages are written.
+    """
+    batchsize = 1000
+    idle = 1.0
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+    def write(self, filename, line):
+        """Schedule appending *line* to *filename*."""
+        self._queue.put((filename, line))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(name='plamslogger', target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+
+
+    def flush(self):
+        """Wait until all scheduled messages are written."""
+        self._queue.join()
+
+
+    def _loop(self):
+        files = {}
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle)]
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        for f in files.values():
+                            f.close()
+                        self._thread = None
+                        return
+                continue
+            while len(batch) < self.batchsize:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = {}
+            for filename, line in batch:
+                lines.setdefault(filename, []).append(line)
+            for filename, chunk in lines.items():
+                try:
+                    if filename not in files:
+                        files[filename] = open(filename, 'a')
+                    files[filename].write(''.join(chunk))
+                    files[filename].flush()
+                except OSError:
+                    files.pop(filename, None)
+            for item in batch:
+                self._queue.task_done()
+
+
+_logwriter = _LogWriter()
+atexit.register(_logwriter.flush)
+
+def log(message, level=0, **data):
     """Log *message* with verbosity *level*.
 
     Logs are printed independently to the text logfile (a file called ``logfile`` in the main working folder) and to the standard output. If *level* is equal or lower than verbosity (defined by ``config.log.file`` or ``config.log.stdout``) the message is printed. Date and/or time can be added based on ``config.log.date`` and ``config.log.time``. All logging activity is thread safe.
+
+    Messages are written to the logfile by a background thread, so logging does not block the calling thread on file operations. If ``config.log.json`` is ``True``, every line of the logfile is a JSON object with the time, the level and the message, extended with optional keyword arguments *data* (for example, the name of the job the message concerns). Otherwise *data* is ignored.
     """
     if 'log' in config:
         if level <= config.log.file or level <= config.log.stdout:
             message = str(message)
+            tofile = level <= config.log.file and 'default_jobmanager' in config
+            if tofile and config.log.get('json'):
+                entry = dict(data, time=time.strftime('%Y-%m-%dT%H:%M:%S'), level=level, message=message)
+                _logwriter.write(config.default_jobmanager.logfile, json.dumps(entry, default=str) + '\n')
+                tofile = False
             prefix = ''
             if config.log.date:
                 prefix += '%d.%m|'
@@ -174,9 +282,8 @@ def log(message, level=0):
             if level <= config.log.stdout:
                 with _stdlock:
                     print(message)
-            if level <= config.log.file and 'default_jobmanager' in config:
-                with _filelock, open(config.default_jobmanager.logfile, 'a') as f:
-                    f.write(message + '\n')
+            if tofile:
+                _logwriter.write(config.default_jobmanager.logfile, message + '\n')
 
 
 #===========================================================================
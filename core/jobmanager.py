@@ -1,13 +1,28 @@
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import itertools
+import json
 import os
+import queue
+import shutil
+import sqlite3
+import stat
 import threading
+import time
+
+import numpy as np
+
 try:
     import dill as pickle
 except ImportError:
     import pickle
 
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join as opj
 
-from .basejob import MultiJob
+from .basejob import MultiJob, _fuzzy_cells, _same_geometry
 from .errors import PlamsError, FileError
 from .functions import config, log
 
@@ -38,6 +53,18 @@ class JobManager:
     *   ``hashing`` -- chosen hashing method (see |RPM|).
     *   ``counter_len`` -- length of number appended to the job name in case of a name conflict.
     *   ``remove_empty_directories`` -- if ``True``, all empty subdirectories of the working folder are removed on |finish|.
+    *   ``hash_index`` -- path to a folder with a persistent index of previously run jobs, shared between runs (optional, see below).
+    *   ``blob_store`` -- path to a folder with a content-addressed store of result files, shared between runs (optional, see below).
+    *   ``journal`` -- if ``True``, a journal of jobs is kept in the working folder (see below).
+    *   ``pickle_queue`` -- maximum number of jobs waiting to be pickled in the background (see below).
+
+    If ``hash_index`` is set, hashes of all successful jobs that were pickled are also stored in a SQLite database in that folder (see :class:`_HashIndex`), together with paths to their ``.dill`` files. When |RPM| does not find a job with the same hash among jobs known to this job manager, the index is consulted and only the matching job is loaded with :meth:`load_job`. That way results of jobs run by earlier scripts are reused without loading all of them with |load_all|.
+
+    If ``blob_store`` is set, |RPM| does not copy or hardlink files of the previous job into the folder of the new one. Instead, each file is put in a content-addressed store in that folder (see :class:`_BlobStore`) and the new job folder gets a symbolic link to it. Files of the previous job are left untouched. Identical files produced by different jobs, also in different runs, are stored only once and copying results of a job becomes a metadata-only operation.
+
+    If ``journal`` is ``True``, registration, hash, queue job ID and every status change of each job are appended to the ``journal`` file in the working folder (see :class:`_Journal`). After a crash, :meth:`replay_journal` uses it to find finished jobs and jobs still waiting in the queue without unpickling anything or scanning the whole working folder.
+
+    If ``pickle_queue`` is a positive integer, finished jobs are pickled by a background thread (see :class:`_PickleWriter`), so dependent jobs and the parent |MultiJob| do not wait for it. If more than ``pickle_queue`` jobs are waiting to be pickled, finalizing jobs wait for a free place in the queue. Since a job is pickled after it is done, changes made to it in the meantime can end up in its ``.dill`` file. If ``pickle_queue`` is 0 (the default), jobs are pickled directly in the threads finalizing them. All pending jobs are pickled before cleaning (see |cleaning|), at the latest in |finish|.
 
     """
 
@@ -47,6 +74,9 @@ class JobManager:
         self.jobs = []
         self.names = {}
         self.hashes = {}
+        self.fuzzy = {}
+        self.index = _HashIndex(settings.hash_index) if settings.get('hash_index') else None
+        self.blobs = _BlobStore(settings.blob_store) if settings.get('blob_store') else None
 
         if path is None:
             self.path = os.getcwd()
@@ -66,6 +96,8 @@ class JobManager:
         self.logfile = opj(self.workdir, 'logfile')
         self.input = opj(self.workdir, 'input')
         os.mkdir(self.workdir)
+        self.journal = _Journal(self.workdir) if settings.get('journal') else None
+        self.pickler = _PickleWriter(settings.pickle_queue) if settings.get('pickle_queue') else None
 
 
 
@@ -82,7 +114,7 @@ class JobManager:
             job.default_settings = [config.job]
             job.path = path
             if isinstance(job, MultiJob):
-                job._lock = threading.Lock()
+                job._lock = threading.Condition()
                 for child in job:
                     setstate(child, opj(path, child.name), job)
                 for otherjob in job.other_jobs():
@@ -92,6 +124,8 @@ class JobManager:
             h = job.hash()
             if h is not None:
                 self.hashes[h] = job
+                if self.settings.hashing == 'fuzzy':
+                    self._check_fuzzy(job, h, register=True)
             for key in job._dont_pickle:
                 job.__dict__[key] = None
 
@@ -101,6 +135,8 @@ class JobManager:
             raise FileError('File {} not present'.format(filename))
         path = os.path.dirname(filename)
         with open(filename, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        with (gzip.open if compressed else open)(filename, 'rb') as f:
             try:
                 job = pickle.load(f)
             except Exception as e:
@@ -112,6 +148,51 @@ class JobManager:
 
 
 
+    def load_job_lazy(self, filename):
+        """Create a lightweight stub of the job saved in *filename*, without unpickling it.
+
+        The stub (see :class:`_JobStub`) is created from the metadata sidecar saved next to *filename* by :meth:`~scm.plams.core.basejob.Job.pickle`. Hashes of the job and all its children are registered right away, so the stub is visible to |RPM|. The job itself is loaded with :meth:`load_job` only when some attribute not present in the metadata is accessed.
+
+        Returns ``None`` if the metadata sidecar is missing or unreadable.
+        """
+        try:
+            with open(filename+'.json') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return _JobStub(os.path.abspath(filename), meta, self)
+
+
+
+    def replay_journal(self, path, jobrunner=None):
+        """Replay the journal of the previous run with the main working folder *path* and return a dictionary of stubs of its jobs (see :class:`_JobStub`), with absolute paths to ``.dill`` files as keys. If *path* does not contain a journal, ``None`` is returned.
+
+        Stubs are created for jobs that finished successfully and were pickled. If *jobrunner* (by default ``config.default_jobrunner``) is a |GridRunner|, stubs are also created for jobs that were still submitted to the queueing system when the previous run ended. These jobs are reattached with :meth:`~scm.plams.core.jobrunner.GridRunner.reattach` and, when they leave the queue, loaded with |load_external| (with ``finalize=True``). Hashes of all stubs are registered, so |RPM| waits for the reattached jobs instead of running them again. Queued jobs keep writing to the folder they were submitted from, so they are not reattached if *path* is not that folder anymore (for example, after it was renamed to ``*.res`` by the ``-r`` option of the ``plams`` launcher).
+
+        The journal is read only once and its last, possibly incomplete, line is ignored, so the cost of replaying it depends only on the number of journal entries.
+        """
+        jobs = _Journal.replay(path)
+        if jobs is None:
+            return None
+        jobrunner = jobrunner or config.default_jobrunner
+        workdir = os.path.abspath(path)
+        stubs = {}
+        for rel, entry in jobs.items():
+            jobpath = opj(workdir, rel)
+            filename = opj(jobpath, entry['name']+'.dill')
+            if entry.get('status') in ['successful', 'copied'] and os.path.isfile(filename):
+                stubs[filename] = _JobStub(filename, entry, self)
+            elif entry.get('status') == 'running' and 'jobid' in entry and hasattr(jobrunner, 'reattach'):
+                if entry.get('workdir', workdir) != workdir:
+                    log('Not reattaching to job {} submitted as {}: it was submitted from {}, which has been moved to {}, so its output will not be found there'.format(entry['name'], entry['jobid'], entry['workdir'], workdir), 3)
+                    continue
+                log('Reattaching to job {} submitted as {}'.format(entry['name'], entry['jobid']), 3)
+                stubs[filename] = _JobStub(filename, entry, self, pending=jobrunner.reattach(entry['jobid'], jobpath))
+        log('Replayed journal of {}: {} finished and {} queued jobs found'.format(path, sum(s._pending is None for s in stubs.values()), sum(s._pending is not None for s in stubs.values())), 3)
+        return stubs
+
+
+
     def remove_job(self, job):
         """Remove *job* from the job manager. Forget its hash."""
         if job in self.jobs:
@@ -156,37 +237,487 @@ class JobManager:
 
         self.jobs.append(job)
         job.status = 'registered'
+        if self.journal:
+            cls = job.__class__
+            self.journal.record(job, 'registered', name=job.name, **{'class': cls.__module__+'.'+cls.__qualname__})
         log('Job {} registered'.format(job.name), 7)
 
 
 
     def _check_hash(self, job):
-        """Calculate the hash of *job* and, if it is not ``None``, search previously run jobs for the same hash. If such a job is found, return it. Otherwise, return ``None``"""
+        """Calculate the hash of *job* and, if it is not ``None``, search previously run jobs for the same hash. If such a job is found, return it. Otherwise, return ``None``. Stubs created by :meth:`load_job_lazy` are replaced with fully loaded jobs when matched."""
         h = job.hash()
         if h is not None:
+            if self.journal:
+                self.journal.record(job, 'hash', hash=h, hashing=self.settings.hashing)
+            if isinstance(self.hashes.get(h), _JobStub):
+                self.hashes[h] = self.hashes[h].load()
+                if self.hashes[h] is None:
+                    del self.hashes[h]
             if h in self.hashes:
                 prev = self.hashes[h]
                 log('Job {} previously run as {}, using old results'.format(job.name, prev.name), 1)
                 return prev
-            else:
-                self.hashes[h] = job
+            prev = self._check_index(h)
+            if prev is not None:
+                log('Job {} previously run as {} in {}, using old results'.format(job.name, prev.name, prev.path), 1)
+                return prev
+            if self.settings.hashing == 'fuzzy':
+                prev = self._check_fuzzy(job, h, register=True)
+                if prev is not None:
+                    log('Job {} previously run as {} with a geometry within {} angstrom, using old results'.format(job.name, prev.name, self.settings.fuzzy_tolerance), 1)
+                    return prev
+            self.hashes[h] = job
+        return None
+
+
+
+    def _check_fuzzy(self, job, h, register=False):
+        """Search jobs hashed by this job manager in the ``fuzzy`` mode for a job with the same :meth:`~scm.plams.core.basejob.SingleJob.fuzzy_fingerprint` as *job* and a geometry differing by at most ``fuzzy_tolerance`` along each axis (see :func:`~scm.plams.core.basejob._same_geometry`). Return that job or ``None``. If *register* is ``True`` and no such job is found, *job* (with its hash *h*) is added to jobs searched later.
+
+        Jobs with the same fingerprint are kept in cells of a grid (see :func:`~scm.plams.core.basejob._fuzzy_cells`) and geometries are compared only with jobs in the cell of *job* and its neighbours. Matched stubs created by :meth:`load_job_lazy` are replaced with fully loaded jobs.
+        """
+        fingerprint, labels, coords = job.fuzzy_fingerprint()
+        tolerance = self.settings.get('fuzzy_tolerance', 1e-4)
+        cells = _fuzzy_cells(coords, tolerance)
+        grid = self.fuzzy.get(fingerprint, {})
+        for cell in cells:
+            for other, otherhash, otherlabels, othercoords in list(grid.get(cell, ())):
+                if self.hashes.get(otherhash) is not other:
+                    continue
+                if _same_geometry(labels, coords, otherlabels, othercoords, tolerance):
+                    if isinstance(other, _JobStub):
+                        other = other.load()
+                        if other is None:
+                            self.hashes.pop(otherhash, None)
+                            continue
+                        self.hashes[otherhash] = other
+                    return other
+        if register:
+            self._register_fuzzy(job, h, fingerprint, labels, coords, cells[0])
         return None
 
 
+    def _register_fuzzy(self, job, h, fingerprint, labels, coords, cell=None):
+        """Add *job* with hash *h* and data returned by :meth:`~scm.plams.core.basejob.SingleJob.fuzzy_fingerprint` to jobs searched by :meth:`_check_fuzzy`."""
+        if cell is None:
+            cell = _fuzzy_cells(coords, self.settings.get('fuzzy_tolerance', 1e-4))[0]
+        self.fuzzy.setdefault(fingerprint, {}).setdefault(cell, []).append((job, h, labels, coords))
+
+
+
+    def _check_index(self, h):
+        """Search the persistent hash index for a job with hash *h*. If found, load that job with :meth:`load_job` and return it. Entries pointing to jobs that do not exist any more, were not successful or have a different hash now are removed from the index."""
+        if self.index is None:
+            return None
+        filename = self.index.get(h)
+        if filename is None:
+            return None
+        prev = self.load_job(filename) if os.path.isfile(filename) else None
+        if prev is None or prev.status not in ['successful', 'copied'] or prev.hash() != h:
+            log('Removing outdated entry {} from the hash index'.format(filename), 5)
+            self.index.remove(h, filename)
+            return None
+        return prev
+
+
+
+    def _pickle(self, job, store_hash=True):
+        """Pickle *job* with :meth:`~scm.plams.core.basejob.Job.pickle`, in the background if this job manager uses a :class:`_PickleWriter`. If *store_hash* is ``True``, the hash of *job* is stored in the persistent hash index afterwards (see :meth:`_store_hash`)."""
+        if self.pickler:
+            self.pickler.put(job, self._store_hash if store_hash else None)
+        else:
+            job.pickle()
+            if store_hash:
+                self._store_hash(job)
+
+
+
+    def _store_hash(self, job):
+        """Store the hash of a successful *job* in the persistent hash index, if this job manager uses one and the ``.dill`` file of *job* exists."""
+        if self.index is None:
+            return
+        h = job.hash()
+        filename = opj(job.path, job.name+'.dill')
+        if h is not None and os.path.isfile(filename):
+            self.index.add(h, filename, job.name, job.status)
+
+
 
     def _clean(self):
-        """Clean all registered jobs according to the ``save`` parameter in their ``settings``. If ``remove_empty_directories`` is ``True``,  traverse the working directory and delete all empty subdirectories."""
+        """Clean all registered jobs according to the ``save`` parameter in their ``settings``. If ``remove_empty_directories`` is ``True``,  traverse the working directory and delete all empty subdirectories. Close the journal.
+
+        Jobs are cleaned in batches by a pool of ``clean_threads`` threads and empty subdirectories of different job folders are removed in parallel as well. Before any job is cleaned, files of copied jobs whose copying was deferred (see :meth:`~scm.plams.core.results.Results._copy_to`) are copied, so that they are not lost if their source is deleted by the cleaning of another job.
+        """
         log('Cleaning job manager', 7)
+        start = time.perf_counter()
+
+        if self.pickler:
+            self.pickler.flush()
+
+        def copy(batch):
+            for job in batch:
+                job.results._copy_pending(job.settings.save)
+
+        def clean(batch):
+            return sum(job.results._clean(job.settings.save) for job in batch)
+
+        jobs = list(self.jobs)
+        batches = [jobs[i:i+256] for i in range(0, len(jobs), 256)]
+        with ThreadPoolExecutor(max_workers=max(1, self.settings.get('clean_threads') or 1), thread_name_prefix='plamscleaner') as executor:
+            list(executor.map(copy, batches))
+            deleted = sum(executor.map(clean, batches))
+            removed = 0
+            if self.settings.remove_empty_directories and os.path.isdir(self.workdir):
+                removed = _remove_empty_dirs(self.workdir, executor)
+
+        log('Deleted {} files and {} empty directories of {} jobs in {:.3f} s'.format(deleted, removed, len(jobs), time.perf_counter() - start), 5)
+        if self.journal:
+            self.journal.close()
+        log('Job manager cleaned', 7)
 
-        for job in self.jobs:
-            job.results._clean(job.settings.save)
 
-        if self.settings.remove_empty_directories:
-            for root, dirs, files in os.walk(self.workdir, topdown=False):
-                for dirname in dirs:
-                    fullname = opj(root, dirname)
-                    if not os.listdir(fullname):
-                        os.rmdir(fullname)
 
-        log('Job manager cleaned', 7)
 
+def _remove_empty_dirs(path, executor=None):
+    """Remove all empty subdirectories of *path*, including these that become empty after removing their own subdirectories, and return their number. Symbolic links are not followed. Batches of subdirectories of *path* are processed in parallel if *executor* is given."""
+    def visit(folder):
+        removed, left = 0, 0
+        with os.scandir(folder) as it:
+            entries = list(it)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                r, empty = visit(entry.path)
+                removed += r
+                if empty:
+                    os.rmdir(entry.path)
+                    removed += 1
+                    continue
+            left += 1
+        return removed, not left
+
+    with os.scandir(path) as it:
+        subdirs = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+    def visit_batch(batch):
+        removed = 0
+        for folder in batch:
+            r, empty = visit(folder)
+            removed += r
+            if empty:
+                os.rmdir(folder)
+                removed += 1
+        return removed
+
+    batches = [subdirs[i:i+256] for i in range(0, len(subdirs), 256)]
+    return sum(executor.map(visit_batch, batches) if executor else map(visit_batch, batches))
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class _HashIndex:
+    """Persistent index of previously run jobs used by |JobManager| for |RPM| across different runs.
+
+    The index is a SQLite database ``plams_hashes.sqlite`` in the folder *path* (created if needed), with a single table mapping job hashes to paths of ``.dill`` files. The database can be safely shared by many PLAMS scripts running at the same time, also on different machines, as long as the filesystem supports file locking. A single connection is shared by all threads of a job manager, guarded by a lock.
+    """
+    def __init__(self, path):
+        path = os.path.expanduser(path)
+        os.makedirs(path, exist_ok=True)
+        self.filename = opj(path, 'plams_hashes.sqlite')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.filename, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS jobs (hash TEXT PRIMARY KEY, path TEXT NOT NULL, name TEXT, status TEXT, time REAL)')
+
+
+    def get(self, h):
+        """Return the path to the ``.dill`` file of a job with hash *h*, or ``None`` if there is no such job in the index."""
+        with self._lock:
+            row = self._conn.execute('SELECT path FROM jobs WHERE hash = ?', (h,)).fetchone()
+        return row[0] if row else None
+
+
+    def add(self, h, path, name, status):
+        """Store the job with hash *h* and the ``.dill`` file *path* in the index, replacing any previous entry with the same hash."""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?)', (h, path, name, status, time.time()))
+
+
+    def remove(self, h, path):
+        """Remove the entry for hash *h*, but only if it still points to *path* (it could have been replaced by another script in the meantime)."""
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE hash = ? AND path = ?', (h, path))
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class _BlobStore:
+    """Content-addressed store of files used by |JobManager| to share identical result files between jobs (see :meth:`~scm.plams.core.results.Results._copy_to`).
+
+    Every file is stored in the folder *path* (created if needed) under the name equal to the SHA256 hash of its contents, in a subfolder named after the first two characters of the hash. Stored files (*blobs*) are read-only and folders of copied jobs refer to them with symbolic links, so the links themselves serve as per-job manifests. Original files of the jobs that were copied are never modified. Blobs are never removed automatically, even if no job folder refers to them any more.
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(self.path, exist_ok=True)
+        self._known = {}
+
+
+    def link(self, src, dst):
+        """Make *dst* refer to the same blob as *src*, adding the contents of *src* to the store if needed (see :meth:`add`). If symbolic links are not supported, the blob is copied to *dst*."""
+        blob = self.add(src)
+        try:
+            os.symlink(blob, dst)
+        except OSError:
+            shutil.copy(blob, dst)
+
+
+    def add(self, filename):
+        """Put the contents of *filename* in the store and return the path to the corresponding blob. The file itself is left untouched, so the job it belongs to can still modify it. Files that are already links to blobs and files that were added before (and not modified since then) are not hashed again."""
+        if os.path.islink(filename):
+            target = os.path.realpath(filename)
+            if os.path.dirname(os.path.dirname(target)) == self.path:
+                return target
+
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+        if key in self._known and os.path.isfile(self._known[key]):
+            return self._known[key]
+
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        blob = opj(self.path, digest[:2], digest)
+
+        if not os.path.isfile(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp = '{}.{}.{}.tmp'.format(blob, os.getpid(), threading.get_ident())
+            shutil.copy2(filename, tmp)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, blob)
+        self._known[key] = blob
+        return blob
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class _JobStub:
+    """Placeholder for a job saved in a ``.dill`` file, created by :meth:`JobManager.load_job_lazy` from the metadata sidecar.
+
+    Attributes ``name``, ``status``, ``path`` and ``jobclass`` (the full name of the job class), as well as the :meth:`hash` method, are available right away. Accessing any other attribute loads the job with :meth:`JobManager.load_job` (for stubs of children of a |MultiJob|, the whole |MultiJob| is loaded) and returns the attribute of the loaded job. The loaded job replaces the stub in ``hashes`` of the job manager.
+
+    Stubs of jobs reattached by :meth:`JobManager.replay_journal` get a *pending* future resolved with the exit code of the job in the queueing system. Loading such a stub waits for that future and then loads the job from its folder with |load_external|.
+    """
+    def __init__(self, filename, meta, jobmanager, parent=None, pending=None):
+        self._filename = filename
+        self._jobmanager = jobmanager
+        self._parent = parent
+        self._job = None
+        self._pending = pending
+        self._lock = threading.Lock()
+        self.name = meta['name']
+        self.status = meta['status']
+        self.jobclass = meta['class']
+        self.path = os.path.dirname(filename) if parent is None else opj(parent.path, self.name)
+        self._hash = meta.get('hash') if meta.get('hashing') == jobmanager.settings.hashing else None
+        self._children = [_JobStub(filename, m, jobmanager, self) for m in meta.get('children', [])]
+        if self._hash is not None:
+            jobmanager.hashes[self._hash] = self
+            fuzzy = meta.get('fuzzy')
+            if fuzzy and fuzzy['precision'] == jobmanager.settings.get('hash_precision', 6):
+                jobmanager._register_fuzzy(self, self._hash, fuzzy['fingerprint'], fuzzy['labels'], np.array(fuzzy['coords'], dtype=float).reshape(-1, 3))
+
+
+    def hash(self):
+        return self._hash
+
+
+    def load(self):
+        """Load and return the job represented by this stub. Subsequent calls return the same job."""
+        with self._lock:
+            if self._job is None:
+                if self._pending is not None:
+                    self._job = self._load_pending()
+                elif self._parent is None:
+                    self._job = self._jobmanager.load_job(self._filename)
+                else:
+                    parent = self._parent.load()
+                    if parent is not None:
+                        self._job = next((j for j in itertools.chain(parent, parent.other_jobs()) if j.name == self.name), None)
+            return self._job
+
+
+    def _load_pending(self):
+        returncode = self._pending.result()
+        if returncode != 0:
+            log('Reattached job {} finished with nonzero return code'.format(self.name), 3)
+            return None
+        parts = self.jobclass.split('.')
+        try:
+            i = next(i for i in range(len(parts)-1, 0, -1) if importlib.util.find_spec('.'.join(parts[:i])))
+            cls = importlib.import_module('.'.join(parts[:i]))
+            for part in parts[i:]:
+                cls = getattr(cls, part)
+            job = cls.load_external(self.path, finalize=True)
+        except Exception as e:
+            log('Loading reattached job {} from {} failed: {}'.format(self.name, self.path, e), 3)
+            return None
+        return job if job.ok() else None
+
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        job = self.load()
+        if job is None:
+            raise AttributeError("Job {} could not be loaded from {}".format(self.name, self._filename))
+        return getattr(job, name)
+
+
+    def __repr__(self):
+        return '<{} stub of {} from {}>'.format(self.jobclass, self.name, self._filename)
+
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class _PickleWriter:
+    """Background thread pickling jobs finished by a |JobManager|.
+
+    Jobs are put in a queue of at most *size* elements with :meth:`put`. The thread is started when a job is put in an empty queue and it exits when the queue is empty again. If the queue is full, :meth:`put` waits for a free place, so a burst of finishing jobs can't fill the memory with unpickled jobs. :meth:`flush` waits until all queued jobs are pickled.
+    """
+    def __init__(self, size):
+        self._queue = queue.Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._thread = None
+
+
+    def put(self, job, callback=None):
+        """Schedule pickling of *job*. After *job* is pickled, *callback* (if not ``None``) is called with *job* as the only argument."""
+        self._queue.put((job, callback))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(name='plamspickler', target=self._loop)
+                self._thread.daemon = config.daemon_threads
+                self._thread.start()
+
+
+    def flush(self):
+        """Wait until all scheduled jobs are pickled."""
+        self._queue.join()
+
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                try:
+                    job, callback = self._queue.get_nowait()
+                except queue.Empty:
+                    self._thread = None
+                    return
+            try:
+                log('Pickling {} in the background'.format(job.name), 7)
+                job.pickle()
+                if callback:
+                    callback(job)
+            except Exception as e:
+                log('Pickling of {} failed: {}'.format(job.name, e), 1)
+            finally:
+                self._queue.task_done()
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class _Journal:
+    """Append-only journal of jobs managed by a |JobManager|, stored as the ``journal`` file in its working folder *workdir*.
+
+    Every line of the file is a JSON object with the path of the job relative to *workdir* (``job``), the type of the event (``event``), its time and event-specific data: the name and class of the job for ``registered``, the hash and the hashing method for ``hash``, the job ID in the queueing system and the absolute path of *workdir* for ``submitted`` and the new status for ``status``. Lines are flushed immediately, so the journal survives a crash of the Python process.
+
+    Queue job IDs are obtained by a |GridRunner|, which knows only the job folder, so all journals are registered in a class-level dictionary and :meth:`submitted` finds the journal of the folder.
+    """
+    _journals = {}
+    _journals_lock = threading.Lock()
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.filename = opj(workdir, 'journal')
+        self._lock = threading.Lock()
+        self._file = open(self.filename, 'a')
+        with _Journal._journals_lock:
+            _Journal._journals[workdir] = self
+
+
+    def record(self, job, event, **data):
+        """Append an entry of type *event* concerning *job* with additional *data* to the journal."""
+        if job.path is None:
+            return
+        entry = dict(data, job=os.path.relpath(job.path, self.workdir), event=event, time=round(time.time(), 3))
+        self._write(entry)
+
+
+    def _write(self, entry):
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+                self._file.flush()
+
+
+    def close(self):
+        with _Journal._journals_lock:
+            _Journal._journals.pop(self.workdir, None)
+        with self._lock:
+            self._file.close()
+
+
+    @classmethod
+    def submitted(cls, path, jobid):
+        """Record that the job in folder *path* was submitted to a queueing system as *jobid*, in the journal of the working folder containing *path* (if any)."""
+        with cls._journals_lock:
+            journals = list(cls._journals.values())
+        for journal in journals:
+            if path.startswith(journal.workdir + os.sep):
+                journal._write({'job': os.path.relpath(path, journal.workdir), 'event': 'submitted', 'jobid': jobid, 'workdir': journal.workdir, 'time': round(time.time(), 3)})
+                return
+
+
+    @staticmethod
+    def replay(workdir):
+        """Read the journal in *workdir* and return a dictionary with the final state of every job in it: data from all entries of each job merged together, with paths relative to *workdir* as keys. Return ``None`` if there is no journal. Unreadable lines (for example, the last line written during a crash) are skipped."""
+        filename = opj(workdir, 'journal')
+        if not os.path.isfile(filename):
+            return None
+        jobs = {}
+        with open(filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                jobs.setdefault(entry.pop('job'), {}).update(entry)
+        return jobs
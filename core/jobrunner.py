@@ -1,20 +1,38 @@
+import asyncio
+import itertools
 import os
 import functools
+import getpass
+import json
+import re
+import shlex
+import stat
+import sys
+import tempfile
 import threading
 import time
 
+from collections import deque
+from concurrent.futures import Future
+
 from os.path import join as opj
 from subprocess import DEVNULL, PIPE
 
 from .errors import PlamsError
 from .functions import config, log
-from .private import saferun
+from .jobmanager import _Journal
+from .private import asaferun, saferun
 from .settings import Settings
+from .tracing import _tracer
+
 
+__all__ = ['JobRunner', 'AsyncJobRunner', 'SlotRunner', 'GridRunner', 'AsyncGridRunner', 'PilotRunner']
 
-__all__ = ['JobRunner', 'GridRunner']
 
 
+#run flags interpreted by PLAMS itself, never passed to the queueing system by GridRunner
+_plams_runflags = ['priority']
+
 
 def _in_thread(func):
     """Decorator for an instance method. If ``parallel`` attribute of given instance is ``True``, run decorated method in a separate :class:`~threading.Thread`. This thread is usually a daemon thread, the decision is based on ``config.daemon_threads`` entry."""
@@ -41,11 +59,141 @@ def _limit(func):
     return wrapper
 
 
+class _WorkerPool:
+    """A fixed-size pool of reusable worker threads consuming a FIFO queue of tasks.
+
+    Worker threads are started lazily, one per submitted task, until *size* of them are alive. Each worker keeps taking tasks from the queue and exits as soon as the queue is empty, so an idle pool does not keep any threads alive. Workers are named ``plamsthread``, hence |finish| waits for them like for any other thread started by a |JobRunner|.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._tasks = deque()
+        self._workers = 0
+        self._lock = threading.Lock()
+
+
+    def submit(self, func, *args, **kwargs):
+        """Append a call of *func* with *args* and *kwargs* to the queue. Start a new worker if less than ``size`` workers are alive."""
+        with self._lock:
+            self._tasks.append((func, args, kwargs))
+            if self._workers < self.size:
+                self._workers += 1
+                t = threading.Thread(name='plamsthread', target=self._work)
+                t.daemon = config.daemon_threads
+                t.start()
+
+
+    def _work(self):
+        """Main loop of a worker thread. Execute queued tasks one by one until the queue is empty."""
+        while True:
+            with self._lock:
+                if not self._tasks:
+                    self._workers -= 1
+                    return
+                func, args, kwargs = self._tasks.popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                log('WARNING: Worker thread caught the following exception: {}'.format(e), 1)
+
+
+class _JobGraph:
+    """A dependency graph of jobs that were started, but are not yet finished.
+
+    Jobs are added in |run| and removed at the end of their life cycle. For every added job an edge from each of its :meth:`~scm.plams.core.basejob.Job.dependencies` to the job itself is stored, unless the dependency is already finished. The graph is used to compute the length of the remaining critical path of a pending job.
+    """
+    _finished = ['successful', 'copied', 'crashed', 'failed', 'preview']
+
+    def __init__(self):
+        self._pending = set()
+        self._successors = {}
+        self._lengths = {}
+        self._lock = threading.Lock()
+
+
+    def add(self, job):
+        """Add *job* to the graph, together with edges from its dependencies."""
+        dependencies = job.dependencies()
+        with self._lock:
+            self._pending.add(job)
+            for dep in dependencies:
+                if dep.status not in _JobGraph._finished:
+                    self._successors.setdefault(dep, []).append(job)
+            self._lengths.clear()
+
+
+    def remove(self, job):
+        """Remove finished *job* from the graph."""
+        with self._lock:
+            self._pending.discard(job)
+            self._successors.pop(job, None)
+            self._lengths.clear()
+
+
+    def critical_path(self, job):
+        """Return the length of the longest chain of pending jobs that can start only after *job* is finished, including *job* itself.
+
+        Each |SingleJob| counts as 1, each |MultiJob| as 0. Jobs depending on a |MultiJob| are considered to depend also on all its children (and children of children etc.).
+
+        Computed lengths are remembered until a job is added to or removed from the graph, so ranking many waiting jobs does not traverse the graph again for each of them.
+        """
+        memo = self._lengths
+        def length(j):
+            if j in memo:
+                return memo[j]
+            memo[j] = 0 #guard against cycles
+            successors = []
+            p = j
+            while p is not None:
+                successors += self._successors.get(p, [])
+                p = getattr(p, 'parent', None)
+            own = 0 if hasattr(j, 'children') else 1
+            memo[j] = own + max([length(s) for s in successors if s in self._pending], default=0)
+            return memo[j]
+        with self._lock:
+            return length(job)
+
+
+
+class _PriorityGate:
+    """A replacement for :class:`BoundedSemaphore<threading.BoundedSemaphore>` with *size* slots used by |JobRunner| with scheduling enabled.
+
+    Jobs call :meth:`acquire` before and :meth:`release` after their execution. Whenever a slot is released and some jobs are waiting, the slot is handed directly to the waiting job with the highest value of *key* (a function taking a job as the only argument). Among jobs with equal keys, the one that has been waiting longest is chosen.
+    """
+    def __init__(self, size, key):
+        self.free = size
+        self.key = key
+        self._waiting = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+
+    def acquire(self, job):
+        with self._lock:
+            if self.free > 0 and not self._waiting:
+                self.free -= 1
+                return
+            event = threading.Event()
+            self._waiting.append((job, next(self._counter), event))
+        event.wait()
+
+
+    def release(self):
+        with self._lock:
+            if self._waiting:
+                best = max(self._waiting, key=lambda x: (self.key(x[0]), -x[1]))
+                self._waiting.remove(best)
+                best[2].set()
+            else:
+                self.free += 1
+
+
+
 class _MetaRunner(type):
-    """Metaclass for |JobRunner|. During an instance creation wrap the :meth:`~scm.plams.core.jobrunner.JobRunner.call` method with :func:`_limit` decorator which enforces a limit on the number of simultaneous :meth:`~scm.plams.core.jobrunner.JobRunner.call` calls.
+    """Metaclass for |JobRunner|. During an instance creation wrap the :meth:`~scm.plams.core.jobrunner.JobRunner.call` method with :func:`_limit` decorator which enforces a limit on the number of simultaneous :meth:`~scm.plams.core.jobrunner.JobRunner.call` calls. Subclasses that do not define their own :meth:`~scm.plams.core.jobrunner.JobRunner.call` inherit the already wrapped one.
     """
     def __new__(meta, name, bases, dct):
-        dct['call'] = _limit(dct['call'])
+        if 'call' in dct:
+            dct['call'] = _limit(dct['call'])
         return type.__new__(meta, name, bases, dct)
 
 
@@ -66,12 +214,28 @@ class JobRunner(metaclass=_MetaRunner):
 
     For a job runner with parallel execution enabled the number of simultaneously running jobs can be limited using the *maxjobs* parameter. If *maxjobs* is 0, no limit is enforced. If *parallel* is ``False``, *maxjobs* is ignored. If *parallel* is ``True`` and *maxjobs* is a positive integer, a :class:`BoundedSemaphore<threading.BoundedSemaphore>` of that size is used to limit the number of simultaneously running :meth:`call` methods.
 
+    By default a parallel job runner starts a new thread for every executed job, so running a large number of jobs at once results in the same number of threads alive at the same time, most of them waiting for the semaphore. If *maxthreads* is a positive integer, instances of |SingleJob| are instead put in a queue and executed by a pool of at most *maxthreads* reusable worker threads (see :class:`_WorkerPool`). |MultiJob| instances are still run in their own threads, since they spend most of their life waiting for their children. If *parallel* is ``False``, *maxthreads* is ignored. A reasonable choice is a *maxthreads* value equal or slightly larger than *maxjobs*, keeping in mind that a job which waits for results of other jobs (for example in its |prerun|) occupies a worker thread while waiting.
+
+    When the number of simultaneously running jobs is limited, the order in which waiting jobs get to run is arbitrary by default. It can be adjusted with the *scheduling* parameter:
+
+    *   ``None`` -- no scheduling, the default behavior described above.
+    *   ``'priority'`` -- jobs with a higher ``priority`` run flag (for example ``job.run(priority=10)``) are executed first. The default priority is 0. Jobs with the same priority are executed in the order in which they became ready.
+    *   ``'critical_path'`` -- like ``'priority'``, but among jobs with the same priority the ones with the longest remaining critical path are executed first. The critical path of a job is the longest chain of pending jobs that depend on it, directly or indirectly (see :meth:`~scm.plams.core.basejob.Job.dependencies`). That way long chains of dependent jobs, like a restart job followed by many jobs using its results, are started as early as possible.
+
+    With scheduling enabled, a :class:`_PriorityGate` is used instead of the semaphore and the limit applies to the execution of |SingleJob| instances rather than to :meth:`call` itself. Only jobs ready for execution (with all their dependencies resolved) are considered. If *maxthreads* is also used, jobs are prepared by the worker pool in the order of |run| calls, so *maxthreads* should be noticeably larger than *maxjobs* for the scheduling to have any choice.
+
     A |JobRunner| instance can be passed to |run| with a keyword argument ``jobrunner``. If this argument is omitted, the instance stored in ``config.default_jobrunner`` is used.
     """
 
-    def __init__ (self, parallel=False, maxjobs=0):
+    def __init__ (self, parallel=False, maxjobs=0, maxthreads=0, scheduling=None):
+        if scheduling not in [None, 'priority', 'critical_path']:
+            raise PlamsError("JobRunner: invalid 'scheduling' argument: {}. Supported values are None, 'priority' and 'critical_path'".format(scheduling))
         self.parallel = parallel
-        self.semaphore = threading.BoundedSemaphore(maxjobs) if maxjobs else None
+        self.scheduling = scheduling if parallel else None
+        self.graph = _JobGraph() if self.scheduling == 'critical_path' else None
+        self.gate = _PriorityGate(maxjobs, self.rank) if (self.scheduling and maxjobs) else None
+        self.semaphore = threading.BoundedSemaphore(maxjobs) if (maxjobs and not self.gate) else None
+        self.pool = _WorkerPool(maxthreads) if (parallel and maxthreads) else None
 
 
     def call(self, runscript, workdir, out, err, runflags):
@@ -91,25 +255,187 @@ class JobRunner(metaclass=_MetaRunner):
         """
         log('Executing {}'.format(runscript), 5)
         command = ['./'+runscript] if os.name == 'posix' else ['sh', runscript]
+        env = self._environment()
         if out is not None:
             with open(opj(workdir, err), 'w') as e, open(opj(workdir, out), 'w') as o:
-                process = saferun(command, cwd=workdir, stderr=e, stdout=o)
+                process = saferun(command, cwd=workdir, stderr=e, stdout=o, env=env)
         else:
             with open(opj(workdir, err), 'w') as e:
-                process = saferun(command, cwd=workdir, stderr=e)
+                process = saferun(command, cwd=workdir, stderr=e, env=env)
         log('Execution of {} finished with returncode {}'.format(runscript, process.returncode), 5)
         return process.returncode
 
 
-    @_in_thread
+    def _environment(self):
+        """Return a dictionary with environment variables for the runscript executed by :meth:`call` in the current thread. The value ``None`` returned here means that the environment of the Python process is inherited."""
+        return None
+
+
     def _run_job(self, job, jobmanager):
         """_run_job(job, jobmanager)
-        This method aggregates the parts of :ref:`job-life-cycle` that are supposed to be run in a separate thread in case of parallel job execution. It is wrapped with :func:`_in_thread` decorator.
+        Pass the parts of :ref:`job-life-cycle` that are supposed to be run in a separate thread to a proper place. If this job runner has a worker pool and *job* is not a |MultiJob|, they are submitted to the pool. Otherwise :meth:`_run_in_thread` is used.
+
+        This method should not be overridden.
+        """
+        if self.graph is not None:
+            self.graph.add(job)
+        if self.pool is not None and not hasattr(job, 'children'):
+            self.pool.submit(self._life_cycle, job, jobmanager)
+        else:
+            self._run_in_thread(job, jobmanager)
+
+
+    @_in_thread
+    def _run_in_thread(self, job, jobmanager):
+        """_run_in_thread(job, jobmanager)
+        Run :meth:`_life_cycle`. This method is wrapped with :func:`_in_thread` decorator.
+        """
+        self._life_cycle(job, jobmanager)
+
+
+    def _life_cycle(self, job, jobmanager):
+        """_life_cycle(job, jobmanager)
+        This method aggregates the parts of :ref:`job-life-cycle` that are supposed to be run in a separate thread in case of parallel job execution.
 
         This method should not be overridden.
         """
         if job._prepare(jobmanager):
+            self._execute_job(job)
+            job._finalize()
+        if self.graph is not None:
+            self.graph.remove(job)
+
+
+    def _execute_job(self, job):
+        """_execute_job(job)
+        Execute *job* by calling its :meth:`~scm.plams.core.basejob.Job._execute`. This is the place where subclasses can acquire and release resources needed for the execution (see |SlotRunner|). If scheduling is enabled, a slot of the :class:`_PriorityGate` is acquired here for each |SingleJob|.
+        """
+        if self.gate is None or hasattr(job, 'children'):
+            job._execute(self)
+            return
+        with _tracer.span(job, 'slot'):
+            self.gate.acquire(job)
+        try:
             job._execute(self)
+        finally:
+            self.gate.release()
+
+
+    def resource_usage(self, workdir):
+        """resource_usage(workdir)
+        Return a |Settings| instance describing resources used by the runscript most recently executed by this job runner in *workdir*, or ``None`` if they are unknown. The basic job runner does not measure them. See :meth:`GridRunner.resource_usage` for the meaning of the returned entries.
+        """
+        return None
+
+
+    def rank(self, job):
+        """rank(job)
+        Return a tuple used to decide which one of the jobs waiting for execution should be executed first (the one with the highest value). Its contents depend on *scheduling* argument of this job runner: the ``priority`` run flag is always the first element and the remaining critical path of *job* is the second one for ``scheduling='critical_path'``.
+        """
+        priority = job.settings.run.priority if 'priority' in job.settings.run else 0
+        if self.graph is not None:
+            return (priority, self.graph.critical_path(job))
+        return (priority,)
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class AsyncJobRunner(JobRunner):
+    """Subclass of |JobRunner| executing jobs as :mod:`asyncio` tasks in a single event loop, instead of using a thread per job.
+
+    This job runner is meant to be used together with :meth:`~scm.plams.core.basejob.Job.arun` and :meth:`~scm.plams.core.results.Results.await_done`, in scripts or services that are already driven by an asyncio event loop::
+
+        async def main():
+            jr = AsyncJobRunner(maxjobs=16)
+            results = await asyncio.gather(*[job.arun(jobrunner=jr) for job in jobs])
+
+        asyncio.run(main())
+
+    Runscripts are started with :func:`asyncio.create_subprocess_exec` and awaited, so thousands of jobs can be run concurrently on one event loop. If *maxjobs* is a positive integer, an :class:`asyncio.Semaphore` is used to limit the number of simultaneously executed runscripts. The parts of the job life cycle that are not related to runscript execution (including |prerun|, |postrun|, :meth:`~scm.plams.core.basejob.Job.check` and |pickling|) are executed directly in the event loop, so they should be kept short and they should not wait for results of other jobs in a blocking way (use :meth:`~scm.plams.core.results.Results.await_done` instead).
+
+    .. note::
+        This job runner requires Python 3.7 or newer.
+
+    If |run| (instead of :meth:`~scm.plams.core.basejob.Job.arun`) is used with this job runner while an event loop is running in the current thread, the job is scheduled as a new task in that loop and |run| returns immediately. Otherwise the job is executed just like with a parallel |JobRunner| (in a separate thread, with blocking runscript execution).
+    """
+    def __init__(self, maxjobs=0):
+        JobRunner.__init__(self, parallel=True, maxjobs=maxjobs)
+        self.maxjobs = maxjobs
+        self._asemaphores = {}
+        self._tasks = set()
+
+
+    async def acall(self, runscript, workdir, out, err, runflags):
+        """acall(runscript, workdir, out, err, runflags)
+        Asynchronous counterpart of :meth:`JobRunner.call`. Execute the *runscript* in the folder *workdir* as an asyncio subprocess and return its exit code.
+        """
+        semaphore = self._semaphore()
+        if semaphore:
+            async with semaphore:
+                return await self._acall(runscript, workdir, out, err, runflags)
+        return await self._acall(runscript, workdir, out, err, runflags)
+
+
+    async def _acall(self, runscript, workdir, out, err, runflags):
+        log('Executing {}'.format(runscript), 5)
+        command = ['./'+runscript] if os.name == 'posix' else ['sh', runscript]
+        if out is not None:
+            with open(opj(workdir, err), 'w') as e, open(opj(workdir, out), 'w') as o:
+                process = await asaferun(*command, cwd=workdir, stderr=e, stdout=o)
+        else:
+            with open(opj(workdir, err), 'w') as e:
+                process = await asaferun(*command, cwd=workdir, stderr=e)
+        log('Execution of {} finished with returncode {}'.format(runscript, process.returncode), 5)
+        return process.returncode
+
+
+    def _semaphore(self):
+        """Return an :class:`asyncio.Semaphore` limiting the number of runscripts executed in the current event loop, or ``None`` if *maxjobs* is 0."""
+        if not self.maxjobs:
+            return None
+        loop = asyncio.get_running_loop()
+        if loop not in self._asemaphores:
+            self._asemaphores[loop] = asyncio.Semaphore(self.maxjobs)
+        return self._asemaphores[loop]
+
+
+    def _run_job(self, job, jobmanager):
+        """_run_job(job, jobmanager)
+        If an event loop is running in the current thread, schedule :meth:`_arun_job` as a new task in it. Otherwise use :meth:`JobRunner._run_job`.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            JobRunner._run_job(self, job, jobmanager)
+        else:
+            task = loop.create_task(self._arun_job(job, jobmanager))
+            self._tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+
+    def _task_done(self, task):
+        """Forget a finished task created by :meth:`_run_job` and log the exception it raised, if any."""
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log('WARNING: Job task caught the following exception: {}'.format(task.exception()), 1)
+
+
+    async def _arun_job(self, job, jobmanager):
+        """_arun_job(job, jobmanager)
+        Asynchronous counterpart of :meth:`JobRunner._life_cycle`. All dependencies of *job* (see :meth:`~scm.plams.core.basejob.Job.dependencies`) are awaited before :meth:`~scm.plams.core.basejob.Job._prepare` is called, so that the event loop is not blocked by them. That includes implicit dependencies present in the ``input`` branch of settings, whose |Results| are usually accessed while the input is prepared.
+
+        This method should not be overridden.
+        """
+        if config.preview is False:
+            for j in job.dependencies():
+                await j.results.await_done()
+        if job._prepare(jobmanager):
+            await job._aexecute(self)
             job._finalize()
 
 
@@ -120,6 +446,242 @@ class JobRunner(metaclass=_MetaRunner):
 
 
 
+class SlotRunner(JobRunner):
+    """Subclass of |JobRunner| that runs jobs in parallel on the current machine as long as the total number of cores requested by them fits the machine.
+
+    Unlike the *maxjobs* limit of a regular |JobRunner|, which treats all jobs equally, this job runner treats the machine as *ncores* core slots (by default, all the cores reported by :func:`os.cpu_count`). Every |SingleJob| requests ``settings.runscript.nproc`` slots (or *default_nproc*, if ``nproc`` is not present in its settings) and its runscript is executed only when that many slots are free. Requests larger than *ncores* are reduced to *ncores*. |MultiJob| instances don't request any slots. For example, on a 64-core node::
+
+        config.default_jobrunner = SlotRunner(ncores=64)
+        for mol in molecules:
+            s = Settings()
+            s.runscript.nproc = 16 if len(mol) > 100 else 1
+            AMSJob(molecule=mol, settings=s).run()
+
+    keeps all 64 cores busy, with at most 4 big jobs running at the same time.
+
+    Waiting jobs are admitted in the order in which they requested slots, or, if *scheduling* is used (see |JobRunner|), in the order given by :meth:`~JobRunner.rank`. If *backfill* is ``True``, a job that fits in the currently free slots is admitted even if some job that should be admitted before it is still waiting for more slots. That keeps small jobs running around big ones, but a big job can be delayed for as long as small jobs keep arriving. With ``backfill=False`` the admission order is strictly first come, first served.
+
+    The number of slots assigned to a job is exported to its runscript as ``OMP_NUM_THREADS`` and ``NSCM`` environment variables, so programs that do not get ``nproc`` explicitly in their command line (or jobs without ``runscript.nproc``) use exactly the cores they were given.
+
+    The *maxthreads* argument has the same meaning as for |JobRunner|. The job runner is always parallel.
+    """
+    def __init__(self, ncores=None, backfill=True, default_nproc=1, maxthreads=0, scheduling=None):
+        JobRunner.__init__(self, parallel=True, maxthreads=maxthreads, scheduling=scheduling)
+        self.ncores = ncores or os.cpu_count() or 1
+        self.backfill = backfill
+        self.default_nproc = default_nproc
+        self.free = self.ncores
+        self._waiting = []
+        self._counter = itertools.count()
+        self._slots = threading.Condition()
+        self._local = threading.local()
+
+
+    def requested_cores(self, job):
+        """requested_cores(job)
+        Return the number of core slots requested by *job*."""
+        n = int(job.settings.runscript.nproc) if 'nproc' in job.settings.runscript else self.default_nproc
+        if n > self.ncores:
+            log('WARNING: Job {} requests {} cores, but only {} are available. Running it with {}'.format(job.name, n, self.ncores, self.ncores), 3)
+            n = self.ncores
+        return max(n, 1)
+
+
+    def _execute_job(self, job):
+        """_execute_job(job)
+        Wait until enough core slots are free for *job*, execute it and release the slots."""
+        if hasattr(job, 'children'):
+            job._execute(self)
+            return
+
+        request = (self.requested_cores(job), next(self._counter), job)
+        with _tracer.span(job, 'slot'), self._slots:
+            self._waiting.append(request)
+            self._slots.wait_for(lambda: self._admissible(request))
+            self._waiting = [r for r in self._waiting if r is not request]
+            self.free -= request[0]
+            self._slots.notify_all()
+        log('Job {} admitted with {} cores ({} of {} free)'.format(job.name, request[0], self.free, self.ncores), 7)
+
+        self._local.nproc = request[0]
+        try:
+            job._execute(self)
+        finally:
+            del self._local.nproc
+            with self._slots:
+                self.free += request[0]
+                self._slots.notify_all()
+
+
+    def _admissible(self, request):
+        """Check if the slot *request* can be admitted now. Should be called with ``_slots`` acquired."""
+        if request[0] > self.free:
+            return False
+        candidates = [r for r in self._waiting if r[0] <= self.free] if self.backfill else self._waiting
+        if self.scheduling:
+            return max(candidates, key=lambda r: (self.rank(r[2]), -r[1])) is request
+        return candidates[0] is request
+
+
+    def _environment(self):
+        """Return the environment of the Python process with ``OMP_NUM_THREADS`` and ``NSCM`` set to the number of cores assigned to the job executed in the current thread."""
+        nproc = getattr(self._local, 'nproc', None)
+        if nproc is None:
+            return None
+        env = os.environ.copy()
+        env['OMP_NUM_THREADS'] = str(nproc)
+        env['NSCM'] = str(nproc)
+        return env
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+
+
+
+class _QueuePoller:
+    """A single thread querying queueing systems on behalf of all |GridRunner| instances.
+
+    Every job runner interested in the state of some submitted jobs registers a *watch* with :meth:`watch`. All watches using the same query command (and the same ``commands.running`` function) are served by a single execution of that command, so the number of queue queries does not grow with the number of job runners or submitted jobs. The thread is started when the first watch is registered and it exits when there are no more watches.
+
+    If the settings of the job runner contain ``commands.query``, this command is used instead of ``commands.check``. The ``{jobids}`` and ``{user}`` placeholders in it are replaced with a comma-separated list of watched job IDs and the name of the current user, respectively, so only the relevant part of the queue is listed.
+
+    The interval between two consecutive queries starts at ``minstep`` seconds and is doubled after every query that did not finish any watch, up to the smallest ``sleepstep`` of all watching job runners. Registering a new watch or finishing an old one resets the interval to ``minstep``.
+    """
+    minstep = 0.5
+
+    def __init__(self):
+        self._watches = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._step = 0
+
+
+    def watch(self, settings, jobids, update, sleepstep):
+        """Start watching jobs in the queueing system described by *settings*. *jobids* should be a function returning a list of job IDs to query. After every query *update* is called with a set of IDs of jobs present in the queue (only from the jobs returned by *jobids*, if ``commands.query`` uses ``{jobids}``). The watch is removed when *update* returns ``True``."""
+        with self._lock:
+            self._watches.append((settings, jobids, update, sleepstep))
+            self._step = 0
+            if self._thread is None:
+                self._thread = threading.Thread(name='plamsthread', target=self._loop)
+                self._thread.daemon = config.daemon_threads
+                self._thread.start()
+
+
+    def _loop(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._watches:
+                        self._thread = None
+                        return
+                    watches = list(self._watches)
+                    maxstep = min(w[3] for w in watches)
+                    step = min(self.minstep, maxstep) if self._step == 0 else min(2*self._step, maxstep)
+                    self._step = step
+                time.sleep(step)
+
+                groups = {}
+                for w in watches:
+                    query = w[0].commands.query if 'query' in w[0].commands else w[0].commands.check
+                    groups.setdefault((query, w[0].commands.running), []).append(w)
+
+                finished = []
+                for (query, running), group in groups.items():
+                    try:
+                        jobids = set()
+                        for w in group:
+                            jobids.update(w[1]())
+                        present = self._query(query, running, jobids)
+                    except Exception as e:
+                        log('WARNING: Error while querying the queue status: {}'.format(e), 1)
+                        continue
+                    for w in group:
+                        try:
+                            if w[2](present):
+                                finished.append(w)
+                        except Exception as e:
+                            log('WARNING: Error while processing the queue status: {}'.format(e), 1)
+
+                if finished:
+                    with self._lock:
+                        for w in finished:
+                            self._watches.remove(w)
+                        self._step = 0
+        finally:
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+
+    @staticmethod
+    def _query(query, running, jobids):
+        """Execute *query* and return the set of job IDs extracted from its output with *running*. If *query* needs job IDs and *jobids* is empty, nothing is executed."""
+        if '{jobids}' in query:
+            if not jobids:
+                return set()
+            query = query.replace('{jobids}', ','.join(sorted(jobids)))
+        if '{user}' in query:
+            query = query.replace('{user}', getpass.getuser())
+        process = saferun(query.split(' '), stdout=PIPE)
+        return set(running(process.stdout.decode()))
+
+
+_poller = _QueuePoller()
+_accounting = _WorkerPool(4)
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class _GridTask:
+    """A single runscript executed by |GridRunner| as a task of a job array or by |PilotRunner| inside a pilot job. The ``future`` attribute (a :class:`concurrent.futures.Future`) is resolved with the exit code of the runscript when the task is finished."""
+    def __init__(self, runscript, workdir, out, err):
+        self.runscript = runscript
+        self.workdir = workdir
+        self.out = out
+        self.err = err
+        self.exitfile = None
+        self.future = Future()
+        self._gone = False
+
+
+    def finish(self, returncode):
+        if not self.future.done():
+            self.future.set_result(returncode)
+
+
+    def check(self, gone):
+        """Finish this task if its exit code file is present. If *gone* is ``True`` (the job array or pilot job executing this task is not in the queue any more) for the second time in a row and the file is still absent, finish with exit code 1."""
+        if self.future.done():
+            return
+        if os.path.isfile(self.exitfile):
+            with open(self.exitfile) as f:
+                code = f.read().strip()
+            self.finish(int(code) if code.isdigit() else 1)
+        elif gone and self._gone:
+            log('WARNING: {} in {} left the queue without reporting its exit code'.format(self.runscript, self.workdir), 3)
+            self.finish(1)
+        else:
+            self._gone = gone
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
 class GridRunner(JobRunner):
     """Subclass of |JobRunner| that submits the runscript to a queueing system instead of executing it locally. Besides two new keyword arguments (*grid* and *sleepstep*) it behaves and is meant to be used just like a regular |JobRunner|.
 
@@ -140,25 +702,40 @@ class GridRunner(JobRunner):
     *   ``workdir`` -- flag for specifying path to the working directory.
     *   ``commands.submit`` -- submit command.
     *   ``commands.check`` -- queue status check command.
+    *   ``commands.query`` -- queue status check command limited to the jobs of interest, with ``{jobids}`` and ``{user}`` placeholders (optional, if absent ``commands.check`` is used, see :class:`_QueuePoller`).
     *   ``commands.getid`` -- function extracting submitted job's ID from the output of the submit command.
     *   ``commands.running`` -- function extracting a list of all running jobs from the output of queue check command
+    *   ``commands.accounting`` -- command obtaining accounting data of a finished job, with ``{jobid}`` placeholder (optional, see :meth:`_account`). The predefined SLURM and PBS settings contain it only as a commented out line in ``plams_defaults``, since it works only if the queueing system keeps records of finished jobs.
+    *   ``commands.usage`` -- function extracting exit code and resource usage from the output of the accounting command (optional, needed only together with ``commands.accounting``).
     *   ``commands.special`` -- branch storing definitions of special |run| keyword arguments.
 
+    *   ``array.flag`` -- flag for submitting a job array, followed directly by the range of task IDs (optional, needed only for batching, see below).
+    *   ``array.taskid`` -- name of the environment variable holding the task ID within a job array (optional, needed only for batching).
+
     See :meth:`call` for more details and examples.
 
-    The *sleepstep* parameter defines how often the queue check is performed. It should be a numerical value telling how many seconds should the interval between two consecutive checks last. If ``None`` is used, the global default from ``config.sleepstep`` is taken.
+    Submitting a large number of short jobs one by one puts a heavy load on the queueing system and can hit limits on the number of submissions per user. If *batch_window* is a positive number, runscripts are not submitted immediately. Instead, they are collected for *batch_window* seconds (or until *batch_size* of them are collected) and submitted together as a single job array. Only runscripts with identical submit flags (built from run flags, see :meth:`call`) are put in the same job array. Every task of the array executes one runscript in its own working folder, with output and error streams redirected by the shell, and writes the exit code of the runscript to a small file in *batch_dir* (by default, a subfolder ``gridrunner_arrays`` in the main working folder). These files are used to detect when individual tasks are finished and what their exit codes were. Keep in mind that with *maxjobs* enabled no more than *maxjobs* runscripts can be waiting for submission at the same time, so batches are never larger than *maxjobs*.
+
+    The queue is checked by a single thread shared by all |GridRunner| instances (see :class:`_QueuePoller`). The *sleepstep* parameter defines the longest allowed interval (in seconds) between two consecutive checks. Checks are performed more often shortly after a job is submitted or finished. If ``None`` is used, the global default from ``config.sleepstep`` is taken.
 
     .. note::
         Usually queueing systems are configured in such a way that output of your calculation is captured somewhere else and copied to the location indicated by the output flag only when the job is finished. Because of that it is not possible to have a peek at your output while your job is running (for example, to see if your calculation is going well). This limitation can be circumvented with ``myjob.settings.runscript.stdout_redirect`` flag. If set to ``True``, the output redirection will not be handled by the queueing system, but rather placed in the runscript using the shell redirection ``>``. That forces the output file to be created directly in *workdir* and updated live as the job proceeds.
     """
-    def __init__(self, grid='auto', sleepstep=None, parallel=True, maxjobs=0):
-        JobRunner.__init__(self, parallel=parallel, maxjobs=maxjobs)
+    def __init__(self, grid='auto', sleepstep=None, parallel=True, maxjobs=0, maxthreads=0, scheduling=None, batch_window=0, batch_size=1000, batch_dir=None):
+        JobRunner.__init__(self, parallel=parallel, maxjobs=maxjobs, maxthreads=maxthreads, scheduling=scheduling)
         self.sleepstep = sleepstep or config.sleepstep
-        self._active_jobs = {}
-        self._active_lock = threading.Lock()
-        self._mainlock = threading.Lock()
-
-        if grid == 'auto':
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.batch_dir = batch_dir
+        self._batches = {}
+        self._batch_lock = threading.Lock()
+        self._batch_counter = itertools.count(1)
+        self._usage = {}
+        self._usage_lock = threading.Lock()
+
+        if isinstance(grid, Settings):
+            self.settings = grid
+        elif grid == 'auto':
             self.settings = self._autodetect()
         elif grid in config.gridrunner:
             self.settings = config.gridrunner[grid]
@@ -166,11 +743,12 @@ class GridRunner(JobRunner):
                 saferun([self.settings.commands.submit, '--version'], stdout=DEVNULL, stderr=DEVNULL)
             except OSError:
                 raise PlamsError('GridRunner: {} command not found'.format(self.settings.commands.submit))
-        elif isinstance(grid, Settings):
-            self.settings = grid
         else:
             raise PlamsError("GridRunner: invalid 'grid' argument. 'grid' should be either a Settings instance (see documentations for details) or a string occurring in config.gridrunner or 'auto' for autodetection")
 
+        if self.batch_window and not ('flag' in self.settings.array and 'taskid' in self.settings.array):
+            raise PlamsError('GridRunner: batching requires array.flag and array.taskid entries in the GridRunner settings')
+
 
     def call(self, runscript, workdir, out, err, runflags):
         """call(runscript, workdir, out, err, runflags)
@@ -182,7 +760,7 @@ class GridRunner(JobRunner):
 
         Underscores denote spaces, parts in pointy brackets correspond to ``settings`` entries, parts in curly brackets to :meth:`call` arguments, square brackets contain optional parts. Output part is added if *out* is not ``None``. This is handled automatically based on ``runscript.stdout_redirect`` value in job's ``settings``.
 
-        ``FLAGS`` part is built based on *runflags* argument, which is a |Settings| instance storing |run| keyword arguments. For every *(key,value)* pair in *runflags* the string ``_-key_value`` is appended to ``FLAGS`` **unless** the *key* is a special key occurring in ``commands.special``. In that case ``_<commands.special.key>value`` is used (mind the lack of space in between). For example, a |Settings| instance defining interaction with SLURM has the following entries::
+        ``FLAGS`` part is built based on *runflags* argument, which is a |Settings| instance storing |run| keyword arguments. For every *(key,value)* pair in *runflags* the string ``_-key_value`` is appended to ``FLAGS`` **unless** the *key* is a special key occurring in ``commands.special``. In that case ``_<commands.special.key>value`` is used (mind the lack of space in between). Run flags interpreted by PLAMS itself (``priority``, see |JobRunner|) are skipped. For example, a |Settings| instance defining interaction with SLURM has the following entries::
 
             workdir = '-D'
             output  = '-o'
@@ -217,22 +795,38 @@ class GridRunner(JobRunner):
 
         The submit command is then executed and the output returned by it is used to determine the submitted job's ID. The value stored in ``commands.getid`` is used for that purpose. It should be a function taking a single string (the whole output of the submit command) and returning a string with job's ID.
 
-        The submitted job's ID is then added to ``_active_jobs`` dictionary, with the key being job's ID and the value being an instance of :class:`threading.Lock`. This lock is used to singal the fact that the job is finished and the thread handling it can continue. Then the :meth:`_check_queue` method starts the thread querying the queue and unlocking finished jobs.
+        The submitted job's ID is then watched by the shared :class:`_QueuePoller` and a :class:`~concurrent.futures.Future` is resolved as soon as the job is not present in the queue any more. This method waits for that future. The same submission is used by the asynchronous counterpart of this method, which awaits the future without blocking any thread (see :meth:`_acall`).
 
-        Since it is difficult to automatically obtain job's exit code, the returned value is 0 (or 1, if the submit command failed). From |run| perspective it means that a job executed with |GridRunner| is *crashed* only if it never entered the queue (usually due to improper submit command).
+        If ``commands.accounting`` is present in ``settings``, it is used to obtain the exit code of the job and the resources it used once the job left the queue (see :meth:`_account`). Otherwise, since it is difficult to automatically obtain job's exit code, the returned value is 0 (or 1, if the submit command failed). From |run| perspective it means that without accounting a job executed with |GridRunner| is *crashed* only if it never entered the queue (usually due to improper submit command).
 
         .. note::
             This method is used automatically during |run| and should never be explicitly called in your script.
         """
+        returncode = self._submit(runscript, workdir, out, err, runflags).result()
+        log('Execution of {} finished with returncode {}'.format(runscript, returncode), 5)
+        return returncode
+
+
+    async def _acall(self, runscript, workdir, out, err, runflags):
+        """Asynchronous counterpart of :meth:`call`, used when this job runner is combined with |AsyncJobRunner| (see |AsyncGridRunner|). The submit command is executed in the default executor of the event loop and the returned future is awaited."""
+        loop = asyncio.get_running_loop()
+        future = await loop.run_in_executor(None, self._submit, runscript, workdir, out, err, runflags)
+        returncode = await asyncio.wrap_future(future)
+        log('Execution of {} finished with returncode {}'.format(runscript, returncode), 5)
+        return returncode
+
+
+    def _submit(self, runscript, workdir, out, err, runflags):
+        """Submit *runscript* (see :meth:`call`) and return a :class:`~concurrent.futures.Future` resolved with its exit code once it is finished. If batching is enabled, the runscript is added to a batch instead."""
+        if self.batch_window:
+            return self._submit_batched(runscript, workdir, out, err, runflags)
+
+        future = Future()
         s = self.settings
         cmd = ' '.join([s.commands.submit, s.workdir, workdir, s.error, err])
         if out is not None:
             cmd += ' '+s.output+' '+out
-        for k,v in runflags.items():
-            if k in s.special:
-                cmd += ' '+s.special[k]+str(v)
-            else:
-                cmd += ' -'+k+' '+str(v)
+        cmd += self._flags(runflags)
         cmd += ' ' + opj(workdir,runscript)
 
         log('Submitting {} with command {}'.format(runscript, cmd), 5)
@@ -243,41 +837,157 @@ class GridRunner(JobRunner):
         jobid = s.commands.getid(subout)
         if jobid is None:
             log('Submitting of {} failed. Stderr of submit command:\n{}'.format(runscript, process.stderr.decode()), 1)
-            return 1
+            future.set_result(1)
+            return future
         log('{} submitted successfully as job {}'.format(runscript, jobid), 3)
+        _Journal.submitted(workdir, jobid)
+        self._watch(jobid, workdir, future)
+        return future
 
-        event = threading.Event()
-        with self._active_lock:
-            self._active_jobs[jobid] = event
-        self._check_queue()
-        event.wait()
 
-        log('Execution of {} finished'.format(runscript), 5)
-        return 0
+    def reattach(self, jobid, workdir):
+        """Return a :class:`~concurrent.futures.Future` resolved with the exit code of the job *jobid*, submitted earlier from *workdir* (for example, by a previous run of PLAMS that crashed), once it leaves the queue. Used by :meth:`~scm.plams.core.jobmanager.JobManager.replay_journal`."""
+        future = Future()
+        self._watch(jobid, workdir, future)
+        return future
 
 
-    @_in_thread
-    def _check_queue(self):
-        """Query the queueing system to obtain a list of currently running jobs. Check for active jobs that are not any more in the queue and release their locks. Repeat this procedure every ``sleepstep`` seconds until there are no more active jobs. The ``_mainlock`` lock ensures that there is at most one thread executing the main loop of this method at the same time."""
-        if self._mainlock.acquire(blocking=False):
-            try:
-                while True:
-                    with self._active_lock:
-                        active_jobs = set(self._active_jobs.keys())
-
-                    process = saferun([self.settings.commands.check], stdout=PIPE)
-                    output = process.stdout.decode()
-                    running_jobs = set(self.settings.commands.running(output))
-
-                    with self._active_lock:
-                        for jobid in active_jobs - running_jobs:
-                            self._active_jobs[jobid].set()
-                            del self._active_jobs[jobid]
-                        if len(self._active_jobs) == 0:
-                            return
+    def _watch(self, jobid, workdir, future):
+        """Watch the job *jobid* and resolve *future* with its exit code (see :meth:`_account`) when it is not in the queue any more."""
+        s = self.settings
+        def update(present):
+            if jobid in present:
+                return False
+            if 'accounting' in s.commands:
+                _accounting.submit(self._account, jobid, workdir, future)
+            else:
+                future.set_result(0)
+            return True
+        _poller.watch(s, lambda: [jobid], update, self.sleepstep)
+
+
+    def _account(self, jobid, workdir, future):
+        """Obtain the exit code and resource usage of the finished job *jobid* and resolve *future* with the exit code.
+
+        The command from ``commands.accounting`` is executed, with ``{jobid}`` replaced by *jobid*. Its output is parsed with the function stored in ``commands.usage``, which should return a dictionary with keys ``exitcode`` (integer), ``walltime`` and ``cputime`` (in seconds) and ``maxrss`` (in megabytes), or ``None`` if the job is not known to the accounting system (yet). Unknown values can be ``None``. Since accounting data can appear with some delay, the command is repeated up to three times, every ``sleepstep`` seconds. If no data was obtained, the exit code is assumed to be 0.
+
+        Obtained data is stored and later returned by :meth:`resource_usage`.
+        """
+        s = self.settings
+        usage = None
+        try:
+            for attempt in range(3):
+                if attempt:
                     time.sleep(self.sleepstep)
-            finally:
-                self._mainlock.release()
+                process = saferun(s.commands.accounting.replace('{jobid}', jobid).split(' '), stdout=PIPE, stderr=PIPE)
+                usage = s.commands.usage(process.stdout.decode())
+                if usage and usage.get('exitcode') is not None:
+                    break
+        finally:
+            exitcode = None
+            if usage:
+                exitcode = usage.get('exitcode')
+                log('Resource usage of job {}: {}'.format(jobid, ', '.join('{}={}'.format(k, v) for k, v in usage.items())), 5)
+                with self._usage_lock:
+                    self._usage[workdir] = Settings(usage)
+            else:
+                log('WARNING: Accounting data for job {} not found'.format(jobid), 3)
+            future.set_result(0 if exitcode is None else exitcode)
+
+
+    def resource_usage(self, workdir):
+        """resource_usage(workdir)
+        Return a |Settings| instance describing resources used by the job most recently submitted by this job runner from *workdir*, or ``None`` if they are unknown. They are known only for jobs submitted individually (not in job arrays or pilot jobs) and only if ``commands.accounting`` is defined. The returned instance has the following entries: ``exitcode``, ``walltime`` (in seconds), ``cputime`` (in seconds) and ``maxrss`` (in megabytes).
+
+        Every entry is returned only once, since this method is used by |SingleJob| to store the data in its ``usage`` attribute.
+        """
+        with self._usage_lock:
+            return self._usage.pop(workdir, None)
+
+
+    def _flags(self, runflags):
+        """Return the ``FLAGS`` part of the submit command built from *runflags* (see :meth:`call`)."""
+        s = self.settings
+        ret = ''
+        for k,v in runflags.items():
+            if k in _plams_runflags:
+                continue
+            if k in s.special:
+                ret += ' '+s.special[k]+str(v)
+            else:
+                ret += ' -'+k+' '+str(v)
+        return ret
+
+
+    def _submit_batched(self, runscript, workdir, out, err, runflags):
+        """Add *runscript* to the batch of runscripts with the same submit flags and return the future of the corresponding :class:`_GridTask`. Start a timer submitting the batch after ``batch_window`` seconds if this is the first runscript in the batch, submit the batch immediately if it reached ``batch_size``."""
+        task = _GridTask(runscript, workdir, out, err)
+        flags = self._flags(runflags)
+        with self._batch_lock:
+            if flags not in self._batches:
+                self._batches[flags] = []
+                timer = threading.Timer(self.batch_window, self._submit_batch, args=(flags, self._batches[flags]))
+                timer.daemon = True
+                timer.start()
+            batch = self._batches[flags]
+            batch.append(task)
+            full = len(batch) >= self.batch_size
+        if full:
+            self._submit_batch(flags, batch)
+        return task.future
+
+
+    def _submit_batch(self, flags, batch):
+        """Submit *batch* (a list of :class:`_GridTask` instances) as a single job array with submit flags *flags*. Do nothing if *batch* was already submitted.
+
+        Tasks of the submitted job array are finished as soon as their exit code files appear. Tasks that did not produce such a file are considered crashed if their job array is still absent from the queue during the next check after it disappeared from it.
+        """
+        with self._batch_lock:
+            if self._batches.get(flags) is not batch:
+                return
+            del self._batches[flags]
+
+        s = self.settings
+        batch_dir = self.batch_dir or opj(config.default_jobmanager.workdir, 'gridrunner_arrays')
+        os.makedirs(batch_dir, exist_ok=True)
+        name = 'array{}'.format(next(self._batch_counter))
+        script = opj(batch_dir, name+'.run')
+
+        lines = [config.job.runscript.shebang, '', 'case ${} in'.format(s.array.taskid)]
+        for i, task in enumerate(batch):
+            task.exitfile = opj(batch_dir, '{}.{}.exit'.format(name, i))
+            redirect = '2>{}'.format(shlex.quote(task.err))
+            if task.out is not None:
+                redirect = '>{} '.format(shlex.quote(task.out)) + redirect
+            lines.append('{}) cd {} && ./{} {}; echo $? >{} ;;'.format(i, shlex.quote(task.workdir), shlex.quote(task.runscript), redirect, shlex.quote(task.exitfile)))
+        lines.append('esac')
+        with open(script, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+        cmd = ' '.join([s.commands.submit, s.workdir, batch_dir, s.error, opj(batch_dir, name+'.err'), s.output, opj(batch_dir, name+'.out')])
+        cmd += ' ' + s.array.flag + '0-{}'.format(len(batch)-1)
+        cmd += flags + ' ' + script
+
+        log('Submitting job array {} with {} tasks with command {}'.format(name, len(batch), cmd), 5)
+        process = saferun(cmd.split(' '), stdout=PIPE, stderr=PIPE)
+        subout = process.stdout.decode()
+        log('Output of {} submit command: {}'.format(name, subout), 5)
+
+        jobid = s.commands.getid(subout)
+        if jobid is None:
+            log('Submitting of job array {} failed. Stderr of submit command:\n{}'.format(name, process.stderr.decode()), 1)
+            for task in batch:
+                task.finish(1)
+            return
+        log('Job array {} with {} tasks submitted successfully as job {}'.format(name, len(batch), jobid), 3)
+
+        def update(present):
+            gone = jobid not in {re.split(r'[_\[]', j)[0] for j in present}
+            for task in batch:
+                task.check(gone)
+            return all(task.future.done() for task in batch)
+        _poller.watch(s, lambda: [jobid], update, self.sleepstep)
 
 
     def _autodetect(self):
@@ -295,3 +1005,186 @@ class GridRunner(JobRunner):
                 log("Grid type autodetected as '{}'".format(grid), 5)
                 return config.gridrunner[grid]
         raise PlamsError('GridRunner: Failed to autodetect grid type')
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class AsyncGridRunner(GridRunner, AsyncJobRunner):
+    """Combination of |GridRunner| and |AsyncJobRunner|. Jobs are executed as :mod:`asyncio` tasks (see |AsyncJobRunner|) and their runscripts are submitted to a queueing system (see |GridRunner|). Waiting for a submitted job does not occupy any thread, the task simply awaits a future resolved by the shared queue poller. That way thousands of queued jobs can be followed from a single event loop.
+
+    All arguments have the same meaning as for |GridRunner|. If *maxjobs* is a positive integer, it limits the number of jobs present in the queue at the same time.
+    """
+    def __init__(self, grid='auto', sleepstep=None, maxjobs=0, batch_window=0, batch_size=1000, batch_dir=None):
+        GridRunner.__init__(self, grid=grid, sleepstep=sleepstep, parallel=True, maxjobs=maxjobs, batch_window=batch_window, batch_size=batch_size, batch_dir=batch_dir)
+        self.maxjobs = maxjobs
+        self._asemaphores = {}
+        self._tasks = set()
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+class PilotRunner(GridRunner):
+    """Subclass of |GridRunner| that executes runscripts inside long-living pilot jobs, instead of submitting every runscript to the queueing system separately.
+
+    When the first runscript arrives, *pilots* pilot jobs are submitted to the queueing system. Each pilot job runs a small executor process (see :mod:`~scm.plams.core.pilot`) that pulls runscripts from this job runner and executes them back-to-back, running up to *slots* of them at the same time. Runscripts are passed to executors through a spool folder on a shared filesystem: a fresh subfolder of *pilot_dir* (by default, the main working folder). Executors exit after being idle for *idle* seconds, or earlier if :meth:`stop` is called. If there are runscripts waiting for execution and less than *pilots* pilot jobs are present in the queue, new pilot jobs are submitted. That way short jobs don't pay the price of waiting in the queue and the queueing system sees only a few long jobs.
+
+    The submit command for pilot jobs is built just like in :meth:`GridRunner.call`, with flags taken from *pilotflags* (a dictionary or |Settings| instance, for example ``{'nodes': 1, 'walltime': '24:00:00'}``). Run flags of individual jobs are ignored, since all of them are executed within resources allocated for pilots. :meth:`~GridRunner.call` puts the runscript in the spool folder and waits until some pilot job executes it. The executor is started with *python* (by default, the interpreter running this script), so that interpreter has to be available on the compute nodes. Executor does not need PLAMS, it uses only the Python standard library.
+
+    Pilot jobs and the spool folder are checked by the shared queue poller (see :class:`_QueuePoller`), at least every *sleepstep* seconds. A runscript executed by a pilot job that left the queue before reporting the exit code (for example, because it ran out of wall time) is considered crashed.
+
+    All other arguments have the same meaning as for |GridRunner|.
+    """
+    def __init__(self, grid='auto', pilots=1, slots=1, idle=60, pilotflags=None, pilot_dir=None, python=None, sleepstep=None, maxjobs=0, maxthreads=0, scheduling=None):
+        GridRunner.__init__(self, grid=grid, sleepstep=sleepstep, parallel=True, maxjobs=maxjobs, maxthreads=maxthreads, scheduling=scheduling)
+        self.pilots = pilots
+        self.slots = slots
+        self.idle = idle
+        self.pilotflags = Settings(pilotflags) if pilotflags else Settings()
+        self.pilot_dir = pilot_dir
+        self.python = python or sys.executable
+        self.spool = None
+        self._tasks = {}
+        self._pilots = {}
+        self._watching = False
+        self._queried = []
+        self._active_lock = threading.Lock()
+        self._task_counter = itertools.count(1)
+        self._pilot_counter = itertools.count(1)
+        self._pilot_lock = threading.Lock()
+
+
+    def stop(self):
+        """Tell all executors to exit as soon as they have nothing left to do, without waiting for the *idle* time to pass."""
+        if self.spool:
+            open(opj(self.spool, 'stop'), 'w').close()
+
+
+    def _submit(self, runscript, workdir, out, err, runflags):
+        """Put *runscript* in the queue of the spool folder and return the future of the corresponding :class:`_GridTask`. Make sure that pilot jobs are present and watched by the queue poller."""
+        spool = self._spool()
+        taskid = '{:08d}'.format(next(self._task_counter))
+        task = _GridTask(runscript, workdir, out, err)
+        task.exitfile = opj(spool, 'done', taskid+'.exit')
+        with self._active_lock:
+            self._tasks[taskid] = task
+
+        taskfile = opj(spool, 'queue', taskid+'.task')
+        with open(taskfile+'.tmp', 'w') as f:
+            json.dump({'runscript': runscript, 'workdir': workdir, 'out': out, 'err': err}, f)
+        os.rename(taskfile+'.tmp', taskfile)
+        log('{} queued for pilot jobs as task {}'.format(runscript, taskid), 5)
+
+        self._ensure_pilots()
+        with self._active_lock:
+            start, self._watching = not self._watching, True
+        if start:
+            _poller.watch(self.settings, self._pilot_ids, self._update, self.sleepstep)
+        return task.future
+
+
+    def _spool(self):
+        """Return the path to the spool folder. Create it if needed."""
+        with self._pilot_lock:
+            if self.spool is None:
+                base = self.pilot_dir or config.default_jobmanager.workdir
+                self.spool = tempfile.mkdtemp(prefix='gridrunner_pilots.', dir=base)
+                for sub in ['queue', 'claimed', 'done']:
+                    os.mkdir(opj(self.spool, sub))
+            return self.spool
+
+
+    def _ensure_pilots(self):
+        """Submit new pilot jobs until *pilots* of them are present. Return the number of present pilot jobs."""
+        with self._pilot_lock:
+            with self._active_lock:
+                missing = self.pilots - len(self._pilots)
+            for i in range(missing):
+                self._submit_pilot()
+            with self._active_lock:
+                return len(self._pilots)
+
+
+    def _submit_pilot(self):
+        """Submit a single pilot job running the executor process."""
+        s = self.settings
+        name = 'pilot{}'.format(next(self._pilot_counter))
+        script = opj(self.spool, name+'.run')
+        executor = opj(os.path.dirname(os.path.abspath(__file__)), 'pilot.py')
+        with open(script, 'w') as f:
+            f.write('{}\n\nexec {} {} {} {} --slots {} --idle {} --poll {}\n'.format(config.job.runscript.shebang, shlex.quote(self.python), shlex.quote(executor), shlex.quote(self.spool), name, self.slots, self.idle, min(self.sleepstep, 1)))
+        os.chmod(script, os.stat(script).st_mode | stat.S_IEXEC)
+
+        cmd = ' '.join([s.commands.submit, s.workdir, self.spool, s.error, opj(self.spool, name+'.err'), s.output, opj(self.spool, name+'.out')])
+        cmd += self._flags(self.pilotflags) + ' ' + script
+
+        log('Submitting pilot job {} with command {}'.format(name, cmd), 5)
+        process = saferun(cmd.split(' '), stdout=PIPE, stderr=PIPE)
+        jobid = s.commands.getid(process.stdout.decode())
+        if jobid is None:
+            log('Submitting of pilot job {} failed. Stderr of submit command:\n{}'.format(name, process.stderr.decode()), 1)
+            return
+        log('Pilot job {} submitted successfully as job {}'.format(name, jobid), 3)
+        with self._active_lock:
+            self._pilots[jobid] = name
+
+
+    def _pilot_ids(self):
+        """Return IDs of pilot jobs to be queried by the queue poller. Remember them, so that pilot jobs submitted after the query started are not considered gone in :meth:`_update`."""
+        with self._active_lock:
+            self._queried = list(self._pilots)
+            return self._queried
+
+
+    def _claimed(self):
+        """Return a dictionary mapping IDs of currently claimed tasks to names of pilot jobs executing them."""
+        ret = {}
+        for filename in os.listdir(opj(self.spool, 'claimed')):
+            pilot, taskid, ext = filename.split('.')
+            ret[taskid] = pilot
+        return ret
+
+
+    def _update(self, present):
+        """Process the result of a queue check performed by the queue poller. *present* is a set of IDs of jobs present in the queue. Finish tasks with exit codes reported by executors, as well as tasks claimed by pilot jobs that are not in the queue any more (see :meth:`_GridTask.check`). Submit new pilot jobs if some tasks are waiting and pilot jobs are missing. Return ``True`` (stop watching) if there are no more active tasks."""
+        claimed = self._claimed()
+        with self._active_lock:
+            for jobid in [j for j in self._queried if j not in present]:
+                log('Pilot job {} ({}) is not in the queue any more'.format(self._pilots[jobid], jobid), 5)
+                del self._pilots[jobid]
+            alive = set(self._pilots.values())
+            for taskid, task in list(self._tasks.items()):
+                task.check(taskid in claimed and claimed[taskid] not in alive)
+                if task.future.done():
+                    del self._tasks[taskid]
+            if len(self._tasks) == 0:
+                self._watching = False
+                return True
+            waiting = [taskid for taskid in self._tasks if taskid not in claimed]
+
+        if waiting and self._ensure_pilots() == 0:
+            self._fail_waiting(waiting)
+        return False
+
+
+    def _fail_waiting(self, waiting):
+        """Finish all tasks from *waiting* that are still in the queue of the spool folder with exit code 1. Used when no pilot job could be submitted."""
+        for taskid in waiting:
+            try:
+                os.remove(opj(self.spool, 'queue', taskid+'.task'))
+            except OSError: #already claimed by some executor
+                continue
+            log('WARNING: No pilot jobs available, task {} cannot be executed'.format(taskid), 1)
+            with self._active_lock:
+                task = self._tasks.pop(taskid, None)
+            if task:
+                task.finish(1)
@@ -0,0 +1,94 @@
+"""Executor process of pilot jobs started by |PilotRunner|.
+
+This module is executed as a standalone script inside every pilot job submitted to a queueing system. It does not import anything from PLAMS (only the standard library), so the Python interpreter running it only needs access to this file.
+
+The executor communicates with the master |PilotRunner| through a spool folder with three subfolders:
+
+*   ``queue`` -- tasks waiting for execution. Each task is a JSON file with the working folder, runscript name and output and error file names.
+*   ``claimed`` -- tasks taken by executors. An executor claims a task by atomically renaming ``queue/ID.task`` to ``claimed/PILOT.ID.task``, so every task is executed exactly once.
+*   ``done`` -- exit codes of finished tasks, one ``ID.exit`` file per task.
+
+An executor runs up to *slots* tasks at the same time and exits when it has been idle (no running tasks and no tasks in the queue) for *idle* seconds or when a file called ``stop`` appears in the spool folder and there is nothing left to do.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import time
+
+from os.path import join as opj
+
+__all__ = []
+
+
+
+def _write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.rename(tmp, path)
+
+
+def _claim(spool, name):
+    """Try to claim the oldest task from the queue. Return a tuple (task ID, task dictionary) or ``None`` if there is nothing to claim."""
+    queue = opj(spool, 'queue')
+    for filename in sorted(f for f in os.listdir(queue) if f.endswith('.task')):
+        taskid = filename[:-len('.task')]
+        claimed = opj(spool, 'claimed', '{}.{}'.format(name, filename))
+        try:
+            os.rename(opj(queue, filename), claimed)
+        except OSError: #some other executor was faster
+            continue
+        with open(claimed) as f:
+            return taskid, json.load(f)
+    return None
+
+
+def _start(task):
+    """Start the runscript of *task* and return a tuple (process, list of opened files)."""
+    files = [open(opj(task['workdir'], task['err']), 'w')]
+    if task['out'] is not None:
+        files.append(open(opj(task['workdir'], task['out']), 'w'))
+    process = subprocess.Popen(['./'+task['runscript']], cwd=task['workdir'], stderr=files[0], stdout=files[1] if len(files) > 1 else None)
+    return process, files
+
+
+def run_executor(spool, name, slots=1, idle=60, poll=0.5):
+    """Main loop of the executor named *name* pulling tasks from the spool folder *spool*."""
+    running = {}
+    last_active = time.time()
+    while True:
+        while len(running) < slots:
+            claimed = _claim(spool, name)
+            if claimed is None:
+                break
+            taskid, task = claimed
+            running[taskid] = _start(task)
+
+        for taskid, (process, files) in list(running.items()):
+            if process.poll() is not None:
+                for f in files:
+                    f.close()
+                _write_atomic(opj(spool, 'done', taskid+'.exit'), str(process.returncode))
+                os.remove(opj(spool, 'claimed', '{}.{}.task'.format(name, taskid)))
+                del running[taskid]
+
+        if running:
+            last_active = time.time()
+        elif not os.listdir(opj(spool, 'queue')):
+            if os.path.exists(opj(spool, 'stop')) or time.time() - last_active > idle:
+                return
+        time.sleep(poll)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PLAMS pilot job executor')
+    parser.add_argument('spool', help='spool folder shared with the master PLAMS process')
+    parser.add_argument('name', help='name of this executor')
+    parser.add_argument('--slots', type=int, default=1, help='number of tasks executed at the same time')
+    parser.add_argument('--idle', type=float, default=60, help='exit after being idle for that many seconds')
+    parser.add_argument('--poll', type=float, default=0.5, help='interval between checks of the spool folder in seconds')
+    args = parser.parse_args()
+    run_executor(args.spool, args.name, args.slots, args.idle, args.poll)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 import copy
@@ -60,6 +61,24 @@ def saferun(*args, **kwargs):
     raise last_error
 
 
+async def asaferun(*args, **kwargs):
+    """Asynchronous counterpart of :func:`saferun`. Start a subprocess with :func:`asyncio.create_subprocess_exec` and wait for it to finish, retrying the start in case of :exc:`OSError` just like :func:`saferun` does. All arguments (*args* and *kwargs*) are passed directly to :func:`~asyncio.create_subprocess_exec`. Returned value is the finished :class:`~asyncio.subprocess.Process`."""
+    attempt = 0
+    (repeat, delay) = (config.saferun.repeat, config.saferun.delay) if ('saferun' in config) else (5,1)
+    while attempt <= repeat:
+        try:
+            process = await asyncio.create_subprocess_exec(*args, **kwargs)
+        except OSError as e:
+            attempt += 1
+            log('asyncio.create_subprocess_exec({}) attempt {} failed with {}'.format(args[0], attempt, e), 5)
+            last_error = e
+            await asyncio.sleep(delay)
+        else:
+            await process.wait()
+            return process
+    raise last_error
+
+
 #===========================================================================
 
 
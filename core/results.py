@@ -1,12 +1,23 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
 import copy
 import functools
-import glob
-import inspect
-import operator
+import mmap
 import os
+import re
 import shutil
+import sys
 import threading
+import time
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from concurrent.futures import Future, ThreadPoolExecutor
 from os.path import join as opj
 from subprocess import PIPE
 
@@ -15,39 +26,32 @@ from .errors import ResultsError, FileError
 from .functions import config, log
 
 
-__all__ = ['Results']
+__all__ = ['Results', 'FileMatch']
 
 
 
-def _caller_name_and_arg(frame):
-    """Extract information about name and arguments of a function call from a *frame* object"""
-    if frame is None:
-        return None, None
-    caller_name = frame.f_code.co_name
-    caller_varnames = frame.f_code.co_varnames
-    caller_arg = None
-    if len(caller_varnames) > 0:
-        try:
-            loc = frame.f_locals
-        except:
-            loc = {}
-        if caller_varnames[0] in loc:
-            caller_arg = loc[caller_varnames[0]]
-    return caller_name, caller_arg
+_finalizing = contextvars.ContextVar('_finalizing', default=None)
+
+
+@contextlib.contextmanager
+def _privileged(job):
+    """Context manager granting privileged access to |Results| methods inside its body. Used by :meth:`~scm.plams.core.basejob.Job._finalize` of *job* around calls to :meth:`~scm.plams.core.basejob.Job.check` and |postrun|.
+
+    The information is stored in a :class:`~contextvars.ContextVar`, so it is visible only in the current thread (or asyncio task) and it is not inherited by threads started inside the body.
+    """
+    token = _finalizing.set(job)
+    try:
+        yield
+    finally:
+        _finalizing.reset(token)
 
 
 def _privileged_access():
-    """Analyze contents of the current stack to find out if privileged access to the |Results| methods should be granted.
+    """Find out if privileged access to the |Results| methods should be granted.
 
-    Privileged access is granted to two |Job| methods: |postrun| and :meth:`~scm.plams.core.basejob.Job.check`, but only if they are called from :meth:`~scm.plams.core.basejob.Job._finalize` of the same |Job| instance.
+    Privileged access is granted to two |Job| methods: |postrun| and :meth:`~scm.plams.core.basejob.Job.check`, but only if they are called from :meth:`~scm.plams.core.basejob.Job._finalize` (which marks such calls with :func:`_privileged`).
     """
-    from .basejob import Job
-    for frame in inspect.getouterframes(inspect.currentframe()):
-        cal, arg = _caller_name_and_arg(frame[0])
-        prev_cal, prev_arg = _caller_name_and_arg(frame[0].f_back)
-        if cal in ['postrun', 'check'] and prev_cal == '_finalize' and arg == prev_arg and isinstance(arg, Job):
-                return True
-    return False
+    return _finalizing.get() is not None
 
 
 def _restrict(func):
@@ -73,9 +77,7 @@ def _restrict(func):
 
         elif self.job.status in ['crashed', 'failed']:
             if func.__name__ == 'wait': #waiting for crashed of failed job should not trigger any warnings/exceptions
-                cal, arg = _caller_name_and_arg(inspect.currentframe())
-                if isinstance(arg, Results):
-                    return func(self, *args, **kwargs)
+                return func(self, *args, **kwargs)
             if config.ignore_failure:
                 log('WARNING: Trying to obtain results of crashed or failed job {}'.format(self.job.name), 3)
                 try:
@@ -107,6 +109,386 @@ def _restrict(func):
 
 
 
+class _AsyncEvent(threading.Event):
+    """A :class:`threading.Event` that can also be awaited from asyncio coroutines without blocking any thread (see :meth:`Results.await_done`).
+
+    Every coroutine waiting with :meth:`wait_async` registers a future in its own event loop. When the event is set, all such futures are resolved in a thread safe way.
+    """
+    def __init__(self):
+        threading.Event.__init__(self)
+        self._waiters = []
+        self._waiters_lock = threading.Lock()
+
+
+    def set(self):
+        threading.Event.set(self)
+        with self._waiters_lock:
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_AsyncEvent._resolve, future)
+            except RuntimeError: #the event loop of the waiting coroutine is already closed
+                pass
+
+
+    async def wait_async(self):
+        """Wait until the event is set, without blocking the event loop."""
+        if self.is_set():
+            return True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._waiters_lock:
+            if self.is_set():
+                return True
+            self._waiters.append((loop, future))
+        await future
+        return True
+
+
+    def __getstate__(self):
+        """Futures of waiting coroutines are bound to their event loops and are never pickled."""
+        state = self.__dict__.copy()
+        state['_waiters'] = []
+        return state
+
+
+    @staticmethod
+    def _resolve(future):
+        if not future.done():
+            future.set_result(True)
+
+
+
+#===========================================================================
+#===========================================================================
+#===========================================================================
+
+
+
+FileMatch = collections.namedtuple('FileMatch', ['lineno', 'offset', 'line'])
+FileMatch.__doc__ = """A line of a text file matching a pattern searched by :meth:`Results.search_file`: the line number (counted from 1), the offset of the beginning of the line in the file (in bytes) and the contents of the line (without the trailing newline)."""
+
+
+class _SearchCache:
+    """Cache of results of :func:`_search`, shared by all |Results| instances. Results are stored separately for every pattern, together with the size, the modification time and the inode number of the file, and they are discarded as soon as any of these changes. The total size of stored lines is limited to about ``maxbytes`` bytes, the least recently used files are forgotten first. Results larger than that limit are not stored at all."""
+    maxbytes = 32 * 1024**2
+
+    def __init__(self):
+        self._files = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+
+    def get(self, path, stamp, keys):
+        """Return a dictionary with stored results for these of *keys* that are present in the cache."""
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None or entry[0] != stamp:
+                return {}
+            self._files.move_to_end(path)
+            return {key: entry[1][key] for key in keys if key in entry[1]}
+
+
+    def put(self, path, stamp, results):
+        sizes = {key: sum(len(m.line) + 64 for m in matches) for key, matches in results.items()}
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None or entry[0] != stamp:
+                self._forget(path)
+                entry = self._files[path] = [stamp, {}, 0]
+            for key, matches in results.items():
+                if sizes[key] <= self.maxbytes and key not in entry[1]:
+                    entry[1][key] = matches
+                    entry[2] += sizes[key]
+                    self._bytes += sizes[key]
+            self._files.move_to_end(path)
+            while self._bytes > self.maxbytes:
+                self._forget(next(iter(self._files)))
+
+
+    def _forget(self, path):
+        entry = self._files.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+
+_search_cache = _SearchCache()
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _search(path, patterns, regex=False):
+    """Search the file *path* for all *patterns* (strings) in a single pass and return a dictionary with a list of :class:`FileMatch` for every pattern.
+
+    The file is memory-mapped and searched with a single compiled regular expression matching any of *patterns*, so only the matching lines are processed in Python. Each matching line is then tested against all *patterns*, so a line matching more than one pattern is reported for each of them. If *regex* is ``False``, *patterns* are plain substrings. Otherwise they are Python regular expressions, matched within single lines. Patterns already searched for in the current version of the file are taken from the cache and not searched again. Results for the empty pattern, which matches every line, are never cached.
+    """
+    stamp = _stamp(path)
+    cached = _search_cache.get(path, stamp, [(p, regex) for p in patterns])
+    ret = {p: cached[(p, regex)] for p in patterns if (p, regex) in cached}
+    missing = [p for p in dict.fromkeys(patterns) if p not in ret]
+    if not missing:
+        return ret
+
+    found = {p: [] for p in missing}
+    compiled = [re.compile(p.encode() if regex else re.escape(p.encode()), re.MULTILINE) for p in missing]
+    anyof = re.compile(b'|'.join(b'(?:' + c.pattern + b')' for c in compiled), re.MULTILINE)
+    if stamp[0]:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = lineno = counted = 0
+            while pos < len(mm):
+                m = anyof.search(mm, pos)
+                if m is None:
+                    break
+                begin = mm.rfind(b'\n', 0, m.start()) + 1
+                end = mm.find(b'\n', m.start())
+                if end == -1:
+                    end = len(mm)
+                lineno += mm[counted:begin].count(b'\n')
+                counted = begin
+                line = mm[begin:end]
+                text = None
+                for p, c in zip(missing, compiled):
+                    if c.search(line):
+                        if text is None:
+                            text = line.decode(errors='replace').rstrip('\r')
+                        found[p].append(FileMatch(lineno+1, begin, text))
+                pos = end + 1
+    _search_cache.put(path, stamp, {(p, regex): v for p, v in found.items() if p})
+    ret.update(found)
+    return ret
+
+
+def _chunks(path, begin, end):
+    """Return a list of chunks of the file *path* delimited by lines containing *begin* and *end*, following the rules of :meth:`Results.get_file_chunk`.
+
+    Every chunk is a pair of byte offsets: the beginning of the line containing *begin* (or ``None`` if *begin* is ``None``) and the beginning of the line containing *end* (or ``None`` if the chunk extends until the end of the file). The offsets are computed from locations of *begin* and *end* found by :func:`_search`, so the file is read at most once for every marker, no matter how many chunks are extracted.
+    """
+    found = _search(path, [m for m in (begin, end) if m])
+    events = {}
+    for m in found.get(begin, []) if begin else []:
+        events.setdefault(m.offset, [False, False])[0] = True
+    for m in found.get(end, []) if end else []:
+        events.setdefault(m.offset, [False, False])[1] = True
+
+    ret = []
+    current = [None, None] if begin is None else None
+    for offset in sorted(events):
+        has_begin, has_end = events[offset]
+        if current and has_end:
+            current[1] = offset
+            ret.append(tuple(current))
+            current = None
+            if begin is None:
+                return ret
+        if current is None and has_begin:
+            current = [offset, None]
+    if current:
+        ret.append(tuple(current))
+    return ret
+
+
+def _read_chunks(path, chunks, inc_begin=False, inc_end=False):
+    """Generate contents of *chunks* (as returned by :func:`_chunks`) of the file *path*, each as a list of lines. Only the required parts of the file are read."""
+    if not chunks:
+        return
+    if not os.path.getsize(path):
+        yield from ([] for chunk in chunks)
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for first, last in chunks:
+            start = 0 if first is None else (first if inc_begin else _line_end(mm, first) + 1)
+            stop = len(mm) if last is None else (_line_end(mm, last) if inc_end else last)
+            if start >= stop:
+                yield []
+                continue
+            lines = mm[start:stop].decode(errors='replace').split('\n')
+            if lines[-1] == '':
+                lines.pop()
+            yield [line[:-1] if line.endswith('\r') else line for line in lines]
+
+
+def _line_end(mm, offset):
+    end = mm.find(b'\n', offset)
+    return len(mm) if end == -1 else end
+
+
+def _glob_regex(pattern):
+    """Translate a shell-style wildcard *pattern* to a regular expression, following the rules of :func:`glob.glob`: wildcards do not match ``/``."""
+    ret = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            ret.append('[^/]*')
+        elif c == '?':
+            ret.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j == -1:
+                ret.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                elif stuff[0] == '^':
+                    stuff = '\\' + stuff
+                ret.append('(?!/)[{}]'.format(stuff))
+        else:
+            ret.append(re.escape(c))
+    return ''.join(ret)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_glob(pattern, ch=''):
+    """Compile a regular expression matching paths matched by a shell-style wildcard *pattern* in which ``$CH`` is replaced by the regular expression *ch* (for the first occurrence) and the backreference to it (for the following ones)."""
+    ret = []
+    for component in pattern.split('/'):
+        if not component.startswith('.') and any(c in component for c in '*?['):
+            ret.append('(?!\\.)')
+        for k, piece in enumerate(component.split('$CH')):
+            if k:
+                ret.append(ch)
+                ch = '(?P=ch)'
+            ret.append(_glob_regex(piece))
+        ret.append('/')
+    return re.compile(''.join(ret[:-1]) + '\\Z', re.DOTALL)
+
+
+def _save_matcher(patterns, jobname, childnames):
+    """Compile a list of keep/save *patterns* (see |cleaning|) of a job called *jobname* with children called *childnames* (a set) and return a function telling if a path relative to the job folder matches any of them.
+
+    The result is the same as comparing the path with all paths returned by :func:`glob.glob` for every pattern with ``$JN`` replaced by *jobname* and ``$CH`` by every element of *childnames*, but the job folder is not accessed. Patterns without wildcards are compared as strings and the other ones are compiled to regular expressions, cached for other jobs. ``$CH`` is first matched with any name, which is then looked up in *childnames*. Only if that fails for a pattern in which child names can be matched in more than one way (like ``$CH*``), a regular expression listing all *childnames* is compiled and used.
+    """
+    literal = set()
+    compiled = []
+    for pattern in patterns:
+        pattern = pattern.replace('$JN', jobname)
+        if '$CH' in pattern:
+            compiled.append([_compile_glob(pattern, '(?P<ch>[^/]+)'), pattern])
+        elif any(c in pattern for c in '*?['):
+            compiled.append([_compile_glob(pattern), None])
+        else:
+            literal.add(pattern)
+
+    def matches(name):
+        name = name.replace(os.sep, '/')
+        if name in literal:
+            return True
+        for entry in compiled:
+            m = entry[0].match(name)
+            if m and (entry[1] is None or m.group('ch') in childnames):
+                return True
+            if m and childnames:
+                if isinstance(entry[1], str):
+                    entry[1] = _compile_glob.__wrapped__(entry[1], '(?P<ch>{})'.format('|'.join(map(re.escape, sorted(childnames)))))
+                if entry[1].match(name):
+                    return True
+        return False
+    return matches
+
+
+class _Transfer:
+    """Transfer of files between job folders, used by :meth:`Results._copy_to`.
+
+    Every file is first cloned with a copy-on-write reflink (on Linux file systems supporting it, like Btrfs or XFS), which is instant and does not take any additional disk space, but leaves both files independent. If that is not possible, the file is hardlinked (if allowed) or copied. Pairs of file systems not supporting reflinks are remembered, so the attempt is not repeated for every file. Files larger than ``large`` bytes are copied concurrently by ``threads`` threads.
+    """
+    threads = 4
+    large = 1 << 24
+    _FICLONE = 0x40049409
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._noreflink = set()
+        self._running = {}
+        self._executor = None
+
+
+    def file(self, src, dst, link=False):
+        """Make *dst* a copy of *src*, creating its folder if needed. Return the method used: ``'reflink'``, ``'hardlink'`` or ``'copy'``. Hardlinks are used only if *link* is ``True``."""
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if self._reflink(src, dst):
+            return 'reflink'
+        if link and os.name == 'posix':
+            try:
+                os.link(src, dst)
+                return 'hardlink'
+            except OSError:
+                pass
+        shutil.copy(src, dst)
+        return 'copy'
+
+
+    def files(self, pairs, link=False):
+        """Transfer all (*src*, *dst*) *pairs* with :meth:`file`. Large files are transferred in parallel, the other ones by the calling thread."""
+        large = []
+        for src, dst in pairs:
+            if self.threads > 1 and os.path.getsize(src) >= self.large:
+                large.append((src, dst))
+            else:
+                self.file(src, dst, link)
+        if large:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='plamstransfer')
+            futures = [self._executor.submit(self.file, src, dst, link) for src, dst in large]
+            for future in futures:
+                future.result()
+
+
+    def once(self, src, dst, link=False):
+        """Transfer *src* to *dst* with :meth:`file`, unless *dst* already exists. If another thread is transferring *dst* at the same time, wait for it to finish instead."""
+        with self._lock:
+            future = self._running.get(dst)
+            owner = future is None
+            if owner:
+                future = self._running[dst] = Future()
+        if owner:
+            try:
+                if not os.path.lexists(dst):
+                    self.file(src, dst, link)
+                future.set_result(None)
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._running[dst]
+        future.result()
+
+
+    def _reflink(self, src, dst):
+        if fcntl is None or not sys.platform.startswith('linux'):
+            return False
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dst)).st_dev)
+        if devices in self._noreflink:
+            return False
+        error = None
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), self._FICLONE, fsrc.fileno())
+            except OSError as e:
+                error = e
+        if error is None:
+            shutil.copymode(src, dst)
+            return True
+        os.remove(dst)
+        self._noreflink.add(devices)
+        return False
+
+
+_transfer = _Transfer()
+
+
+
 #===========================================================================
 #===========================================================================
 #===========================================================================
@@ -114,11 +496,11 @@ def _restrict(func):
 
 
 class _MetaResults(type):
-    """Metaclass for |Results|. During new |Results| instance creation it wraps all methods with :func:`_restrict` decorator ensuring proper synchronization and thread safety. Methods listed in ``_dont_restrict`` as well as "magic methods" are not wrapped."""
-    _dont_restrict = ['refresh', 'collect', '_clean']
+    """Metaclass for |Results|. During new |Results| instance creation it wraps all methods with :func:`_restrict` decorator ensuring proper synchronization and thread safety. Methods listed in ``_dont_restrict``, static and class methods, as well as "magic methods" are not wrapped."""
+    _dont_restrict = ['refresh', 'collect', '_clean', 'await_done', '_set_files', '_has_file', '_to_delete', '_copy_pending', '_materialize']
     def __new__(meta, name, bases, dct):
         for attr in dct:
-            if not (attr.endswith('__') and attr.startswith('__')) and callable(dct[attr]) and (attr not in _MetaResults._dont_restrict):
+            if not (attr.endswith('__') and attr.startswith('__')) and callable(dct[attr]) and not isinstance(dct[attr], (staticmethod, classmethod)) and (attr not in _MetaResults._dont_restrict):
                 dct[attr] = _restrict(dct[attr])
         return type.__new__(meta, name, bases, dct)
 
@@ -135,6 +517,8 @@ class Results(metaclass=_MetaResults):
 
     ``job`` attribute stores a reference to associated job. ``files`` attribute is a list with contents of the job folder. ``_rename_map`` is a class attribute with the dictionary storing the default renaming scheme.
 
+    Membership tests used by PLAMS are answered by a set mirroring ``files`` (so ``files`` should not be modified directly, use :meth:`refresh` instead) and the modification times of all folders scanned by :meth:`refresh` are remembered, so refreshing an unchanged job folder does not list it again.
+
     Bracket notation (``myresults[filename]``) can be used to obtain full absolute paths to files in the job folder.
 
     Instance methods are automatically wrapped with the "access guardian" that ensures thread safety (see |parallel|).
@@ -143,23 +527,87 @@ class Results(metaclass=_MetaResults):
 
     def __init__(self, job):
         self.job = job
-        self.files = []
+        self._set_files([])
         self.finished = threading.Event()
-        self.done = threading.Event()
+        self.done = _AsyncEvent()
+
+
+    def __getstate__(self):
+        """The set mirroring ``files``, remembered modification times of folders and files whose copying was deferred by :meth:`_copy_to` are not pickled. Deferred files are also removed from the pickled ``files``, since they are not present in the job folder yet."""
+        state = self.__dict__.copy()
+        pending = state.pop('_pending', None)
+        if pending:
+            state['files'] = [f for f in self.files if f not in pending]
+        state.pop('_fileset', None)
+        state.pop('_dirstamps', None)
+        return state
+
+
+    def __setstate__(self, state):
+        """Rebuild the set mirroring ``files``."""
+        self.__dict__.update(state)
+        self._set_files(self.files)
 
 
     def refresh(self):
-        """Refresh the contents of the ``files`` list. Traverse the job folder (and all its subfolders) and collect relative paths to all files found there, except files with ``.dill`` extension.
+        """Refresh the contents of the ``files`` list. Traverse the job folder (and all its subfolders) and collect relative paths to all files found there, except files with ``.dill`` extension and their metadata sidecars (``.dill.json``).
 
         This is a cheap and fast method that should be used every time there is a risk the contents of the job folder changed and ``files`` is no longer up-to-date. For proper working of various PLAMS elements it is crucial that ``files`` always contains up-to-date information about the contents of the job folder.
 
         All functions and methods defined in PLAMS that could change the state of the job folder refresh the ``files`` list, so there is no need to manually call :meth:`~Results.refresh` after, for example, :meth:`~Results.rename`. If you are implementing a new method of that kind, please don't forget about refreshing.
+
+        If none of the folders scanned by the previous call was modified since then (according to their modification times), the folder is not traversed again. Modification times from the last two seconds before the previous scan are not trusted, because of the limited resolution of timestamps of some file systems.
         """
-        self.files = []
-        for pth, dirs, files in os.walk(self.job.path):
-            relpath = os.path.relpath(pth, self.job.path)
-            self.files += [opj(relpath, x) if relpath != '.' else x for x in files]
-        self.files = [x for x in self.files if not x.endswith('.dill')]
+        path = self.job.path
+        stamps = getattr(self, '_dirstamps', None)
+        if stamps and None not in stamps.values():
+            try:
+                if all(os.stat(opj(path, d)).st_mtime_ns == m for d, m in stamps.items()):
+                    return
+            except OSError:
+                pass
+
+        files = []
+        stamps = {}
+        limit = time.time_ns() - 2 * 10**9
+        def scan(rel):
+            full = opj(path, rel) if rel else path
+            mtime = os.stat(full).st_mtime_ns
+            stamps[rel] = mtime if mtime < limit else None
+            subdirs = []
+            with os.scandir(full) as entries:
+                for entry in entries:
+                    name = opj(rel, entry.name) if rel else entry.name
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append(name)
+                    elif not name.endswith(('.dill', '.dill.json')):
+                        files.append(name)
+            for d in subdirs:
+                scan(d)
+
+        try:
+            scan('')
+        except OSError:
+            stamps = None
+        pending = getattr(self, '_pending', None)
+        if pending:
+            found = set(files)
+            files += [name for name in pending if name not in found]
+        self._set_files(files)
+        self._dirstamps = stamps
+
+
+    def _set_files(self, files):
+        """Set ``files`` to *files* (a list) and update the set used by :meth:`_has_file`. The remembered state of the job folder is forgotten, so the next :meth:`refresh` traverses it again."""
+        self.files = files
+        self._fileset = set(files)
+        self._dirstamps = None
+
+
+    def _has_file(self, name):
+        """Check if *name* is present in ``files``, using the set mirroring it. Every change of ``files`` should be followed by :meth:`_set_files`, otherwise the set gets out of date."""
+        return name in self._fileset
 
 
     def collect(self):
@@ -168,13 +616,16 @@ class Results(metaclass=_MetaResults):
         If you wish to override this function, you have to call the parent version at the beginning.
         """
         self.refresh()
+        renamed = False
         for old, new in self.__class__._rename_map.items():
             old = old.replace('$JN', self.job.name)
             new = new.replace('$JN', self.job.name)
-            if old in self.files:
+            if self._has_file(old):
                 os.rename(opj(self.job.path, old), opj(self.job.path, new))
                 self.files[self.files.index(old)] = new
-        self.refresh()
+                renamed = True
+        if renamed:
+            self._set_files(list(dict.fromkeys(self.files)))
 
 
     def wait(self):
@@ -188,6 +639,18 @@ class Results(metaclass=_MetaResults):
         pass
 
 
+    async def await_done(self):
+        """await_done()
+        Asynchronous counterpart of :meth:`~Results.wait` meant to be used in asyncio coroutines (see :meth:`~scm.plams.core.basejob.Job.arun`). Wait for associated job to finish without blocking the thread running the event loop.
+
+        This method is not wrapped with the :func:`_restrict` decorator, so it never blocks and never raises an exception for jobs that crashed, failed or were run in the preview mode.
+        """
+        if not self.job:
+            raise ResultsError('Using Results not associated with any Job')
+        if self.job.status in ['created', 'started', 'registered', 'running', 'finished']:
+            await self.done.wait_async()
+
+
     def grep_file(self, filename, pattern='', options=''):
         """grep_file(filename, pattern='', options='')
         Execute ``grep`` on a file given by *filename* and search for *pattern*.
@@ -195,11 +658,40 @@ class Results(metaclass=_MetaResults):
         Additional ``grep`` flags can be passed with *options*, which should be a single string containing all flags, space separated.
 
         Returned value is a list of lines (strings). See ``man grep`` for details.
+
+        If there are no *options* and *pattern* contains no characters with a special meaning in basic regular expressions, the search is done in-process with :meth:`search_file`, without starting ``grep``.
         """
+        if pattern and not options and not any(c in pattern for c in '.[]\\*^$'):
+            return [m.line for m in self.search_file(filename, [pattern])[pattern]]
         cmd = ['grep'] + [pattern] + options.split()
         return self._process_file(filename, cmd)
 
 
+    def search_file(self, filename, patterns, regex=False):
+        """search_file(filename, patterns, regex=False)
+        Search a file given by *filename* for all *patterns* (a list of strings) in a single pass, without starting any external process.
+
+        Returned value is a dictionary with a list of :class:`FileMatch` tuples (line number, offset of the line in bytes and the line itself) for every pattern. If *regex* is ``False``, *patterns* are plain substrings, otherwise they are Python regular expressions matched against single lines. Results are cached until the file is modified, so searching the same file for the same patterns again is almost free.
+        """
+        filename = filename.replace('$JN', self.job.name)
+        if not self._has_file(filename):
+            raise FileError('File {} not present in {}'.format(filename, self.job.path))
+        self._materialize(filename)
+        return _search(opj(self.job.path, filename), list(patterns), regex)
+
+
+    def search_output(self, patterns, regex=False):
+        """search_output(patterns, regex=False)
+        Shortcut for :meth:`~Results.search_file` on the output file."""
+        try:
+            output = self.job._filename('out')
+        except AttributeError:
+            raise ResultsError('Job {} does not seem to be an instance of SingleJob, it does not have _filenames dictionary'.format(self.job.name))
+        except KeyError:
+            raise ResultsError('Job {} does not have an output'.format(self.job.name))
+        return self.search_file(output, patterns, regex)
+
+
     def grep_output(self, pattern='', options=''):
         """grep_output(pattern='', options='')
         Shortcut for :meth:`~Results.grep_file` on the output file."""
@@ -253,9 +745,14 @@ class Results(metaclass=_MetaResults):
         old = old.replace('$JN', self.job.name)
         new = new.replace('$JN', self.job.name)
         self.refresh()
-        if old in self.files:
-            os.rename(opj(self.job.path, old), opj(self.job.path, new))
+        if self._has_file(old):
+            pending = getattr(self, '_pending', None)
+            if pending and old in pending:
+                pending[new] = pending.pop(old)
+            else:
+                os.rename(opj(self.job.path, old), opj(self.job.path, new))
             self.files[self.files.index(old)] = new
+            self._set_files(list(dict.fromkeys(self.files)))
         else:
             raise FileError('File {} not present in {}'.format(old, self.job.path))
 
@@ -268,26 +765,14 @@ class Results(metaclass=_MetaResults):
         *begin* and *end* should be simple strings (no regular expressions allowed) or ``None`` (in that case matching is done from the beginning or until the end of the file). If multiple blocks delimited by *begin* end *end* are present in the file, *match* can be used to indicate which one should be printed (*match*=0 prints all of them). *inc_begin* and *inc_end* can be used to include the delimiting lines in the final result (by default they are excluded).
 
         The returned value is a list of strings. *process* can be used to provide a function executed on each element of this list before returning it.
-        """
-        current_match = 0
-        ret = []
-        switch = (begin == None)
-
-        append = lambda x: ret.append(x.rstrip('\n')) if (match in [0,current_match]) else None
-
-        with open(self[filename], 'r') as f:
-            for line in f:
-                if switch and end and (end in line):
-                    switch = False
-                    if inc_end: append(line)
-                    if match == current_match: break
-                if switch:
-                    append(line)
-                if (not switch) and begin and (begin in line):
-                    switch = True
-                    current_match += 1
-                    if inc_begin: append(line)
 
+        Locations of *begin* and *end* are found in a single pass over the file and cached (see :meth:`search_file`) until the file is modified, so extracting subsequent chunks delimited by the same lines only reads these chunks. To extract many different chunks from a large file, all the delimiters can be indexed at once by passing them together to :meth:`search_file` beforehand.
+        """
+        path = self[filename]
+        chunks = _chunks(path, begin, end)
+        if match:
+            chunks = chunks[match-1:match] if begin is not None else []
+        ret = [line for chunk in _read_chunks(path, chunks, inc_begin, inc_end) for line in chunk]
         return list(map(process, ret)) if process else ret
 
 
@@ -301,6 +786,26 @@ class Results(metaclass=_MetaResults):
         return self.get_file_chunk(output, begin, end, match, inc_begin, inc_end, process)
 
 
+    def iter_file_chunks(self, filename, begin=None, end=None, inc_begin=False, inc_end=False, process=None):
+        """iter_file_chunks(filename, begin=None, end=None, inc_begin=False, inc_end=False, process=None)
+
+        Generate consecutive chunks of a text file given by *filename*, delimited by lines containing *begin* and *end*, as separate lists of strings. Arguments have the same meaning as in :meth:`get_file_chunk`, but only one chunk at a time is read from the file and kept in memory.
+        """
+        path = self[filename]
+        for chunk in _read_chunks(path, _chunks(path, begin, end), inc_begin, inc_end):
+            yield list(map(process, chunk)) if process else chunk
+
+
+    def iter_output_chunks(self, begin=None, end=None, inc_begin=False, inc_end=False, process=None):
+        """iter_output_chunks(begin=None, end=None, inc_begin=False, inc_end=False, process=None)
+        Shortcut for :meth:`~Results.iter_file_chunks` on the output file."""
+        try:
+            output = self.job._filename('out')
+        except AttributeError:
+            raise ResultsError('Job {} is not an instance of SingleJob, it does not have an output'.format(self.job.name))
+        return self.iter_file_chunks(output, begin, end, inc_begin, inc_end, process)
+
+
     def recreate_molecule(self):
         """Recreate the input molecule for the corresponding job based on files present in the job folder. This method is used by |load_external|.
 
@@ -321,42 +826,70 @@ class Results(metaclass=_MetaResults):
 #=======================================================================
 
 
-    def _clean(self, arg):
-        """Clean the job folder. *arg* should be a string or a list of strings. See |cleaning| for details."""
+    def _to_delete(self, arg):
+        """Return the list of files that should be deleted by cleaning with *arg* (see :meth:`_clean`)."""
         if arg == 'all':
-            return
+            return []
 
-        path = self.job.path
-        absfiles = [opj(path, f) for f in self.files]
-        childnames = [child.name for child in self.job] if hasattr(self.job, 'children') else []
         if arg in ['none', [], None]:
-            [os.remove(f) for f in absfiles if os.path.isfile(f)]
+            return list(self.files)
 
-        elif isinstance(arg, list):
+        if isinstance(arg, list):
             rev = False
             if arg[0] == '-':
                 rev = True
                 arg = arg[1:]
+            childnames = {child.name for child in self.job} if hasattr(self.job, 'children') else set()
+            matches = _save_matcher(arg, self.job.name, childnames)
+            return [f for f in self.files if matches(f) == rev]
 
-            absarg = []
-            for i in arg:
-                s = i.replace('$JN', self.job.name)
-                if s.find('$CH') != -1:
-                    absarg += [opj(path, s.replace('$CH', ch)) for ch in childnames]
-                else:
-                    absarg.append(opj(path, s))
+        log('WARNING: {} is not a valid keep/save argument'.format(arg), 3)
+        return []
 
-            if absarg:
-                absarg = functools.reduce(operator.iadd, map(glob.glob, absarg))
 
-            for f in absfiles:
-                if (f in absarg) == rev and os.path.isfile(f):
-                    os.remove(f)
-                    log('Deleting file '+f, 5)
+    def _clean(self, arg):
+        """Clean the job folder. *arg* should be a string or a list of strings. See |cleaning| for details. Files whose copying was deferred by :meth:`_copy_to` are copied, unless they are deleted. Return the number of deleted files."""
+        pending = getattr(self, '_pending', None)
+        gone = set()
+        for f in self._to_delete(arg):
+            if pending and pending.pop(f, None):
+                gone.add(f)
+                continue
+            absf = opj(self.job.path, f)
+            try:
+                os.remove(absf)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            else:
+                log('Deleting file '+absf, 5)
+            gone.add(f)
+        if gone:
+            self._set_files([f for f in self.files if f not in gone])
+        self._copy_pending()
+        return len(gone)
+
+
+    def _copy_pending(self, arg='all'):
+        """Copy all files whose copying was deferred by :meth:`_copy_to`, except these that would be deleted by cleaning with *arg*. The latter are forgotten, as if they were already deleted."""
+        pending = getattr(self, '_pending', None)
+        if not pending:
+            return
+        forgotten = {name for name in self._to_delete(arg) if pending.pop(name, None)}
+        if forgotten:
+            self._set_files([f for f in self.files if f not in forgotten])
+        for name in list(pending):
+            self._materialize(name)
 
-        else:
-            log('WARNING: {} is not a valid keep/save argument'.format(arg), 3)
-        self.refresh()
+
+    def _materialize(self, name):
+        """If copying of the file *name* was deferred by :meth:`_copy_to`, copy it now."""
+        pending = getattr(self, '_pending', None)
+        if pending and name in pending:
+            src, link = pending[name]
+            _transfer.once(src, opj(self.job.path, name), link)
+            pending.pop(name, None)
 
 
     def _copy_to(self, newresults):
@@ -365,18 +898,30 @@ class Results(metaclass=_MetaResults):
 
         This method is used when |RPM| discovers an attempt to run a job identical to a previously run job. Instead of the execution, results of the previous job are copied/linked to the new one.
 
-        This method is called from |Results| of the old job and *newresults* should be |Results| of the new job. The goal is to faithfully recreate the state of this |Results| instance in ``newresults``. To achieve that, all the contents of the job folder are copied (or hardlinked, if your platform allows that and ``job.settings.link_files`` is ``True``) to other's job folder. Moreover, all attributes of this |Results| instance (other than ``job`` and ``files``) are exported to *newresults* using :meth:`~Results._export_attribute` method.
+        This method is called from |Results| of the old job and *newresults* should be |Results| of the new job. The goal is to faithfully recreate the state of this |Results| instance in ``newresults``. To achieve that, all the contents of the job folder are transferred to other's job folder, as copy-on-write reflinks if the file system supports them, otherwise as hardlinks (if your platform allows that and ``job.settings.link_files`` is ``True``) or copies (see :class:`_Transfer`). If the job manager of the new job uses a blob store (see |JobManager|), files are instead put in the store and the folder of the new job gets symbolic links to them, while files of this job are left untouched. Moreover, all attributes of this |Results| instance (other than ``job`` and ``files``) are exported to *newresults* using :meth:`~Results._export_attribute` method.
+
+        If ``lazy_copy`` in ``settings`` of the new job is ``True``, files are not transferred right away, but only when they are accessed for the first time through *newresults* (with the bracket notation or any method processing files), or when the new job is cleaned by |finish|. Subclasses overriding :meth:`~Results._export_attribute` (like ``SCMResults``) usually keep handles to files in the job folder, so for them ``lazy_copy`` is ignored and files are always transferred before attributes are exported.
         """
+        blobs = newresults.job.jobmanager.blobs if newresults.job.jobmanager else None
+        link = self.job.settings.link_files is True
+        lazy = blobs is None and newresults.job.settings.get('lazy_copy') is True and type(self)._export_attribute is Results._export_attribute
+        pending = getattr(self, '_pending', None) or {}
+        pairs = []
         for name in self.files:
             newname = Results._replace_job_name(name, self.job.name, newresults.job.name)
-            args = (opj(self.job.path, name), opj(newresults.job.path, newname))
-            if os.name == 'posix' and self.job.settings.link_files is True:
-                os.link(*args)
+            src, srclink = pending.get(name, (opj(self.job.path, name), link))
+            if blobs is not None:
+                self._materialize(name)
+                blobs.link(opj(self.job.path, name), opj(newresults.job.path, newname))
+            elif lazy:
+                newresults.__dict__.setdefault('_pending', {})[newname] = (src, srclink)
             else:
-                shutil.copy(*args)
+                pairs.append((src, opj(newresults.job.path, newname)))
             newresults.files.append(newname)
+        _transfer.files(pairs, link)
+        newresults._set_files(newresults.files)
         for k,v in self.__dict__.items():
-            if k in ['job', 'files', 'done', 'finished']: continue
+            if k in ['job', 'files', 'done', 'finished', '_fileset', '_dirstamps', '_pending']: continue
             newresults.__dict__[k] = self._export_attribute(v, newresults)
 
 
@@ -401,7 +946,8 @@ class Results(metaclass=_MetaResults):
     def __getitem__(self, name):
         """Magic method to enable bracket notation. Elements from ``files`` can be used to get absolute paths."""
         name = name.replace('$JN', self.job.name)
-        if name in self.files:
+        if self._has_file(name):
+            self._materialize(name)
             return opj(self.job.path, name)
         else:
             raise FileError('File {} not present in {}'.format(name, self.job.path))
@@ -413,7 +959,8 @@ class Results(metaclass=_MetaResults):
         Skeleton for all file processing methods. Execute *command* (should be a list of strings) on *filename* and return output as a list of lines.
         """
         filename = filename.replace('$JN', self.job.name)
-        if filename in self.files:
+        if self._has_file(filename):
+            self._materialize(filename)
             process = saferun(command + [filename], cwd=self.job.path, stdout=PIPE)
             if process.returncode != 0:
                 return []
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+from .functions import config, log
+
+__all__ = []
+
+
+
+class _Tracer:
+    """Recorder of time spent by jobs in consecutive phases of their life cycle, used when ``config.trace`` is ``True``.
+
+    Phases are recorded with :meth:`span` (a context manager), :meth:`start` and :meth:`stop` (for phases that begin and end in different places of the code) or :meth:`add` (for phases with known boundaries). When tracing is disabled, all these methods return immediately.
+
+    Recorded phases can be exported with :meth:`export` to a JSON file in the Chrome trace event format, which can be opened in ``chrome://tracing`` or in `Perfetto <https://ui.perfetto.dev>`_, with every job shown in a separate row. :meth:`summary` returns a table with the number of occurrences and the total, mean and maximal duration of each phase. Both are done by |finish|.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self.events = []
+        self._jobs = {}
+        self._open = {}
+
+
+    @staticmethod
+    def enabled():
+        return bool(config.get('trace'))
+
+
+    @contextmanager
+    def span(self, job, phase):
+        """Record the time spent by *job* in *phase* inside the ``with`` block."""
+        if not self.enabled():
+            yield
+            return
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(job, phase, begin, time.perf_counter())
+
+
+    def start(self, job, phase):
+        """Mark the beginning of *phase* of *job*."""
+        if self.enabled():
+            with self._lock:
+                self._open[(id(job), phase)] = time.perf_counter()
+
+
+    def stop(self, job, phase):
+        """Mark the end of *phase* of *job* started earlier with :meth:`start`."""
+        if self.enabled():
+            with self._lock:
+                begin = self._open.pop((id(job), phase), None)
+            if begin is not None:
+                self.add(job, phase, begin, time.perf_counter())
+
+
+    def add(self, job, phase, begin, end):
+        """Record *phase* of *job* between *begin* and *end*, given as values of :func:`time.perf_counter`."""
+        if self.enabled():
+            with self._lock:
+                tid = self._jobs.setdefault(id(job), [len(self._jobs)+1, job.name])
+                tid[1] = job.name
+                self.events.append((tid[0], phase, begin, end, threading.get_ident()))
+
+
+    def clear(self):
+        with self._lock:
+            self._t0 = time.perf_counter()
+            self.events = []
+            self._jobs = {}
+            self._open = {}
+
+
+    def export(self, filename):
+        """Write recorded phases to *filename* in the Chrome trace event format. Timestamps are in microseconds since the creation of this instance (or the last :meth:`clear`)."""
+        with self._lock:
+            events = list(self.events)
+            jobs = list(self._jobs.values())
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}} for tid, name in jobs]
+        for tid, phase, begin, end, thread in events:
+            trace.append({'name': phase, 'cat': 'job', 'ph': 'X', 'pid': 1, 'tid': tid, 'ts': round((begin - self._t0) * 1e6, 1), 'dur': round((end - begin) * 1e6, 1), 'args': {'thread': thread}})
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+    def summary(self):
+        """Return a string with a table summarizing recorded phases, sorted by the total time spent in them."""
+        with self._lock:
+            events = list(self.events)
+            njobs = len(self._jobs)
+        stats = {}
+        for tid, phase, begin, end, thread in events:
+            s = stats.setdefault(phase, [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += end - begin
+            s[2] = max(s[2], end - begin)
+        lines = ['Time spent in phases of the life cycle of {} jobs:'.format(njobs)]
+        lines.append('{:<12}{:>8}{:>12}{:>12}{:>12}'.format('phase', 'count', 'total [s]', 'mean [s]', 'max [s]'))
+        for phase, (count, total, longest) in sorted(stats.items(), key=lambda x: -x[1][1]):
+            lines.append('{:<12}{:>8}{:>12.3f}{:>12.4f}{:>12.3f}'.format(phase, count, total, total/count, longest))
+        return '\n'.join(lines)
+
+
+_tracer = _Tracer()
@@ -239,6 +239,10 @@ rst_epilog = """
 
 .. |JobRunner| replace:: :class:`~scm.plams.core.jobrunner.JobRunner`
 .. |GridRunner| replace:: :class:`~scm.plams.core.jobrunner.GridRunner`
+.. |SlotRunner| replace:: :class:`~scm.plams.core.jobrunner.SlotRunner`
+.. |PilotRunner| replace:: :class:`~scm.plams.core.jobrunner.PilotRunner`
+.. |AsyncJobRunner| replace:: :class:`~scm.plams.core.jobrunner.AsyncJobRunner`
+.. |AsyncGridRunner| replace:: :class:`~scm.plams.core.jobrunner.AsyncGridRunner`
 
 .. |Settings| replace:: :class:`~scm.plams.core.settings.Settings`
 .. |Results| replace:: :class:`~scm.plams.core.results.Results`
@@ -540,8 +540,8 @@ class AMSJob(SingleJob):
         All instances of |AMSJob| or |AMSResults| present as values in ``settings.input`` branch are replaced with hashes of corresponding job's inputs. Instances of |KFFile| are replaced with absolute paths to corresponding files.
         """
         special = {
-            AMSJob: lambda x: x.hash_input(),
-            AMSResults: lambda x: x.job.hash_input(),
+            AMSJob: lambda x: x._hash_part('input'),
+            AMSResults: lambda x: x.job._hash_part('input'),
             KFFile: lambda x: x.path,
             tuple: lambda x: AMSJob._tuple2rkf(x)
         }
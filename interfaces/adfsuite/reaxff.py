@@ -74,6 +74,16 @@ class ReaxFFJob(SingleJob):
         return None
 
 
+    def hash_normalized(self, precision=None):
+        """Disable hashing for ReaxFF jobs also in the ``normalized`` hashing mode, for the reasons given in :meth:`hash_input`."""
+        return None
+
+
+    def hash_fuzzy(self, tolerance=None, precision=None):
+        """Disable hashing for ReaxFF jobs also in the ``fuzzy`` hashing mode, for the reasons given in :meth:`hash_input`."""
+        return None
+
+
     def _get_ready(self):
         """Prepare contents of the job folder for execution.
 
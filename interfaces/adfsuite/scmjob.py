@@ -256,8 +256,8 @@ class SCMJob(SingleJob):
         All instances of |SCMJob| or |SCMResults| present as values in ``settings.input`` branch are replaced with hashes of corresponding job's inputs.
         """
         special = {
-            SCMJob: lambda x: x.hash_input(),
-            SCMResults: lambda x: x.job.hash_input(),
+            SCMJob: lambda x: x._hash_part('input'),
+            SCMResults: lambda x: x.job._hash_part('input'),
             KFFile: lambda x: x.path
         }
         return sha256(self._serialize_input(special))
@@ -20,14 +20,14 @@ setup(
             'Development Status :: 5 - Production/Stable',
             'Intended Audience :: Science/Research',
             'Operating System :: OS Independent',
-            'Programming Language :: Python :: 3.6',
+            'Programming Language :: Python :: 3.7',
             'Topic :: Scientific/Engineering :: Chemistry',
             'Topic :: Scientific/Engineering :: Physics',
             'Topic :: Scientific/Engineering :: Bio-Informatics',
             'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     keywords         = ['molecular modeling', 'computational chemistry', 'workflow', 'python interface'],
-    python_requires  = '>=3.6',
+    python_requires  = '>=3.7',
     install_requires = ['dill>=0.2.4', 'numpy'],
     packages         = packages,
     package_dir      = {'scm.plams': '.'},
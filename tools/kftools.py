@@ -48,6 +48,14 @@ class KFReader:
             self._autodetect()
 
 
+    def __getstate__(self):
+        """The index of the file is a cache that can be big for large files, so it is not pickled. It is recreated on the first use after unpickling."""
+        state = self.__dict__.copy()
+        state['_sections'] = None
+        state.pop('_data', None)
+        return state
+
+
     def read(self, section, variable):
         """Extract and return data for a *variable* located in a *section*.
 
@@ -0,0 +1,252 @@
+import json
+import os
+import shutil
+import subprocess
+
+from scm.plams import SingleJob, MultiJob, JobManager, GridRunner, Settings, config, init, finish, load_all
+
+
+class TrivialJob(SingleJob):
+    def get_input(self):
+        return 'value {}'.format(self.settings.input.value)
+
+    def get_runscript(self):
+        return 'echo done\n'
+
+
+def test_hash_index(tmp_path):
+    """Test rerun prevention across job managers (separate runs) with the persistent hash index."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    settings = config.jobmanager.copy()
+    settings.hash_index = str(tmp_path / 'cache')
+
+    def run(folder, value):
+        jm = JobManager(settings, path=str(tmp_path), folder=folder)
+        job = TrivialJob(name='job')
+        job.settings.input.value = value
+        job.run(jobmanager=jm)
+        job.results.wait()
+        return job, jm
+
+    first, jm1 = run('first', 1)
+    second, jm2 = run('second', 1)
+    third, jm3 = run('third', 2)
+    assert [first.status, second.status, third.status] == ['successful', 'copied', 'successful']
+    assert jm2.hashes[second.hash()].path == first.path
+
+    shutil.rmtree(jm1.workdir)
+    fourth, jm4 = run('fourth', 1)
+    assert fourth.status == 'successful'
+    assert jm4.index.get(fourth.hash()).startswith(jm4.workdir)
+
+    #the hash of a loaded job is calculated anew, so a job pickled with different settings is not reused
+    h = fourth.hash()
+    fourth.settings.input.value = 5
+    fourth.pickle()
+    fifth, jm5 = run('fifth', 1)
+    assert fifth.status == 'successful' and fifth.hash() == h
+    assert jm5.index.get(h).startswith(jm5.workdir)
+    finish([jm1, jm2, jm3, jm4, jm5])
+
+
+def test_blob_store(tmp_path):
+    """Test sharing files of copied jobs through the content-addressed blob store."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    settings = config.jobmanager.copy()
+    settings.blob_store = str(tmp_path / 'blobs')
+    jm = JobManager(settings, path=str(tmp_path), folder='blobs_run')
+    jobs = [TrivialJob(name='job{}'.format(i)) for i in range(3)]
+    for job in jobs:
+        job.settings.input.value = 1
+        job.run(jobmanager=jm)
+        job.results.wait()
+    assert [job.status for job in jobs] == ['successful', 'copied', 'copied']
+
+    out = [os.path.realpath(job.results[job.name+'.out']) for job in jobs]
+    assert out[1] == out[2] and out[1].startswith(jm.blobs.path)
+    assert not os.path.islink(jobs[0].results[jobs[0].name+'.out'])
+    assert os.access(out[0], os.W_OK)
+    assert all(job.results.grep_output('done') == ['done'] for job in jobs)
+    finish([jm])
+
+
+def test_lazy_load_all(tmp_path):
+    """Test :func:`load_all` with stubs created from metadata sidecars."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    settings = config.jobmanager.copy()
+    settings.journal = False
+    jm1 = JobManager(settings, path=str(tmp_path), folder='first')
+    single = TrivialJob(name='single')
+    single.settings.input.value = 1
+    children = [TrivialJob(name='child{}'.format(i)) for i in range(2)]
+    for i, child in enumerate(children):
+        child.settings.input.value = 10 + i
+    multi = MultiJob(name='multi', children=children)
+    for job in [single, multi]:
+        job.run(jobmanager=jm1)
+        job.results.wait()
+
+    jm2 = JobManager(config.jobmanager, path=str(tmp_path), folder='second')
+    loaded = load_all(jm1.workdir, jobmanager=jm2, lazy=True)
+    assert sorted(stub.name for stub in loaded.values()) == ['multi', 'single']
+    assert all(stub._job is None for stub in loaded.values())
+    assert len(jm2.hashes) == 3
+
+    again = TrivialJob(name='again')
+    again.settings.input.value = 11
+    again.run(jobmanager=jm2)
+    again.results.wait()
+    assert again.status == 'copied'
+    assert again.results.grep_output('done') == ['done']
+    stub = next(stub for stub in loaded.values() if stub.name == 'multi')
+    assert stub._job is not None and stub.children[1].path == stub._children[1].path
+    finish([jm1, jm2])
+
+
+def test_journal(tmp_path):
+    """Test replaying the journal of a crashed run, with finished jobs and a job still in the queue."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    settings = config.jobmanager.copy()
+    settings.journal = True
+    jm1 = JobManager(settings, path=str(tmp_path), folder='first')
+    children = [TrivialJob(name='child{}'.format(i)) for i in range(2)]
+    for i, child in enumerate(children):
+        child.settings.input.value = i
+    multi = MultiJob(name='multi', children=children)
+    multi.run(jobmanager=jm1)
+    multi.results.wait()
+
+    #simulate a job submitted by the crashed run and still running in the queue, with process ID as job ID
+    queued = TrivialJob(name='queued')
+    queued.settings.input.value = 2
+    os.mkdir(os.path.join(jm1.workdir, 'queued'))
+    process = subprocess.Popen(['sh', '-c', 'sleep 1; echo done > queued.out'], cwd=os.path.join(jm1.workdir, 'queued'))
+    with open(jm1.journal.filename, 'a') as f:
+        for entry in [{'event': 'registered', 'name': 'queued', 'class': __name__+'.TrivialJob'}, {'event': 'hash', 'hash': queued.hash(), 'hashing': 'input'},
+                      {'event': 'submitted', 'jobid': str(process.pid), 'workdir': jm1.workdir}, {'event': 'status', 'status': 'running'}]:
+            f.write(json.dumps(dict(entry, job='queued')) + '\n')
+        f.write('{"job": "multi/chi')
+    stub_names = {'multi', 'child0', 'child1', 'queued'}
+
+    grid = Settings()
+    grid.commands.check = 'true'
+    grid.commands.running = lambda output: [] if process.poll() is not None else [str(process.pid)]
+    jm2 = JobManager(config.jobmanager, path=str(tmp_path), folder='second')
+    loaded = jm2.replay_journal(jm1.workdir, jobrunner=GridRunner(grid=grid, sleepstep=0.1))
+    assert {stub.name for stub in loaded.values()} == stub_names
+    assert len(jm2.hashes) == 3
+
+    jobs = [TrivialJob(name='again{}'.format(i)) for i in range(3)]
+    for i, job in enumerate(jobs):
+        job.settings.input.value = i
+        job.run(jobmanager=jm2)
+        job.results.wait()
+    assert [job.status for job in jobs] == ['copied'] * 3
+    assert jobs[2].results.grep_output('done') == ['done']
+    assert os.path.isfile(os.path.join(jm1.workdir, 'queued', 'queued.dill'))
+
+    #a queued job is not reattached if the working folder was moved after submission
+    moved = str(tmp_path / 'moved')
+    shutil.copytree(jm1.workdir, moved)
+    loaded = JobManager(config.jobmanager, path=str(tmp_path), folder='third').replay_journal(moved, jobrunner=GridRunner(grid=grid, sleepstep=0.1))
+    assert {stub.name for stub in loaded.values()} == stub_names - {'queued'}
+    finish([jm1, jm2])
+
+
+def test_background_pickling(tmp_path):
+    """Test pickling jobs in the background, with a short queue and compression."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    settings = config.jobmanager.copy()
+    settings.pickle_queue = 2
+    jm = JobManager(settings, path=str(tmp_path), folder='pickles')
+    jobs = [TrivialJob(name='job{}'.format(i)) for i in range(8)]
+    for i, job in enumerate(jobs):
+        job.settings.input.value = i
+        job.settings.compact_pickle = bool(i % 2)
+        job.run(jobmanager=jm)
+    finish([jm])
+    dills = [os.path.join(job.path, job.name+'.dill') for job in jobs]
+    assert all(os.path.isfile(f) and os.path.isfile(f+'.json') for f in dills)
+    assert [open(f, 'rb').read(2) == b'\x1f\x8b' for f in dills] == [False, True] * 4
+    loaded = [JobManager(settings, path=str(tmp_path)).load_job(f) for f in dills[:2]]
+    assert [job.settings.input.value for job in loaded] == [0, 1]
+
+
+def test_normalized_hashing(tmp_path):
+    """Test the normalized hashing mode and remembering hashes of prepared jobs."""
+    from scm.plams import Molecule, Atom
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    config.default_jobmanager.settings.hashing = 'normalized'
+
+    class CountingJob(TrivialJob):
+        calls = 0
+        def hash_normalized(self, precision=None):
+            CountingJob.calls += 1
+            return TrivialJob.hash_normalized(self, precision)
+
+    def job(value, x):
+        mol = Molecule()
+        mol.add_atom(Atom(symbol='H', coords=(0, 0, 0)))
+        mol.add_atom(Atom(symbol='H', coords=(x, 0, 0)))
+        ret = CountingJob(name='norm', molecule=mol)
+        ret.settings.input.value = value
+        return ret
+
+    first = job(0.1, 0.74)
+    second = job('1.0e-1', 0.7400000001)
+    third = job(0.1, 0.75)
+    assert first.hash() == second.hash() != third.hash()
+    assert first.hash() != job(0.1, 0.74000001).hash_normalized(precision=8)
+    for j in [first, second, third]:
+        j.run().wait()
+    assert [j.status for j in [first, second, third]] == ['successful', 'copied', 'successful']
+
+    calls = CountingJob.calls
+    first.settings.input.value = 0.2
+    assert first.hash() == second.hash() and first._hashcache
+    assert CountingJob.calls == calls
+    finish()
+
+
+def test_fuzzy_hashing(tmp_path):
+    """Test the rerun prevention with geometries matched up to a tolerance, with atoms in the same order."""
+    from scm.plams import Molecule, Atom
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    config.default_jobmanager.settings.hashing = 'fuzzy'
+    config.default_jobmanager.settings.fuzzy_tolerance = 1e-4
+
+    def job(coords):
+        mol = Molecule()
+        for symbol, xyz in coords:
+            mol.add_atom(Atom(symbol=symbol, coords=xyz))
+        ret = TrivialJob(name='fuzzy', molecule=mol)
+        ret.settings.input.value = 1
+        return ret
+
+    water = [('O', (0, 0, 0.000351)), ('H', (0.76, 0.59, 0)), ('H', (-0.76, 0.59, 0))]
+    jobs = [job(water),
+            job([('O', (0, 0, 0.000349)), ('H', (0.76001, 0.58999, 0)), water[2]]),
+            job([('O', (0, 0, 0)), water[1], water[2]]),
+            job(water[:2] + [('H', (-0.76, 0.59, 0.001))]),
+            job([water[1], water[0], water[2]])]
+    assert jobs[0].hash() != jobs[1].hash()
+    assert jobs[0].fuzzy_fingerprint()[0] == jobs[1].fuzzy_fingerprint()[0] == jobs[3].fuzzy_fingerprint()[0] != jobs[4].fuzzy_fingerprint()[0]
+    for j in jobs:
+        j.run().wait()
+    assert [j.status for j in jobs] == ['successful', 'copied', 'successful', 'successful', 'successful']
+    grid = config.default_jobmanager.fuzzy[jobs[0].fuzzy_fingerprint()[0]]
+    assert sum(len(entries) for entries in grid.values()) == 3 and len(grid) > 1
+
+    jm = JobManager(config.default_jobmanager.settings, path=str(tmp_path), folder='fuzzy_lazy')
+    load_all(config.default_jobmanager.workdir, jobmanager=jm, lazy=True)
+    again = job([water[0], ('H', (0.76006, 0.59, 0)), water[2]])
+    again.run(jobmanager=jm).wait()
+    assert again.status == 'copied'
+    finish([jm])
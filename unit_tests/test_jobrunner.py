@@ -0,0 +1,356 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+from scm.plams import SingleJob, MultiJob, JobRunner, AsyncJobRunner, SlotRunner, GridRunner, AsyncGridRunner, PilotRunner, Settings, config, init, finish
+
+
+class TrivialJob(SingleJob):
+    def get_input(self):
+        return 'seed {}\n'.format(self.settings.input.seed)
+
+    def get_runscript(self):
+        return 'true\n'
+
+
+@pytest.fixture
+def plams_env(tmp_path):
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    config.jobmanager.hashing = False
+    yield
+    finish()
+
+
+def test_pool(plams_env):
+    """Test :class:`JobRunner` with a worker pool."""
+    jr = JobRunner(parallel=True, maxjobs=2, maxthreads=2)
+    children = [MultiJob(name='inner', children=[TrivialJob(name='leaf') for i in range(4)]) for j in range(3)]
+    jobs = [TrivialJob(name='single') for i in range(10)] + [MultiJob(name='outer', children=children)]
+    for job in jobs:
+        job.run(jobrunner=jr)
+    assert all(job.ok() for job in jobs)
+    assert jr.pool._workers <= 2
+
+
+def test_async(plams_env):
+    """Test :meth:`Job.arun` with :class:`AsyncJobRunner`."""
+    jr = AsyncJobRunner(maxjobs=4)
+    singles = [TrivialJob(name='single') for i in range(20)]
+    multi = MultiJob(name='outer', children=[TrivialJob(name='leaf') for i in range(5)])
+    waiting = TrivialJob(name='waiting')
+
+    async def main():
+        waiter = asyncio.ensure_future(waiting.results.await_done())
+        results = await asyncio.gather(*[job.arun(jobrunner=jr) for job in singles + [multi]])
+        await waiting.arun(jobrunner=jr)
+        await waiter
+        return results
+
+    results = asyncio.run(main())
+    assert all(job.ok() for job in singles + [multi, waiting])
+    assert [r.job for r in results] == singles + [multi]
+
+
+class RestartJob(TrivialJob):
+    def get_input(self):
+        return 'restart {}\n'.format(len(self.settings.input.restart.grep_output('')))
+
+
+def test_async_implicit_dependency(plams_env):
+    """Test that :class:`AsyncJobRunner` awaits dependencies present in the ``input`` branch of settings."""
+    jr = AsyncJobRunner()
+    head = TrivialJob(name='head')
+    tail = RestartJob(name='tail')
+    tail.settings.input.restart = head.results
+
+    async def main():
+        await asyncio.gather(tail.arun(jobrunner=jr), head.arun(jobrunner=jr))
+
+    thread = threading.Thread(target=asyncio.run, args=(main(),), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive()
+    assert head.ok() and tail.ok()
+
+
+class EnvJob(TrivialJob):
+    def get_runscript(self):
+        return 'echo $NSCM $OMP_NUM_THREADS\n'
+
+
+def test_slots(plams_env):
+    """Test :class:`SlotRunner`."""
+    jr = SlotRunner(ncores=4)
+    jobs = [EnvJob(name='env') for i in range(6)]
+    for i, job in enumerate(jobs):
+        if i % 2:
+            job.settings.runscript.nproc = 3
+    jobs.append(EnvJob(name='huge'))
+    jobs[-1].settings.runscript.nproc = 100
+    for job in jobs:
+        job.run(jobrunner=jr)
+    nprocs = [job.results.grep_output('')[0] for job in jobs]
+    assert nprocs == ['1 1', '3 3'] * 3 + ['4 4']
+    assert jr.free == 4
+
+
+def test_critical_path(plams_env):
+    """Test :meth:`Job.dependencies` and scheduling with ``scheduling='critical_path'``."""
+    order = []
+
+    class RecordingRunner(JobRunner):
+        def call(self, runscript, workdir, out, err, runflags):
+            order.append(runscript)
+            return JobRunner.call(self, runscript, workdir, out, err, runflags)
+
+    class SleepJob(TrivialJob):
+        def get_runscript(self):
+            return 'sleep 0.5\n'
+
+    jr = RecordingRunner(parallel=True, maxjobs=1, scheduling='critical_path')
+    blocker = SleepJob(name='blocker')
+    blocker.run(jobrunner=jr)
+    while not order: #make sure the blocker holds the only slot
+        time.sleep(0.01)
+    short = [TrivialJob(name='short{}'.format(i)) for i in range(3)]
+    head = TrivialJob(name='head')
+    tail = TrivialJob(name='tail')
+    tail.settings.input.restart = head.results
+    assert tail.dependencies() == [head]
+    for job in short + [head, tail]:
+        job.run(jobrunner=jr)
+    assert jr.graph.critical_path(head) == 2
+    assert jr.graph.critical_path(short[0]) == 1
+    assert all(job.ok() for job in short + [head, tail])
+    assert order[:2] == ['blocker.run', 'head.run']
+
+
+FAKE_SUBMIT = '''#!{python}
+import os, subprocess, sys
+with open(os.path.join(os.path.dirname(__file__), 'submitted'), 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+tasks = [a for a in sys.argv if a.startswith('--array=')]
+last = int(tasks[0].split('-')[-1]) if tasks else 0
+for i in range(last + 1):
+    subprocess.run([sys.argv[-1]], env=dict(os.environ, TASKID=str(i)))
+print('Submitted batch job 42')
+'''
+
+
+class FailingJob(TrivialJob):
+    def get_runscript(self):
+        return 'exit 3\n'
+
+
+def fake_grid(tmp_path):
+    """Return |GridRunner| settings for a fake queueing system executing submitted job arrays on the spot."""
+    submit = tmp_path / 'fakesubmit'
+    submit.write_text(FAKE_SUBMIT.format(python=sys.executable))
+    submit.chmod(0o755)
+    grid = Settings()
+    grid.workdir = '-D'
+    grid.output = '-o'
+    grid.error = '-e'
+    grid.commands.submit = str(submit)
+    grid.commands.check = 'true'
+    grid.commands.getid = lambda output: output.split()[-1]
+    grid.commands.running = lambda output: []
+    grid.array.flag = '--array='
+    grid.array.taskid = 'TASKID'
+    return grid
+
+
+def test_array_batching(plams_env, tmp_path):
+    """Test submitting jobs as job arrays with :class:`GridRunner`."""
+    gr = GridRunner(grid=fake_grid(tmp_path), sleepstep=0.1, batch_window=0.5)
+    jobs = [TrivialJob(name='ok') for i in range(4)] + [FailingJob(name='bad')]
+    for job in jobs:
+        job.run(jobrunner=gr)
+    assert [job.ok() for job in jobs] == [True] * 4 + [False]
+    assert jobs[-1].status == 'crashed'
+    assert len((tmp_path / 'submitted').read_text().splitlines()) == 1
+
+
+BACKGROUND_SUBMIT = '''#!{python}
+import os, subprocess, sys
+os.chdir(sys.argv[sys.argv.index('-D') + 1])
+out = open(sys.argv[sys.argv.index('-o') + 1], 'w')
+here = os.path.dirname(__file__)
+p = subprocess.Popen(['sh', '-c', '"$0"; echo $? >"$1/$$.exit"', sys.argv[-1], here], stdout=out, stderr=subprocess.STDOUT, start_new_session=True)
+with open(os.path.join(here, 'pids'), 'a') as f:
+    f.write('{{}}\\n'.format(p.pid))
+print('Submitted batch job {{}}'.format(p.pid))
+'''
+
+BACKGROUND_CHECK = '''#!{python}
+import os, sys
+with open(os.path.join(os.path.dirname(__file__), 'queries'), 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+for pid in open(os.path.join(os.path.dirname(__file__), 'pids')).read().split():
+    try:
+        os.kill(int(pid), 0)
+        print(pid)
+    except OSError:
+        pass
+'''
+
+
+BACKGROUND_ACCOUNTING = '''#!{python}
+import os, sys
+exitfile = os.path.join(os.path.dirname(__file__), sys.argv[-1] + '.exit')
+if os.path.isfile(exitfile):
+    code = open(exitfile).read().strip()
+    print('{{0}}:0|5|00:02.000|\\n{{0}}:0|5|00:01.500|2048K'.format(code))
+'''
+
+
+def background_grid(tmp_path):
+    """Return |GridRunner| settings for a fake queueing system executing submitted scripts as background processes with process IDs used as job IDs."""
+    grid = fake_grid(tmp_path)
+    for name, text in [('fakesubmit', BACKGROUND_SUBMIT), ('fakecheck', BACKGROUND_CHECK), ('fakeacct', BACKGROUND_ACCOUNTING)]:
+        script = tmp_path / name
+        script.write_text(text.format(python=sys.executable))
+        script.chmod(0o755)
+    (tmp_path / 'pids').write_text('')
+    grid.commands.submit = str(tmp_path / 'fakesubmit')
+    grid.commands.check = str(tmp_path / 'fakecheck')
+    grid.commands.running = lambda output: output.split()
+    return grid
+
+
+def test_poller(plams_env, tmp_path):
+    """Test the queue poller shared by :class:`GridRunner` instances, with waiting for queued jobs in :class:`AsyncGridRunner`."""
+    grid = background_grid(tmp_path)
+    grid.commands.query = grid.commands.check + ' {jobids}'
+    runners = [GridRunner(grid=grid, sleepstep=0.2) for i in range(2)]
+    jobs = [TrivialJob(name='ok') for i in range(6)]
+    for i, job in enumerate(jobs):
+        job.run(jobrunner=runners[i%2])
+    assert all(job.ok() for job in jobs)
+
+    async_jobs = [TrivialJob(name='async') for i in range(4)]
+    async def main():
+        ar = AsyncGridRunner(grid=grid, sleepstep=0.2)
+        await asyncio.gather(*[job.arun(jobrunner=ar) for job in async_jobs])
+    asyncio.run(main())
+    assert all(job.ok() for job in async_jobs)
+
+    submitted = set((tmp_path / 'pids').read_text().split())
+    queries = (tmp_path / 'queries').read_text().splitlines()
+    assert all(set(q.split(',')) <= submitted for q in queries)
+    assert len(queries) < 2 * len(submitted)
+
+    scheduled = TrivialJob(name='scheduled')
+    async def schedule():
+        scheduled.run(jobrunner=AsyncGridRunner(grid=grid, sleepstep=0.2))
+        await scheduled.results.await_done()
+    asyncio.run(schedule())
+    assert scheduled.ok()
+
+
+def test_poller_errors(plams_env, tmp_path):
+    """Test that the queue poller survives errors raised while querying the queue."""
+    grid = background_grid(tmp_path)
+    calls = []
+    def running(output):
+        calls.append(output)
+        if len(calls) == 1:
+            raise ValueError('broken output')
+        return output.split()
+    grid.commands.running = running
+    gr = GridRunner(grid=grid, sleepstep=0.1)
+    jobs = [TrivialJob(name='ok') for i in range(2)]
+    for job in jobs:
+        job.run(jobrunner=gr)
+    assert all(job.ok() for job in jobs)
+    assert len(calls) > 1
+
+
+def test_accounting(plams_env, tmp_path):
+    """Test obtaining exit codes and resource usage of jobs submitted by :class:`GridRunner` with an accounting command."""
+    grid = background_grid(tmp_path)
+    grid.commands.accounting = str(tmp_path / 'fakeacct') + ' -j {jobid}'
+    grid.commands.usage = config.gridrunner.slurm.commands.usage
+    gr = GridRunner(grid=grid, sleepstep=0.1)
+    jobs = [TrivialJob(name='ok'), FailingJob(name='bad')]
+    for job in jobs:
+        job.run(jobrunner=gr)
+    for job in jobs:
+        job.results.wait()
+    assert [job.status for job in jobs] == ['successful', 'crashed']
+    assert [job.usage.exitcode for job in jobs] == [0, 3]
+    assert jobs[0].usage.walltime == 5 and jobs[0].usage.cputime == 2 and jobs[0].usage.maxrss == 2
+
+
+def test_pilots(plams_env, tmp_path):
+    """Test executing jobs inside pilot jobs with :class:`PilotRunner`."""
+    pr = PilotRunner(grid=background_grid(tmp_path), pilots=2, slots=2, idle=2, sleepstep=0.1)
+    jobs = [TrivialJob(name='ok') for i in range(6)] + [FailingJob(name='bad')]
+    for job in jobs:
+        job.run(jobrunner=pr)
+    assert [job.ok() for job in jobs] == [True] * 6 + [False]
+    assert len((tmp_path / 'pids').read_text().split()) == 2
+    pr.stop()
+
+
+def test_pilots_maxjobs(plams_env, tmp_path):
+    """Test limiting the number of runscripts executed at the same time by :class:`PilotRunner` with *maxjobs*."""
+    pr = PilotRunner(grid=background_grid(tmp_path), pilots=1, slots=2, idle=2, sleepstep=0.1, maxjobs=1)
+    jobs = [TrivialJob(name='ok') for i in range(3)]
+    for job in jobs:
+        job.run(jobrunner=pr)
+    thread = threading.Thread(target=lambda: [job.ok() for job in jobs], daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive()
+    assert all(job.ok() for job in jobs)
+    pr.stop()
+
+
+def test_trace(tmp_path, monkeypatch):
+    """Test tracing of the job life cycle with ``config.trace``."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    config.jobmanager.hashing = False
+    monkeypatch.setitem(config, 'trace', True)
+    jr = JobRunner(parallel=True, maxjobs=2)
+    jobs = [TrivialJob(name='traced') for i in range(4)] + [MultiJob(name='multi', children=[TrivialJob(name='child') for i in range(2)])]
+    for job in jobs:
+        job.run(jobrunner=jr)
+    assert all(job.ok() for job in jobs)
+    finish()
+    with open(config.default_jobmanager.workdir + '/trace.json') as f:
+        events = json.load(f)['traceEvents']
+    names = {e['args']['name'] for e in events if e['ph'] == 'M'}
+    phases = {e['name'] for e in events if e['ph'] == 'X'}
+    assert len(names) == 7
+    assert {'pending', 'register', 'prerun', 'hash', 'get_ready', 'call', 'collect', 'check', 'postrun', 'pickle'} <= phases
+    assert all(e['dur'] >= 0 for e in events if e['ph'] == 'X')
+
+
+class PostrunJob(TrivialJob):
+    def get_runscript(self):
+        return 'echo postrun\n'
+
+    def check(self):
+        return self.results.grep_output('postrun') == ['postrun']
+
+    def postrun(self):
+        self.seen = self.status, self.results.grep_output('postrun')
+
+
+def test_privileged_access(plams_env):
+    """Test using |Results| of a finished job in its own :meth:`check` and |postrun|, in parallel and asynchronously."""
+    jobs = [PostrunJob(name='postrun') for i in range(4)]
+    for job in jobs[:2]:
+        job.run(jobrunner=JobRunner(parallel=True))
+    async def main():
+        await asyncio.gather(*[job.arun(jobrunner=AsyncJobRunner()) for job in jobs[2:]])
+    asyncio.run(main())
+    assert all(job.ok() for job in jobs)
+    assert all(job.seen == ('finished', ['postrun']) for job in jobs)
@@ -0,0 +1,44 @@
+import json
+import threading
+
+from scm.plams import SingleJob, config, init, finish, log
+
+
+class TrivialJob(SingleJob):
+    def get_input(self):
+        return ''
+
+    def get_runscript(self):
+        return 'true\n'
+
+
+def test_log(tmp_path):
+    """Test writing the logfile from many threads, in the text and in the JSON lines format."""
+    init(path=str(tmp_path), folder='text')
+    config.log.stdout = 0
+    config.log.file = 7
+    threads = [threading.Thread(target=lambda i=i: [log('message {} {}'.format(i, j), 7) for j in range(200)]) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finish()
+    with open(config.default_jobmanager.logfile) as f:
+        lines = [line for line in f.read().splitlines() if ' message ' in line]
+    assert len(lines) == 1600
+    first = [int(line.split()[-1]) for line in lines if ' message 0 ' in line]
+    assert first == list(range(200))
+
+    init(path=str(tmp_path), folder='json')
+    config.log.stdout = 0
+    config.log.json = True
+    TrivialJob(name='trivial').run()
+    finish()
+    with open(config.default_jobmanager.logfile) as f:
+        entries = [json.loads(line) for line in f if line.startswith('{')] #messages logged by init() precede the change of the format
+    assert all({'time', 'level', 'message'} <= set(entry) for entry in entries)
+    statuses = [e for e in entries if e.get('job') == 'trivial']
+    assert statuses[-1]['status'] == 'successful'
+    assert 'phase' not in statuses[0]
+    assert [e['phase'] for e in statuses[1:]] == [e['status'] for e in statuses[:-1]]
+    assert all(isinstance(e['duration'], float) and e['duration'] >= 0 for e in statuses[1:])
@@ -0,0 +1,196 @@
+import os
+
+from scm.plams import SingleJob, MultiJob, JobManager, KFFile, config, init, finish
+from scm.plams.interfaces.adfsuite.scmjob import SCMResults
+
+
+class TrivialJob(SingleJob):
+    def get_input(self):
+        return 'value {}'.format(self.settings.input.value)
+
+    def get_runscript(self):
+        return 'echo done\n'
+
+
+def test_results_refresh(tmp_path, monkeypatch):
+    """Test skipping the traversal of unchanged job folders in :meth:`Results.refresh`."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    job = TrivialJob(name='files')
+    job.settings.input.value = 1
+    job.run().wait()
+    os.mkdir(os.path.join(job.path, 'sub'))
+    for i in range(100):
+        with open(os.path.join(job.path, 'sub', 'frame{}.xyz'.format(i)), 'w') as f:
+            f.write('0\n\n')
+    for folder in [job.path, os.path.join(job.path, 'sub')]:
+        os.utime(folder, ns=(10**18, 10**18))
+    job.results.refresh()
+    assert len(job.results.files) == 104 and os.path.join('sub', 'frame7.xyz') in job.results.files
+
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: scans.append(path) or scandir(path))
+    job.results.refresh()
+    assert scans == []
+    job.results.rename('sub/frame0.xyz', 'sub/first.xyz')
+    assert job.results['sub/first.xyz'] and 'sub/frame0.xyz' not in job.results.files
+    job.results.refresh()
+    assert len(scans) == 2 and len(job.results.files) == 104
+    finish()
+
+
+def test_search_file(tmp_path, monkeypatch):
+    """Test in-process search of files with :meth:`Results.search_file` and the ``grep`` shortcut."""
+    from scm.plams.core import results
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    job = TrivialJob(name='search')
+    job.settings.input.value = 1
+    job.run().wait()
+    with open(os.path.join(job.path, 'data.txt'), 'w') as f:
+        f.write('Energy: -1.5\r\nGeometry\n  Energy: -2.0 (final)\n\nBond order\nlast Energy')
+    job.results.refresh()
+    found = job.results.search_file('data.txt', ['Energy', 'Bond', 'missing'])
+    assert [(m.lineno, m.line) for m in found['Energy']] == [(1, 'Energy: -1.5'), (3, '  Energy: -2.0 (final)'), (6, 'last Energy')]
+    assert found['Bond'] == [(5, 47, 'Bond order')] and found['missing'] == []
+    assert job.results.search_file('data.txt', [r'^\s+Energy: (\S+)'], regex=True)[r'^\s+Energy: (\S+)'][0].lineno == 3
+    for pattern in ['Energy: -', 'order', 'nothing']:
+        assert job.results.grep_file('data.txt', pattern) == job.results.grep_file('data.txt', pattern, '-a')
+
+    with open(os.path.join(job.path, 'data.txt'), 'a') as f:
+        f.write('\nBond length\n')
+    assert [m.line for m in job.results.search_file('data.txt', ['Bond'])['Bond']] == ['Bond order', 'Bond length']
+    assert len(job.results.search_file('data.txt', [''])['']) == 7
+    assert results._search_cache.get(job.results['data.txt'], results._stamp(job.results['data.txt']), [('', False)]) == {}
+
+    cache = results._SearchCache()
+    monkeypatch.setattr(cache, 'maxbytes', 300)
+    match = [results.FileMatch(1, 0, 'x' * 100)]
+    cache.put('a', 1, {('x', False): match})
+    cache.put('b', 1, {('x', False): match})
+    cache.put('c', 1, {('y', False): match * 3})
+    assert cache.get('a', 1, [('x', False)]) == {} and cache.get('b', 1, [('x', False)]) == {('x', False): match}
+    assert cache.get('c', 1, [('y', False)]) == {} and cache._bytes <= 300
+    finish()
+
+
+def test_file_chunks(tmp_path, monkeypatch):
+    """Test extraction of chunks of files with the cached index of delimiters."""
+    from scm.plams.core import results
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    job = TrivialJob(name='chunks')
+    job.settings.input.value = 1
+    job.run().wait()
+    with open(os.path.join(job.path, 'data.txt'), 'w') as f:
+        for i in range(1, 4):
+            f.write('Step {}\r\nBEGIN\n{}\n{}\nEND\n'.format(i, i, i*i))
+    job.results.refresh()
+    r = job.results
+    assert r.get_file_chunk('data.txt', 'BEGIN', 'END') == ['1', '1', '2', '4', '3', '9']
+    assert r.get_file_chunk('data.txt', 'BEGIN', 'END', match=2, inc_begin=True, inc_end=True) == ['BEGIN', '2', '4', 'END']
+    assert r.get_file_chunk('data.txt', end='Step 2', process=len) == [6, 5, 1, 1, 3]
+
+    searches = []
+    put = results._search_cache.put
+    monkeypatch.setattr(results._search_cache, 'put', lambda *args: searches.append(args[2].keys()) or put(*args))
+    assert r.get_file_chunk('data.txt', 'BEGIN', 'END', match=3, process=int) == [3, 9]
+    assert list(r.iter_file_chunks('data.txt', 'END', 'Step')) == [[], [], []]
+    assert list(r.iter_file_chunks('data.txt', 'Step', 'BEGIN', inc_begin=True)) == [['Step 1'], ['Step 2'], ['Step 3']]
+    assert len(searches) == 1
+    with open(os.path.join(job.path, 'data.txt'), 'a') as f:
+        f.write('BEGIN\nlast\n')
+    assert list(r.iter_file_chunks('data.txt', 'BEGIN', 'END')) == [['1', '1'], ['2', '4'], ['3', '9'], ['last']]
+    assert len(searches) == 2
+    finish()
+
+
+def test_clean(tmp_path):
+    """Test cleaning of job folders with keep/save patterns and removal of empty directories in :func:`finish`."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    config.jobmanager.clean_threads = 4
+    children = [TrivialJob(name='child{}'.format(i)) for i in range(1, 12)]
+    for i, child in enumerate(children):
+        child.settings.input.value = i
+        child.settings.save = 'all'
+    multi = MultiJob(name='multi', children=children)
+    multi.settings.save = ['$CH/$CH.in', '$CH/$CH*.out', '$CH/keep/*']
+    single = TrivialJob(name='single')
+    single.settings.input.value = 'x'
+    single.settings.save = ['-', '$JN.run', '.*']
+    multi.run()
+    single.run().wait()
+    for job in [children[0], children[10], single]:
+        for name in ['keep/a', 'drop/a', 'drop/b/c', '.hidden']:
+            os.makedirs(os.path.join(job.path, os.path.dirname(name)), exist_ok=True)
+            open(os.path.join(job.path, name), 'w').close()
+    multi.results.refresh()
+    single.results.refresh()
+    workdir = config.default_jobmanager.workdir
+    finish()
+
+    assert sorted(os.listdir(children[0].path)) == ['child1.dill', 'child1.dill.json', 'child1.in', 'child1.out', 'keep']
+    assert sorted(os.listdir(children[10].path)) == ['child11.dill', 'child11.dill.json', 'child11.in', 'child11.out', 'keep']
+    assert sorted(os.listdir(single.path)) == ['drop', 'keep', 'single.dill', 'single.dill.json', 'single.err', 'single.in', 'single.out']
+    assert os.path.isdir(workdir)
+
+
+def test_copy_results(tmp_path, monkeypatch):
+    """Test transferring files of previously run jobs by the rerun prevention, also in parallel and lazily."""
+    from scm.plams.core import results
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    monkeypatch.setattr(results._Transfer, 'large', 10)
+    jobs = [TrivialJob(name='job') for i in range(3)]
+    for i, job in enumerate(jobs):
+        job.settings.input.value = 1
+        job.settings.link_files = False
+        job.settings.lazy_copy = (i == 2)
+        job.settings.save = ['$JN.in', '$JN.out']
+        job.run().wait()
+    assert [job.status for job in jobs] == ['successful', 'copied', 'copied']
+    eager, lazy = jobs[1], jobs[2]
+    assert sorted(os.listdir(eager.path)) == ['job.002.dill', 'job.002.dill.json', 'job.002.err', 'job.002.in', 'job.002.out', 'job.002.run']
+    assert os.stat(eager.results['$JN.out']).st_ino != os.stat(jobs[0].results['$JN.out']).st_ino
+    assert not os.path.exists(os.path.join(lazy.path, 'job.003.out'))
+
+    lazy.results.refresh()
+    assert sorted(lazy.results.files) == ['job.003.err', 'job.003.in', 'job.003.out', 'job.003.run']
+    assert lazy.results.grep_output('done') == eager.results.grep_output('done')
+    lazy.results.rename('$JN.run', 'runscript')
+    assert sorted(os.listdir(lazy.path)) == ['job.003.dill', 'job.003.dill.json', 'job.003.out']
+    loaded = JobManager(config.jobmanager, path=str(tmp_path)).load_job(os.path.join(lazy.path, 'job.003.dill'))
+    assert loaded.results.files == ['job.003.out'] and not hasattr(loaded.results, '_pending')
+    finish()
+    assert sorted(os.listdir(lazy.path)) == ['job.003.dill', 'job.003.dill.json', 'job.003.in', 'job.003.out']
+
+
+class KFResults(SCMResults):
+    _kfext = '.kf'
+
+
+class KFJob(SingleJob):
+    _result_type = KFResults
+
+    def get_input(self):
+        return ''
+
+    def get_runscript(self):
+        return 'head -c 128 /dev/zero > {}.kf\n'.format(self.name)
+
+
+def test_copy_scm_results(tmp_path):
+    """Test that KF files exported by :meth:`SCMResults._export_attribute` are present in the new job folder, also with ``lazy_copy``."""
+    init(path=str(tmp_path))
+    config.log.stdout = 0
+    jobs = [KFJob(name='scm') for i in range(2)]
+    for job in jobs:
+        job.settings.lazy_copy = True
+        job.run().wait()
+    assert [job.status for job in jobs] == ['successful', 'copied']
+    copied = jobs[1].results
+    assert isinstance(copied._kf, KFFile) and copied._kf.path == os.path.join(jobs[1].path, 'scm.002.kf')
+    assert os.path.isfile(copied._kf.path) and not getattr(copied, '_pending', None)
+    finish()